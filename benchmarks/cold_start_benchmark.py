@@ -0,0 +1,111 @@
+"""
+Time-to-first-prediction of a fresh process , pickled .pth checkpoint vs memory mapped safetensors.
+
+Every run is a new Python process that imports the service , loads the model and predicts
+one image , so import , load and first forward costs are all included.
+Uses the real checkpoint when present , otherwise builds random weight artifacts in a temp folder.
+
+Usage : python -m benchmarks.cold_start_benchmark [--runs 5]
+"""
+
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import torch
+from src.constants import CHECKPOINT_PATH
+from src.api.weights import convert_checkpoint
+from benchmarks.common import build_random_model, fake_label_encoder
+
+
+# runs inside the fresh process , prints one JSON line with the timings
+CHILD_SCRIPT = '''
+import json , resource , sys , time
+start = time.perf_counter()
+import torch
+from src.api import model_loader
+from src.api.predictor import predict_batch
+imported = time.perf_counter()
+model_loader.load_model_safe(backend='torch', precision='fp32', optimize=False, weights_format=sys.argv[1])
+loaded = time.perf_counter()
+predict_batch(model_loader.model, model_loader.label_encoder, torch.zeros(1, 3, 224, 224), model_loader.device)
+predicted = time.perf_counter()
+print(json.dumps({
+    'import_s': imported - start,
+    'load_s': loaded - imported,
+    'first_forward_s': predicted - loaded,
+    'time_to_first_prediction_s': predicted - start,
+    'max_rss_mb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+}))
+'''
+
+
+
+def prepare_artifacts(folder):
+
+    """ Writes a .pth checkpoint and the matching safetensors + sidecar , returns the env pointing at them """
+
+    checkpoint_path = os.path.join(folder, 'checkpoint.pth')
+
+    if os.path.exists(CHECKPOINT_PATH):
+        from src.api import model_loader
+        model_loader.load_model_safe(backend='torch', precision='fp32', optimize=False, weights_format='pth')
+        model, label_encoder = model_loader.model.cpu(), model_loader.label_encoder
+        checkpoint_path = os.path.abspath(CHECKPOINT_PATH)
+    else:
+        print('No checkpoint available , using random weights')
+        model, label_encoder = build_random_model(), fake_label_encoder()
+        torch.save({'label_encoder': label_encoder, 'model_state_dict': model.state_dict()}, checkpoint_path)
+
+    weights_path, config_path = convert_checkpoint(
+        model, label_encoder.classes_,
+        os.path.join(folder, 'model.safetensors'), os.path.join(folder, 'model.json'),
+    )
+
+    env = dict(os.environ)
+    env.update({'CHECKPOINT_PATH': checkpoint_path, 'SAFETENSORS_PATH': weights_path, 'MODEL_CONFIG_PATH': config_path})
+    return env
+
+
+
+def run(runs):
+
+    report = {}
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        env = prepare_artifacts(tmp_dir)
+
+        for weights_format in ('pth', 'safetensors'):
+            samples = []
+            for _ in range(runs):
+                output = subprocess.run(
+                    [sys.executable, '-c', CHILD_SCRIPT, weights_format],
+                    env=env, capture_output=True, text=True, check=True,
+                )
+                samples.append(json.loads(output.stdout.strip().splitlines()[-1]))
+
+            report[weights_format] = {key: statistics.median(sample[key] for sample in samples) for key in samples[0]}
+            summary = report[weights_format]
+            print(f"{weights_format:>11} | first prediction {summary['time_to_first_prediction_s']:.2f} s "
+                  f"(import {summary['import_s']:.2f} , load {summary['load_s']:.2f} , forward {summary['first_forward_s']:.2f}) "
+                  f"| max rss {summary['max_rss_mb']:.0f} MB")
+
+    return report
+
+
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser(description='Measure time-to-first-prediction for both weight formats')
+    parser.add_argument('--runs', type=int, default=5)
+    parser.add_argument('--output', default=None, help='optional path to write the JSON report')
+    args = parser.parse_args()
+
+    results = run(args.runs)
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
@@ -0,0 +1,116 @@
+import io
+import time
+import statistics
+import numpy as np
+from PIL import Image
+
+
+def synthetic_image(width, height, seed=0):
+
+    """
+    Creates a smooth , skin toned test image with some noise , so JPEG / PNG
+    compression behaves roughly like it does on real lesion photos
+    """
+
+    rng = np.random.default_rng(seed)
+
+    y = np.linspace(0, 1, height, dtype=np.float32)[:, None]
+    x = np.linspace(0, 1, width, dtype=np.float32)[None, :]
+
+    # a dark blob in the middle on a skin coloured gradient
+    blob = np.exp(-(((x - 0.5) ** 2) + ((y - 0.5) ** 2)) / 0.02)
+    base = np.stack([
+        200 - 60 * blob + 20 * x,
+        150 - 70 * blob + 10 * y,
+        130 - 60 * blob,
+    ], axis=-1)
+
+    noise = rng.normal(0, 6, size=(height, width, 3))
+    pixels = np.clip(base + noise, 0, 255).astype(np.uint8)
+
+    return Image.fromarray(pixels, 'RGB')
+
+
+
+def encode_image(image, fmt='JPEG', quality=90):
+
+    """ Encodes a PIL image into upload-like bytes """
+
+    buffer = io.BytesIO()
+    if fmt == 'JPEG':
+        image.save(buffer, format=fmt, quality=quality)
+    else:
+        image.save(buffer, format=fmt)
+    return buffer.getvalue()
+
+
+
+def time_call(fn, repeat=20, warmup=2):
+
+    """ Calls fn repeatedly and returns latency statistics in milliseconds """
+
+    for _ in range(warmup):
+        fn()
+
+    samples = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        samples.append((time.perf_counter() - start) * 1000)
+
+    return summarize(samples)
+
+
+
+def summarize(samples):
+
+    """ Latency distribution summary (ms) of a list of samples """
+
+    ordered = sorted(samples)
+
+    def percentile(p):
+        index = min(len(ordered) - 1, int(round(p / 100 * (len(ordered) - 1))))
+        return ordered[index]
+
+    return {
+        'n': len(ordered),
+        'mean_ms': statistics.fmean(ordered),
+        'p50_ms': percentile(50),
+        'p90_ms': percentile(90),
+        'p99_ms': percentile(99),
+        'min_ms': ordered[0],
+        'max_ms': ordered[-1],
+    }
+
+
+
+# stand-in class names , the real ones live in the private checkpoint
+FAKE_CLASSES = [f'class_{i}' for i in range(10)]
+
+
+
+def build_random_model(num_classes=len(FAKE_CLASSES)):
+
+    """
+    Builds get_custom_efficientb3 with random weights (no checkpoint needed) in eval mode ,
+    with the LazyLinear already materialized by a dummy forward pass
+    """
+
+    import torch
+    from src.api.model_loader import get_custom_efficientb3
+
+    model = get_custom_efficientb3(num_classes=num_classes).cpu()
+    model.eval()
+    with torch.no_grad():
+        model(torch.zeros(1, 3, 224, 224))
+    return model
+
+
+
+def fake_label_encoder(classes=FAKE_CLASSES):
+
+    from sklearn.preprocessing import LabelEncoder
+
+    label_encoder = LabelEncoder()
+    label_encoder.fit(classes)
+    return label_encoder
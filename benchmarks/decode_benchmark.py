@@ -0,0 +1,81 @@
+"""
+Compares the full resolution decode path against reduced-on-decode (JPEG draft mode).
+
+Reports decode + preprocessing latency , the size of the decoded image (the peak pixel
+buffer held per request) and how far the final model input tensors diverge.
+
+Usage : python -m benchmarks.decode_benchmark [--repeat 20]
+"""
+
+import argparse
+import json
+from src.api.preprocess_image import decode_image, transformation
+from benchmarks.common import synthetic_image, encode_image, time_call
+
+
+# (width , height) of typical phone / dermatoscope uploads
+RESOLUTIONS = [(1024, 768), (2048, 1536), (4032, 3024), (6000, 4000)]
+
+
+
+def run(repeat):
+
+    report = []
+
+    for width, height in RESOLUTIONS:
+
+        content = encode_image(synthetic_image(width, height), 'JPEG', quality=92)
+
+        full_image = decode_image(content, draft=False)
+        draft_image = decode_image(content, draft=True)
+
+        full_tensor = transformation(full_image)
+        draft_tensor = transformation(draft_image)
+        diff = (full_tensor - draft_tensor).abs()
+
+        entry = {
+            'resolution': f'{width}x{height}',
+            'upload_bytes': len(content),
+            'full': {
+                'decoded_size': list(full_image.size),
+                'decoded_bytes': full_image.size[0] * full_image.size[1] * 3,
+                'decode_ms': time_call(lambda: decode_image(content, draft=False), repeat),
+                'decode_preprocess_ms': time_call(lambda: transformation(decode_image(content, draft=False)), repeat),
+            },
+            'draft': {
+                'decoded_size': list(draft_image.size),
+                'decoded_bytes': draft_image.size[0] * draft_image.size[1] * 3,
+                'decode_ms': time_call(lambda: decode_image(content, draft=True), repeat),
+                'decode_preprocess_ms': time_call(lambda: transformation(decode_image(content, draft=True)), repeat),
+            },
+            # divergence of the normalized (3,224,224) model inputs
+            'tensor_divergence': {
+                'max_abs': float(diff.max()),
+                'mean_abs': float(diff.mean()),
+            },
+        }
+
+        entry['speedup'] = entry['full']['decode_preprocess_ms']['p50_ms'] / entry['draft']['decode_preprocess_ms']['p50_ms']
+        report.append(entry)
+
+        print(f"{entry['resolution']:>10} | full {entry['full']['decode_preprocess_ms']['p50_ms']:8.2f} ms "
+              f"| draft {entry['draft']['decode_preprocess_ms']['p50_ms']:8.2f} ms "
+              f"| x{entry['speedup']:.1f} | decoded {entry['draft']['decoded_size']} "
+              f"| max |diff| {entry['tensor_divergence']['max_abs']:.4f} mean {entry['tensor_divergence']['mean_abs']:.4f}")
+
+    return report
+
+
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser(description='Benchmark reduced-on-decode against full decoding')
+    parser.add_argument('--repeat', type=int, default=20)
+    parser.add_argument('--output', default=None, help='optional path to write the JSON report')
+    args = parser.parse_args()
+
+    results = run(args.repeat)
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
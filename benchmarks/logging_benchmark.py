@@ -0,0 +1,141 @@
+"""
+Logging cost per request on the request path , before and after the async logging change.
+
+before : synchronous RotatingFileHandler + console handler at DEBUG , the ~10 eagerly formatted
+         f-string lines the prediction path used to write per request
+after  : queue handler with a background writer thread at INFO , per-stage lines at DEBUG with
+         lazy %-formatting (skipped) and one structured record per request
+
+Console output goes to /dev/null so the terminal does not dominate the numbers.
+
+Usage : python -m benchmarks.logging_benchmark [--requests 5000]
+"""
+
+import argparse
+import json
+import logging
+import os
+import queue
+import tempfile
+import time
+from logging.handlers import RotatingFileHandler, QueueListener
+from src.logger import DeferredQueueHandler
+
+
+FORMAT = '%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+
+# values logged by a typical request
+SIZE = (4032, 3024)
+SHAPE = (1, 3, 224, 224)
+TOP_3 = [('Melanocytic Nevi', 0.91234), ('Melanoma', 0.05121), ('Benign Keratosis', 0.01873)]
+
+
+
+def make_handlers(log_path, devnull):
+    formatter = logging.Formatter(FORMAT)
+    file_handler = RotatingFileHandler(log_path, maxBytes=5 * 1024 * 1024, backupCount=3)
+    console_handler = logging.StreamHandler(devnull)
+    for handler in (file_handler, console_handler):
+        handler.setFormatter(formatter)
+    return file_handler, console_handler
+
+
+
+def request_before(logger):
+    logger.info('Image preprocessing started.....')
+    logger.info(f'The size of image is {SIZE}')
+    logger.info(f'Image preprocessing completed , Final tensor shape : {SHAPE}')
+    logger.info('Starting image prediction...')
+    logger.info(f'Model outputs shape : {(1, 10)}')
+    logger.info(f'Predicted class  : {TOP_3[0][0]}')
+    logger.info(f'Confidence score :{TOP_3[0][1]}')
+    logger.info("Top 3 predictions:")
+    for class_name, prob in TOP_3:
+        logger.info(f"  {class_name}: {prob:.4f}")
+    logger.info(f'Prediction successful: {TOP_3[0][0]}')
+
+
+
+def request_after(logger):
+    logger.debug('Image preprocessing started.....')
+    logger.debug('The size of image is %s', SIZE)
+    logger.debug('Image preprocessing completed , Final tensor shape : %s', SHAPE)
+    logger.debug('Starting image prediction...')
+    logger.debug('Model outputs shape : %s', (1, 10))
+    logger.debug('Batch prediction done for %d image(s)', 1)
+    logger.info(
+        'event=prediction filename=%s bytes=%d class=%s confidence=%.4f cached=%s near_duplicate=%s model_version=%s latency_ms=%.1f',
+        'lesion.jpg', 3_500_000, TOP_3[0][0], TOP_3[0][1], False, False, 'abc123', 42.0,
+    )
+
+
+
+def measure(requests, request_fn, logger, drain=None):
+
+    """ Returns (us per request on the request path , us per request including draining the queue) """
+
+    start = time.perf_counter()
+    for _ in range(requests):
+        request_fn(logger)
+    request_path = time.perf_counter() - start
+
+    if drain is not None:
+        drain()
+    total = time.perf_counter() - start
+
+    return request_path / requests * 1e6, total / requests * 1e6
+
+
+
+def run(requests):
+
+    report = {}
+
+    with tempfile.TemporaryDirectory() as tmp_dir, open(os.devnull, 'w') as devnull:
+
+        # before : inline handlers at DEBUG
+        before = logging.getLogger('bench.before')
+        before.propagate = False
+        before.setLevel(logging.DEBUG)
+        for handler in make_handlers(os.path.join(tmp_dir, 'before.log'), devnull):
+            before.addHandler(handler)
+
+        path_us, total_us = measure(requests, request_before, before)
+        report['before'] = {'request_path_us': path_us, 'total_us': total_us}
+
+        # after : queue handler , writer thread , INFO
+        after = logging.getLogger('bench.after')
+        after.propagate = False
+        after.setLevel(logging.INFO)
+        log_queue = queue.SimpleQueue()
+        after.addHandler(DeferredQueueHandler(log_queue))
+        listener = QueueListener(log_queue, *make_handlers(os.path.join(tmp_dir, 'after.log'), devnull))
+        listener.start()
+
+        path_us, total_us = measure(requests, request_after, after, drain=listener.stop)
+        report['after'] = {'request_path_us': path_us, 'total_us': total_us}
+
+    report['requests'] = requests
+    report['request_path_speedup'] = report['before']['request_path_us'] / report['after']['request_path_us']
+
+    for name in ('before', 'after'):
+        print(f"{name:>6} | {report[name]['request_path_us']:8.1f} us / request on the request path "
+              f"| {report[name]['total_us']:8.1f} us / request including writes")
+    print(f"request path x{report['request_path_speedup']:.1f} faster")
+
+    return report
+
+
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser(description='Measure logging cost per request before and after async logging')
+    parser.add_argument('--requests', type=int, default=5000)
+    parser.add_argument('--output', default=None, help='optional path to write the JSON report')
+    args = parser.parse_args()
+
+    results = run(args.requests)
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
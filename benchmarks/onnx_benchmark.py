@@ -0,0 +1,99 @@
+"""
+Softmax parity and latency / throughput comparison between eager PyTorch and ONNX Runtime.
+
+Uses the real checkpoint when model_path/ has one , otherwise a randomly initialized
+get_custom_efficientb3. Exits non-zero if the softmax outputs drift past the tolerance.
+
+Usage : python -m benchmarks.onnx_benchmark [--batch-sizes 1 4 16] [--repeat 20]
+"""
+
+import argparse
+import json
+import os
+import sys
+import tempfile
+import torch
+from src.api import model_loader
+from src.api.onnx_backend import OnnxModel, export_onnx
+from benchmarks.common import build_random_model, fake_label_encoder, time_call
+
+
+# max abs difference allowed between torch and ONNX Runtime softmax probabilities
+SOFTMAX_TOLERANCE = 1e-4
+
+
+
+def load_reference_model():
+    try:
+        model_loader.load_model_safe(backend='torch', precision='fp32', optimize=False)
+        return model_loader.model.cpu(), model_loader.label_encoder.classes_
+    except Exception:
+        print('No checkpoint available , using random weights')
+        return build_random_model(), fake_label_encoder().classes_
+
+
+
+def run(batch_sizes, repeat):
+
+    model, classes = load_reference_model()
+    report = {'parity': {}, 'latency': []}
+    failed = False
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+
+        onnx_path = export_onnx(model, classes, os.path.join(tmp_dir, 'model.onnx'))
+        onnx_model = OnnxModel(onnx_path)
+
+        # parity on softmax outputs over a random batch
+        inputs = torch.randn(max(batch_sizes), 3, 224, 224)
+        with torch.no_grad():
+            torch_probs = torch.softmax(model(inputs), dim=1)
+        onnx_probs = torch.softmax(onnx_model(inputs), dim=1)
+
+        diff = (torch_probs - onnx_probs).abs()
+        report['parity'] = {
+            'max_abs': float(diff.max()),
+            'top1_agreement': float((torch_probs.argmax(1) == onnx_probs.argmax(1)).float().mean()),
+        }
+        failed = report['parity']['max_abs'] > SOFTMAX_TOLERANCE
+        print(f"softmax parity | max |diff| {report['parity']['max_abs']:.2e} "
+              f"| top-1 agreement {report['parity']['top1_agreement']:.3f} | {'FAILED' if failed else 'OK'}")
+
+        for batch_size in batch_sizes:
+            batch = torch.randn(batch_size, 3, 224, 224)
+
+            def torch_forward():
+                with torch.no_grad():
+                    model(batch)
+
+            entry = {
+                'batch_size': batch_size,
+                'torch': time_call(torch_forward, repeat),
+                'onnx': time_call(lambda: onnx_model(batch), repeat),
+            }
+            for backend in ('torch', 'onnx'):
+                entry[backend]['images_per_second'] = batch_size / (entry[backend]['mean_ms'] / 1000)
+            report['latency'].append(entry)
+
+            print(f"batch {batch_size:>3} | torch {entry['torch']['p50_ms']:8.2f} ms ({entry['torch']['images_per_second']:7.1f} img/s) "
+                  f"| onnx {entry['onnx']['p50_ms']:8.2f} ms ({entry['onnx']['images_per_second']:7.1f} img/s)")
+
+    return report, failed
+
+
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser(description='Compare eager PyTorch and ONNX Runtime inference')
+    parser.add_argument('--batch-sizes', type=int, nargs='+', default=[1, 4, 16])
+    parser.add_argument('--repeat', type=int, default=20)
+    parser.add_argument('--output', default=None, help='optional path to write the JSON report')
+    args = parser.parse_args()
+
+    results, parity_failed = run(args.batch_sizes, args.repeat)
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+
+    sys.exit(1 if parity_failed else 0)
@@ -0,0 +1,133 @@
+"""
+Parity check and per-stage timing of the 'pil' and 'tensor' preprocessing backends.
+
+The parity check compares the model input produced by the tensor backend against the
+existing transformation Compose and exits non-zero when it drifts past the tolerance.
+
+Usage : python -m benchmarks.preprocess_benchmark [--repeat 20] [--batch-size 16]
+"""
+
+import argparse
+import json
+import sys
+import numpy as np
+import torch
+from src.api.preprocess_image import (
+    transformation, decode_image, decode_to_uint8_tensor, resize_crop_uint8, normalize_batch,
+    RESIZE_SIZE, CROP_SIZE,
+)
+from torchvision import transforms
+from benchmarks.common import synthetic_image, encode_image, time_call
+
+
+# (width , height , format) of the synthetic uploads
+CASES = [(640, 480, 'JPEG'), (1920, 1080, 'JPEG'), (4032, 3024, 'JPEG'), (1024, 1024, 'PNG')]
+
+# max abs difference allowed on the normalized tensor , resampling filters differ slightly
+# between PIL and torch so the two paths are close but not bit identical
+PARITY_TOLERANCE = 0.1
+MEAN_TOLERANCE = 0.01
+
+resize_crop_pil = transforms.Compose([transforms.Resize(RESIZE_SIZE), transforms.CenterCrop(CROP_SIZE)])
+to_tensor_normalize = transforms.Compose(transformation.transforms[2:])
+
+
+
+def parity(content):
+
+    """ Divergence between the existing Compose and the tensor backend for one upload """
+
+    reference = transformation(decode_image(content, draft=False)).unsqueeze(0)
+    candidate = normalize_batch(resize_crop_uint8(decode_to_uint8_tensor(content)))
+
+    diff = (reference - candidate).abs()
+    return {'max_abs': float(diff.max()), 'mean_abs': float(diff.mean())}
+
+
+
+def stage_timings(content, repeat):
+
+    """ Per-stage latency of both backends for one upload """
+
+    pil_image = decode_image(content, draft=False)
+    pil_cropped = resize_crop_pil(pil_image)
+    uint8_image = decode_to_uint8_tensor(content)
+    uint8_cropped = resize_crop_uint8(uint8_image)
+
+    return {
+        'pil': {
+            'decode': time_call(lambda: decode_image(content, draft=False), repeat),
+            'resize_crop': time_call(lambda: resize_crop_pil(pil_image), repeat),
+            'to_tensor_normalize': time_call(lambda: to_tensor_normalize(pil_cropped), repeat),
+        },
+        'tensor': {
+            'decode': time_call(lambda: decode_to_uint8_tensor(content), repeat),
+            'resize_crop': time_call(lambda: resize_crop_uint8(uint8_image), repeat),
+            'to_tensor_normalize': time_call(lambda: normalize_batch(uint8_cropped), repeat),
+        },
+    }
+
+
+
+def batch_normalize_timings(batch_size, repeat):
+
+    """ ToTensor + Normalize over a whole batch : per image Compose vs one fused op """
+
+    image = synthetic_image(CROP_SIZE, CROP_SIZE)
+    uint8_batch = torch.from_numpy(np.asarray(image)).permute(2, 0, 1).unsqueeze(0).repeat(batch_size, 1, 1, 1)
+    images = [image] * batch_size
+
+    return {
+        'batch_size': batch_size,
+        'pil_per_image': time_call(lambda: torch.stack([to_tensor_normalize(im) for im in images]), repeat),
+        'tensor_fused': time_call(lambda: normalize_batch(uint8_batch), repeat),
+    }
+
+
+
+def run(repeat, batch_size):
+
+    report = {'cases': [], 'batch_normalize': batch_normalize_timings(batch_size, repeat)}
+    failed = False
+
+    for width, height, fmt in CASES:
+        content = encode_image(synthetic_image(width, height), fmt)
+
+        entry = {
+            'case': f'{width}x{height} {fmt}',
+            'parity': parity(content),
+            'stages': stage_timings(content, repeat),
+        }
+        report['cases'].append(entry)
+
+        ok = entry['parity']['max_abs'] <= PARITY_TOLERANCE and entry['parity']['mean_abs'] <= MEAN_TOLERANCE
+        failed = failed or not ok
+
+        total = {backend: sum(stage['p50_ms'] for stage in stages.values()) for backend, stages in entry['stages'].items()}
+        print(f"{entry['case']:>16} | pil {total['pil']:8.2f} ms | tensor {total['tensor']:8.2f} ms "
+              f"| max |diff| {entry['parity']['max_abs']:.4f} mean {entry['parity']['mean_abs']:.5f} "
+              f"| {'OK' if ok else 'PARITY FAILED'}")
+
+    normalize = report['batch_normalize']
+    print(f"normalize x{batch_size} | per image {normalize['pil_per_image']['p50_ms']:.2f} ms "
+          f"| fused {normalize['tensor_fused']['p50_ms']:.2f} ms")
+
+    return report, failed
+
+
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser(description='Compare the pil and tensor preprocessing backends')
+    parser.add_argument('--repeat', type=int, default=20)
+    parser.add_argument('--batch-size', type=int, default=16)
+    parser.add_argument('--output', default=None, help='optional path to write the JSON report')
+    args = parser.parse_args()
+
+    results, parity_failed = run(args.repeat, args.batch_size)
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+
+    sys.exit(1 if parity_failed else 0)
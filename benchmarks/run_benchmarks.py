@@ -0,0 +1,266 @@
+"""
+Self-contained benchmark suite for the inference pipeline , no checkpoint required.
+
+Builds get_custom_efficientb3 with random weights and synthetic uploads at several resolutions
+and formats , then reports :
+    - per-stage latency distributions (decode , preprocess , forward , postprocess , json) and end to end
+    - forward throughput across batch sizes and torch thread counts
+    - peak memory (process max RSS after each section , python heap peak per stage)
+Results are written as JSON so runs can be compared with --compare.
+
+Usage : python -m benchmarks.run_benchmarks [--quick] [--output results.json] [--compare baseline.json]
+"""
+
+import argparse
+import json
+import logging
+import os
+import platform
+import resource
+import time
+import tracemalloc
+from datetime import datetime
+import torch
+import torchvision
+
+try:
+    import orjson
+    ORJSON_AVAILABLE = True
+except ImportError:
+    ORJSON_AVAILABLE = False
+from src.api.preprocess_image import decode_image, apply_transformation, preprocess_bytes, normalize_batch
+from src.api.predictor import format_prediction, format_top_k, compact_prediction
+from benchmarks.common import (
+    synthetic_image, encode_image, time_call, build_random_model, fake_label_encoder,
+)
+
+
+# (width , height , format) of the synthetic uploads
+IMAGE_CASES = [
+    (640, 480, 'JPEG'),
+    (1920, 1080, 'JPEG'),
+    (4032, 3024, 'JPEG'),
+    (1024, 1024, 'PNG'),
+    (1024, 1024, 'WEBP'),
+]
+BATCH_SIZES = [1, 4, 8, 16, 32]
+
+QUICK_IMAGE_CASES = IMAGE_CASES[:2]
+QUICK_BATCH_SIZES = [1, 8]
+
+
+
+def max_rss_mb():
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+
+def python_heap_peak(fn):
+
+    """ Peak python heap allocation (MB) while running fn once , torch / PIL buffers are not included """
+
+    tracemalloc.start()
+    try:
+        fn()
+        return tracemalloc.get_traced_memory()[1] / (1024 * 1024)
+    finally:
+        tracemalloc.stop()
+
+
+
+def stage_latencies(model, classes, cases, repeat, backend):
+
+    """ Latency distribution of every stage of the /predict pipeline for each synthetic upload """
+
+    results = []
+
+    for width, height, fmt in cases:
+        content = encode_image(synthetic_image(width, height), fmt)
+
+        image = decode_image(content)
+        tensor = preprocess_bytes(content, 'cpu', backend)
+        batch = normalize_batch(tensor) if tensor.dtype == torch.uint8 else tensor
+
+        with torch.no_grad():
+            probs = torch.softmax(model(batch), dim=1).numpy()
+        prediction = format_prediction(probs[0], classes)
+        response = {'Success': True, 'prediction': prediction, 'filename': 'bench.jpg'}
+
+        # postprocess as predict_batch does it , one torch.topk over the batch
+        probs_tensor = torch.from_numpy(probs)
+
+        def postprocess_top_k(k):
+            values, indices = torch.topk(probs_tensor, k, dim=1)
+            return [format_top_k(v, i, classes) for v, i in zip(values.tolist(), indices.tolist())]
+
+        compact_response = {'Success': True, **compact_prediction(postprocess_top_k(3)[0]), 'filename': 'bench.jpg'}
+
+        def forward():
+            with torch.no_grad():
+                torch.softmax(model(batch), dim=1)
+
+        def end_to_end():
+            t = preprocess_bytes(content, 'cpu', backend)
+            b = normalize_batch(t) if t.dtype == torch.uint8 else t
+            with torch.no_grad():
+                p = torch.softmax(model(b), dim=1).numpy()
+            json.dumps({'Success': True, 'prediction': format_prediction(p[0], classes)})
+
+        stages = {
+            'decode': time_call(lambda: decode_image(content), repeat),
+            'preprocess': time_call(
+                (lambda: apply_transformation(image, 'cpu')) if backend == 'pil' else (lambda: preprocess_bytes(content, 'cpu', backend)),
+                repeat,
+            ),
+            'forward': time_call(forward, repeat),
+            'postprocess': time_call(lambda: format_prediction(probs[0], classes), repeat),
+            'postprocess_topk_all': time_call(lambda: postprocess_top_k(len(classes)), repeat),
+            'postprocess_top3': time_call(lambda: postprocess_top_k(3), repeat),
+            'json': time_call(lambda: json.dumps(response), repeat),
+            'end_to_end': time_call(end_to_end, repeat),
+        }
+
+        if ORJSON_AVAILABLE:
+            stages['json_orjson'] = time_call(lambda: orjson.dumps(response), repeat)
+            stages['json_orjson_compact_top3'] = time_call(lambda: orjson.dumps(compact_response), repeat)
+
+        results.append({
+            'case': f'{width}x{height} {fmt}',
+            'upload_bytes': len(content),
+            'preprocess_backend': backend,
+            'stages': stages,
+            'python_heap_peak_mb': {
+                'decode': python_heap_peak(lambda: decode_image(content)),
+                'end_to_end': python_heap_peak(end_to_end),
+            },
+        })
+
+        print(f"{results[-1]['case']:>16} | " + ' | '.join(f"{name} {stat['p50_ms']:.2f}" for name, stat in stages.items()) + ' (p50 ms)')
+
+    return results
+
+
+
+def throughput(model, batch_sizes, thread_counts, repeat):
+
+    """ Forward throughput (images / s) for every batch size and torch thread count """
+
+    results = []
+    original_threads = torch.get_num_threads()
+
+    try:
+        for threads in thread_counts:
+            torch.set_num_threads(threads)
+
+            for batch_size in batch_sizes:
+                batch = torch.randn(batch_size, 3, 224, 224)
+
+                def forward():
+                    with torch.no_grad():
+                        model(batch)
+
+                latency = time_call(forward, repeat)
+                entry = {
+                    'threads': threads,
+                    'batch_size': batch_size,
+                    'latency': latency,
+                    'images_per_second': batch_size / (latency['mean_ms'] / 1000),
+                }
+                results.append(entry)
+                print(f"threads {threads:>2} | batch {batch_size:>3} | {latency['p50_ms']:8.2f} ms | {entry['images_per_second']:8.1f} img/s")
+    finally:
+        torch.set_num_threads(original_threads)
+
+    return results
+
+
+
+def environment():
+    return {
+        'timestamp': datetime.now().isoformat(timespec='seconds'),
+        'python': platform.python_version(),
+        'torch': torch.__version__,
+        'torchvision': torchvision.__version__,
+        'platform': platform.platform(),
+        'cpu_count': os.cpu_count(),
+        'torch_threads': torch.get_num_threads(),
+    }
+
+
+
+def compare(current, baseline_path):
+
+    """ Prints p50 latency / throughput ratios of this run against an earlier JSON report """
+
+    with open(baseline_path) as f:
+        baseline = json.load(f)
+
+    print(f'\nComparison against {baseline_path} (current / baseline)')
+
+    baseline_stages = {entry['case']: entry['stages'] for entry in baseline.get('stages', [])}
+    for entry in current['stages']:
+        old = baseline_stages.get(entry['case'])
+        if old is None:
+            continue
+        ratios = {name: stat['p50_ms'] / old[name]['p50_ms'] for name, stat in entry['stages'].items() if name in old and old[name]['p50_ms'] > 0}
+        print(f"{entry['case']:>16} | " + ' | '.join(f'{name} x{ratio:.2f}' for name, ratio in ratios.items()))
+
+    baseline_throughput = {(e['threads'], e['batch_size']): e['images_per_second'] for e in baseline.get('throughput', [])}
+    for entry in current['throughput']:
+        old = baseline_throughput.get((entry['threads'], entry['batch_size']))
+        if old:
+            print(f"threads {entry['threads']:>2} | batch {entry['batch_size']:>3} | throughput x{entry['images_per_second'] / old:.2f}")
+
+
+
+def run(quick, backend, thread_counts):
+
+    repeat = 5 if quick else 30
+    cases = QUICK_IMAGE_CASES if quick else IMAGE_CASES
+    batch_sizes = QUICK_BATCH_SIZES if quick else BATCH_SIZES
+
+    start = time.perf_counter()
+    model = build_random_model()
+    classes = fake_label_encoder().classes_
+
+    report = {'environment': environment(), 'memory': {'after_model_build_max_rss_mb': max_rss_mb()}}
+
+    print('== per-stage latency')
+    report['stages'] = stage_latencies(model, classes, cases, repeat, backend)
+    report['memory']['after_stages_max_rss_mb'] = max_rss_mb()
+
+    print('== forward throughput')
+    report['throughput'] = throughput(model, batch_sizes, thread_counts, repeat)
+    report['memory']['after_throughput_max_rss_mb'] = max_rss_mb()
+
+    report['duration_s'] = time.perf_counter() - start
+    print(f"peak rss {report['memory']['after_throughput_max_rss_mb']:.0f} MB , took {report['duration_s']:.1f} s")
+
+    return report
+
+
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser(description='Benchmark the inference pipeline with random weights and synthetic images')
+    parser.add_argument('--quick', action='store_true', help='fewer repeats , images and batch sizes')
+    parser.add_argument('--backend', default='pil', choices=['pil', 'tensor'], help='preprocessing backend')
+    parser.add_argument('--threads', type=int, nargs='+', default=None, help='torch thread counts (default 1 and all cores)')
+    parser.add_argument('--output', default=None, help='path of the JSON report (default benchmarks/results/<timestamp>.json)')
+    parser.add_argument('--compare', default=None, help='earlier JSON report to compare against')
+    parser.add_argument('--log-level', default='WARNING', help='service log level while benchmarking')
+    args = parser.parse_args()
+
+    logging.getLogger().setLevel(args.log_level)
+
+    thread_counts = args.threads or sorted({1, torch.get_num_threads()})
+    results = run(args.quick, args.backend, thread_counts)
+
+    output = args.output or os.path.join('benchmarks', 'results', f"{datetime.now().strftime('%Y%m%d_%H%M%S')}.json")
+    os.makedirs(os.path.dirname(output) or '.', exist_ok=True)
+    with open(output, 'w') as f:
+        json.dump(results, f, indent=2)
+    print(f'Report written to {output}')
+
+    if args.compare:
+        compare(results, args.compare)
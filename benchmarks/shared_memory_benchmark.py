@@ -0,0 +1,83 @@
+"""
+Total memory of N workers holding the model at the same time , private .pth copies vs shared mapped weights.
+
+Starts N worker-like processes per mode , each loads the model and reports /proc/self/smaps_rollup while
+all of them are alive. The sum of Pss over the workers is the real footprint of the group.
+Uses the real checkpoint when present , otherwise random weight artifacts in a temp folder.
+
+Usage : python -m benchmarks.shared_memory_benchmark [--workers 4]
+"""
+
+import argparse
+import json
+import subprocess
+import sys
+import tempfile
+from benchmarks.cold_start_benchmark import prepare_artifacts
+
+
+# loads the model , reports its memory , then stays alive until the parent closes stdin
+CHILD_SCRIPT = '''
+import json , sys
+from src.api import model_loader
+from src.api.memory import process_memory
+model_loader.load_model_safe(backend='torch', precision='fp32', optimize=False, weights_format=sys.argv[1])
+print(json.dumps(process_memory()), flush=True)
+sys.stdin.read()
+'''
+
+
+
+def measure(weights_format, workers, env):
+
+    processes = [
+        subprocess.Popen(
+            [sys.executable, '-c', CHILD_SCRIPT, weights_format],
+            env=env, stdin=subprocess.PIPE, stdout=subprocess.PIPE, text=True,
+        )
+        for _ in range(workers)
+    ]
+
+    try:
+        reports = [json.loads(process.stdout.readline()) for process in processes]
+    finally:
+        for process in processes:
+            process.stdin.close()
+            process.wait()
+
+    return {
+        'workers': reports,
+        'total_rss_mb': sum(report.get('rss_mb', 0) for report in reports),
+        'total_pss_mb': sum(report.get('pss_mb', 0) for report in reports),
+    }
+
+
+
+def run(workers):
+
+    report = {}
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        env = prepare_artifacts(tmp_dir)
+
+        for weights_format in ('pth', 'safetensors'):
+            report[weights_format] = measure(weights_format, workers, env)
+            print(f"{weights_format:>11} | {workers} workers | total rss {report[weights_format]['total_rss_mb']:8.0f} MB "
+                  f"| total pss {report[weights_format]['total_pss_mb']:8.0f} MB")
+
+    return report
+
+
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser(description='Compare the memory of N workers with private vs shared weights')
+    parser.add_argument('--workers', type=int, default=4)
+    parser.add_argument('--output', default=None, help='optional path to write the JSON report')
+    args = parser.parse_args()
+
+    results = run(args.workers)
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
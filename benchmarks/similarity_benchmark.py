@@ -0,0 +1,141 @@
+"""
+Similar case search : latency and recall of the memory mapped index at 1M vectors ,
+flat (exact) against IVF at several nprobe values and vector storage types.
+Also checks that forward_with_embedding returns the same logits as the plain forward pass ,
+eager and optimized , so the embedding really comes for free with the prediction.
+
+The vectors are synthetic (clustered unit vectors , 512-d) and written to a temporary directory ,
+the 1M float32 run needs about 4 GB of free disk.
+
+Usage : python -m benchmarks.similarity_benchmark [--count 1000000] [--queries 200] [--k 10] [--output similarity.json]
+"""
+
+import argparse
+import json
+import os
+import tempfile
+import numpy as np
+import torch
+from src.api.embedding import EMBEDDING_DIM, forward_with_embedding
+from src.api.optimize import optimize_for_inference
+from src.api.similarity import SimilarityIndex, write_index, normalize_rows, auto_nlist
+from benchmarks.common import build_random_model, summarize, time_call
+
+
+NPROBES = (1, 4, 16, 64)
+DTYPES = ('float32', 'float16', 'int8')
+CLUSTERS = 2000
+
+
+
+def synthetic_embeddings(path, count, dim=EMBEDDING_DIM, seed=0, chunk=100000):
+
+    """ Unit vectors scattered around random cluster centers , written to a float32 memmap """
+
+    rng = np.random.default_rng(seed)
+    centers = normalize_rows(rng.standard_normal((CLUSTERS, dim)))
+
+    vectors = np.lib.format.open_memmap(path, mode='w+', dtype=np.float32, shape=(count, dim))
+    for start in range(0, count, chunk):
+        size = min(chunk, count - start)
+        noise = rng.standard_normal((size, dim)).astype(np.float32) * 0.04
+        vectors[start:start + size] = normalize_rows(centers[rng.integers(0, CLUSTERS, size)] + noise)
+
+    vectors.flush()
+    return vectors, centers
+
+
+
+def embedding_parity():
+
+    """ Max logit difference between model(x) and forward_with_embedding , eager and optimized """
+
+    model = build_random_model()
+    optimized = optimize_for_inference(model, 'cpu')
+    batch = torch.randn(4, 3, 224, 224, generator=torch.Generator().manual_seed(0))
+
+    with torch.no_grad():
+        logits = model(batch)
+        eager_logits, eager_embedding = forward_with_embedding(model, batch)
+        optimized_logits, optimized_embedding = forward_with_embedding(optimized, batch)
+
+    return {
+        'eager_logit_diff': float((logits - eager_logits).abs().max()),
+        'optimized_logit_diff': float((logits - optimized_logits).abs().max()),
+        'optimized_embedding_diff': float((eager_embedding - optimized_embedding).abs().max()),
+        'embedding_shape': list(eager_embedding.shape),
+    }
+
+
+
+def recall(found, exact):
+    return len(set(found) & set(exact)) / len(exact)
+
+
+
+def run(count, num_queries, k):
+
+    report = {'count': count, 'k': k, 'parity': embedding_parity(), 'indexes': []}
+    print(f"parity : {report['parity']}")
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        embeddings, centers = synthetic_embeddings(os.path.join(tmp_dir, 'raw.npy'), count)
+        labels = np.zeros(count, dtype=np.int16)
+        paths = [str(i) for i in range(count)]
+
+        # queries near the data , like an upload of a known condition
+        rng = np.random.default_rng(1)
+        queries = normalize_rows(centers[rng.integers(0, CLUSTERS, num_queries)] + rng.standard_normal((num_queries, EMBEDDING_DIM)) * 0.04)
+
+        flat = SimilarityIndex(_build(tmp_dir, 'flat', embeddings, labels, paths, 0, 'float32'))
+        exact = [[result['path'] for result in flat.search(query, k)] for query in queries]
+
+        report['indexes'].append(_measure(flat, 'flat float32', queries, k, exact))
+
+        nlist = auto_nlist(count)
+        for dtype in DTYPES:
+            index = SimilarityIndex(_build(tmp_dir, f'ivf_{dtype}', embeddings, labels, paths, nlist, dtype))
+            for nprobe in NPROBES:
+                report['indexes'].append(_measure(index, f'ivf{nlist} {dtype}', queries, k, exact, nprobe))
+
+    return report
+
+
+
+def _build(tmp_dir, name, embeddings, labels, paths, nlist, dtype):
+    index_dir = os.path.join(tmp_dir, name)
+    write_index(embeddings, labels, paths, ['reference'], index_dir, 'benchmark', nlist, dtype)
+    return index_dir
+
+
+
+def _measure(index, name, queries, k, exact, nprobe=None):
+
+    samples = []
+    recalls = []
+    for query, expected in zip(queries, exact):
+        latency = time_call(lambda: index.search(query, k, nprobe), repeat=1, warmup=0)
+        samples.append(latency['p50_ms'])
+        recalls.append(recall([result['path'] for result in index.search(query, k, nprobe)], expected))
+
+    row = {'index': name, 'nprobe': nprobe, 'latency': summarize(samples), 'recall': float(np.mean(recalls))}
+    print(f"{name:>20} | nprobe {str(nprobe):>4} | p50 {row['latency']['p50_ms']:8.3f} ms | "
+          f"p99 {row['latency']['p99_ms']:8.3f} ms | recall@{k} {row['recall']:.3f}")
+    return row
+
+
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser(description='Similar case index latency and recall , flat against IVF')
+    parser.add_argument('--count', type=int, default=1_000_000)
+    parser.add_argument('--queries', type=int, default=200)
+    parser.add_argument('--k', type=int, default=10)
+    parser.add_argument('--output', default=None, help='optional path to write the JSON report')
+    args = parser.parse_args()
+
+    results = run(args.count, args.queries, args.k)
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
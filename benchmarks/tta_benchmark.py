@@ -0,0 +1,64 @@
+"""
+Latency of test time augmentation : every view set run as one batched forward pass (predict_tta)
+against the naive loop calling predict_image once per view.
+
+Uses a randomly initialized get_custom_efficientb3 , latency does not depend on the weights.
+
+Usage : python -m benchmarks.tta_benchmark [--repeat 10] [--output tta.json]
+"""
+
+import argparse
+import json
+import torch
+from src.api.predictor import predict_image
+from src.api.tta import TTA_VIEWS, augment, predict_tta
+from benchmarks.common import build_random_model, fake_label_encoder, time_call
+
+
+
+def run(repeat):
+
+    model = build_random_model()
+    label_encoder = fake_label_encoder()
+    image = torch.randn(1, 3, 224, 224)
+
+    single = time_call(lambda: predict_image(model, label_encoder, image, 'cpu'), repeat)
+    report = {'single_view': single, 'tta': []}
+
+    print(f"{'1 view':>10} | {single['p50_ms']:8.2f} ms")
+
+    for views, count in TTA_VIEWS.items():
+        batched = time_call(lambda: predict_tta(model, label_encoder, image, 'cpu', views), repeat)
+
+        augmented = augment(image, views)
+        sequential = time_call(
+            lambda: [predict_image(model, label_encoder, view.unsqueeze(0), 'cpu') for view in augmented], repeat
+        )
+
+        report['tta'].append({
+            'views': views,
+            'count': count,
+            'batched': batched,
+            'sequential': sequential,
+            'batched_vs_single': batched['p50_ms'] / single['p50_ms'],
+        })
+
+        print(f"{views:>10} | {count} views | batched {batched['p50_ms']:8.2f} ms ({batched['p50_ms'] / single['p50_ms']:.2f}x one view) "
+              f"| sequential {sequential['p50_ms']:8.2f} ms")
+
+    return report
+
+
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser(description='Batched TTA latency against one predict_image call per view')
+    parser.add_argument('--repeat', type=int, default=10)
+    parser.add_argument('--output', default=None, help='optional path to write the JSON report')
+    args = parser.parse_args()
+
+    results = run(args.repeat)
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
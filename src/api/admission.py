@@ -0,0 +1,101 @@
+import time
+from fastapi import HTTPException
+from src.constants import MAX_IN_FLIGHT, RETRY_AFTER_SECONDS, DEFAULT_REQUEST_TIMEOUT_MS
+from .metrics import SHED
+
+
+# endpoints behind admission control , everything else (health , readiness , metrics) is always served
+ADMITTED_ENDPOINTS = ('/predict', '/predict/batch', '/predict/raw', '/similar')
+
+# relative budget in milliseconds , or absolute deadline as unix epoch seconds
+TIMEOUT_HEADER = 'x-request-timeout-ms'
+DEADLINE_HEADER = 'x-request-deadline'
+
+
+
+class DeadlineExceeded(Exception):
+
+    """ Raised when a request's deadline passed before a stage started , the stage is skipped """
+
+    def __init__(self, stage):
+        super().__init__(f'Deadline exceeded before {stage}')
+        self.stage = stage
+
+
+
+class AdmissionController:
+
+    """
+    Bounds the prediction requests handled at once. The count is only touched on the event loop ,
+    so no lock is needed. A request over the limit is turned away before its body is read.
+    """
+
+    def __init__(self, max_in_flight=MAX_IN_FLIGHT, retry_after=RETRY_AFTER_SECONDS):
+
+        self.max_in_flight = max(1, int(max_in_flight))
+        self.retry_after = max(1, int(retry_after))
+
+        self.in_flight = 0
+        self.admitted_total = 0
+        self.rejected_total = 0
+
+
+    def try_admit(self):
+        if self.in_flight >= self.max_in_flight:
+            self.rejected_total += 1
+            return False
+
+        self.in_flight += 1
+        self.admitted_total += 1
+        return True
+
+
+    def release(self):
+        self.in_flight -= 1
+
+
+    def stats(self):
+        return {
+            'in_flight': self.in_flight,
+            'max_in_flight': self.max_in_flight,
+            'admitted_total': self.admitted_total,
+            'rejected_total': self.rejected_total,
+        }
+
+
+
+def parse_deadline(headers, default_timeout_ms=DEFAULT_REQUEST_TIMEOUT_MS):
+
+    """
+    Returns the request deadline on the time.monotonic() clock , or None.
+    X-Request-Timeout-Ms is a budget from now , X-Request-Deadline an absolute unix time (seconds).
+    """
+
+    now = time.monotonic()
+
+    try:
+        timeout_ms = headers.get(TIMEOUT_HEADER)
+        if timeout_ms is not None:
+            return now + float(timeout_ms) / 1000
+
+        deadline = headers.get(DEADLINE_HEADER)
+        if deadline is not None:
+            return now + (float(deadline) - time.time())
+
+    except ValueError:
+        raise HTTPException(status_code=400, detail=f"{TIMEOUT_HEADER} / {DEADLINE_HEADER} must be numbers")
+
+    if default_timeout_ms > 0:
+        return now + default_timeout_ms / 1000
+
+    return None
+
+
+
+def check_deadline(deadline, stage, endpoint):
+
+    """ Raises DeadlineExceeded when the deadline already passed , so stage is never started """
+
+    if deadline is not None and time.monotonic() > deadline:
+        SHED.labels(endpoint, f'deadline_{stage}').inc()
+        raise DeadlineExceeded(stage)
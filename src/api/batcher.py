@@ -0,0 +1,187 @@
+import asyncio
+import time
+import torch
+from src.logger import logger
+from src.constants import MAX_BATCH_SIZE, MAX_BATCH_WAIT_MS
+from .executor import run_in_executor
+from .predictor import trim_prediction
+from .metrics import STAGE_LATENCY, BATCH_SIZE, QUEUE_DEPTH, SHED
+from .admission import DeadlineExceeded
+
+
+class MicroBatcher:
+
+    """
+    Collects concurrent prediction requests and runs them through the model as a single batch.
+    A batch is flushed as soon as it holds max_batch_size images or the oldest request
+    has waited max_wait_ms, whichever comes first.
+    """
+
+    def __init__(self, predict_fn, max_batch_size=MAX_BATCH_SIZE, max_wait_ms=MAX_BATCH_WAIT_MS):
+
+        # predict_fn receives the stacked (N,3,224,224) tensor and a top_k and returns N results in order ,
+        # it runs inside the inference executor so it has to be a module level (picklable) function
+        self.predict_fn = predict_fn
+        self.max_batch_size = max(1, int(max_batch_size))
+        self.max_wait = max(0.0, max_wait_ms) / 1000
+
+        self._queue = None
+        self._worker = None
+
+        # counters exposed through stats()
+        self.batches_total = 0
+        self.images_total = 0
+        self.last_batch_size = 0
+        self.batch_size_counts = {}
+
+
+    @property
+    def queue_depth(self):
+        return self._queue.qsize() if self._queue is not None else 0
+
+
+    async def start(self):
+        self._queue = asyncio.Queue()
+        self._worker = asyncio.create_task(self._run())
+        logger.info(f'Micro-batcher started (max batch size : {self.max_batch_size}, max wait : {self.max_wait * 1000:.1f} ms)')
+
+
+    async def stop(self):
+        if self._worker is None:
+            return
+
+        self._worker.cancel()
+        try:
+            await self._worker
+        except asyncio.CancelledError:
+            pass
+        self._worker = None
+
+        # failing whatever is still queued so no caller waits forever
+        while not self._queue.empty():
+            _, future, _, _, _ = self._queue.get_nowait()
+            if not future.done():
+                future.set_exception(RuntimeError('Batcher stopped before the request was processed'))
+
+        logger.info('Micro-batcher stopped')
+
+
+    async def submit(self, image_tensor, top_k=None, deadline=None):
+
+        """
+        Queues one preprocessed image tensor of shape (1,3,H,W) and waits for its own result ,
+        holding only the top_k classes when top_k is given.
+        A request whose deadline (time.monotonic()) passed while queued is dropped with DeadlineExceeded.
+        """
+
+        if self._worker is None:
+            raise RuntimeError('Batcher is not running')
+
+        future = asyncio.get_running_loop().create_future()
+        await self._queue.put((image_tensor, future, time.perf_counter(), top_k, deadline))
+        QUEUE_DEPTH.set(self._queue.qsize())
+        return await future
+
+
+    async def _collect(self):
+
+        """ Waits for the first request , then keeps collecting until the batch is full or the wait time is over. """
+
+        loop = asyncio.get_running_loop()
+
+        batch = [await self._queue.get()]
+        deadline = loop.time() + self.max_wait
+
+        while len(batch) < self.max_batch_size:
+
+            # taking whatever is already queued without waiting
+            if not self._queue.empty():
+                batch.append(self._queue.get_nowait())
+                continue
+
+            timeout = deadline - loop.time()
+            if timeout <= 0:
+                break
+
+            try:
+                batch.append(await asyncio.wait_for(self._queue.get(), timeout))
+            except asyncio.TimeoutError:
+                break
+
+        return batch
+
+
+    async def _run(self):
+
+        while True:
+            batch = await self._collect()
+            QUEUE_DEPTH.set(self._queue.qsize())
+
+            # time each request spent queued before its batch started
+            started = time.perf_counter()
+            for _, _, enqueued_at, _, _ in batch:
+                STAGE_LATENCY.labels('queue_wait').observe(started - enqueued_at)
+
+            # skipping callers that already went away (client disconnected , request cancelled)
+            # and requests whose deadline passed while they were queued
+            now = time.monotonic()
+            live = []
+            for tensor, future, _, top_k, deadline in batch:
+                if future.done():
+                    continue
+                if deadline is not None and now > deadline:
+                    SHED.labels('batcher', 'deadline_inference').inc()
+                    future.set_exception(DeadlineExceeded('inference'))
+                    continue
+                live.append((tensor, future, top_k))
+
+            batch = live
+            if not batch:
+                continue
+
+            # one top-k for the whole batch , large enough for every request in it
+            top_ks = [top_k for _, _, top_k in batch]
+            batch_top_k = None if None in top_ks else max(top_ks)
+
+            try:
+                stacked = torch.cat([tensor for tensor, _, _ in batch], dim=0)
+
+                # the forward pass is blocking , so it runs in the inference executor
+                results = await run_in_executor(self.predict_fn, stacked, batch_top_k)
+
+            except Exception as e:
+                logger.error(f'Batch of {len(batch)} failed : {str(e)}')
+                for _, future, _ in batch:
+                    if not future.done():
+                        future.set_exception(e)
+                continue
+
+            self._record(len(batch))
+
+            for (_, future, top_k), result in zip(batch, results):
+                if not future.done():
+                    future.set_result(trim_prediction(result, top_k))
+
+
+    def _record(self, batch_size):
+        self.batches_total += 1
+        self.images_total += batch_size
+        self.last_batch_size = batch_size
+        self.batch_size_counts[batch_size] = self.batch_size_counts.get(batch_size, 0) + 1
+        BATCH_SIZE.observe(batch_size)
+
+
+    def stats(self):
+
+        """ Returns queue depth and batch size metrics for the health endpoint """
+
+        return {
+            'queue_depth': self.queue_depth,
+            'max_batch_size': self.max_batch_size,
+            'max_wait_ms': self.max_wait * 1000,
+            'batches_total': self.batches_total,
+            'images_total': self.images_total,
+            'last_batch_size': self.last_batch_size,
+            'avg_batch_size': (self.images_total / self.batches_total) if self.batches_total else 0.0,
+            'batch_size_counts': {str(size): count for size, count in sorted(self.batch_size_counts.items())},
+        }
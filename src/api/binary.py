@@ -0,0 +1,116 @@
+import json
+import re
+import numpy as np
+from fastapi import HTTPException, Request
+from fastapi.responses import Response
+from src.constants import MAX_UPLOAD_BYTES, MAX_IMAGE_PIXELS
+
+try:
+    import msgpack
+    MSGPACK_AVAILABLE = True
+except ImportError:
+    MSGPACK_AVAILABLE = False
+
+
+# request body types of POST /predict/raw
+IMAGE_CONTENT_TYPES = ('image/jpeg', 'image/png', 'image/webp', 'image/bmp', 'image/tiff')
+ARRAY_CONTENT_TYPE = 'application/octet-stream'
+
+# response types , anything else gets JSON
+MSGPACK_MEDIA_TYPES = ('application/msgpack', 'application/x-msgpack', 'application/vnd.msgpack')
+FLOAT32_MEDIA_TYPE = 'application/octet-stream'
+
+# header with the (height , width , channels) of a raw uint8 RGB array body
+SHAPE_HEADER = 'x-image-shape'
+
+
+
+async def read_body(request: Request, max_bytes: int = MAX_UPLOAD_BYTES) -> bytes:
+
+    """ Streams the request body and stops as soon as it goes over max_bytes """
+
+    chunks = []
+    total = 0
+
+    async for chunk in request.stream():
+        total += len(chunk)
+        if total > max_bytes:
+            raise HTTPException(status_code=413, detail=f"Body too large , at most {max_bytes} bytes allowed")
+        chunks.append(chunk)
+
+    return b''.join(chunks)
+
+
+
+def parse_image_shape(header, body_size, max_pixels=MAX_IMAGE_PIXELS):
+
+    """
+    Parses an X-Image-Shape header like '256,256,3' or '256x256x3' (height , width , channels)
+    and checks it against the body size. Returns (height , width).
+    """
+
+    if not header:
+        raise HTTPException(status_code=400, detail="Raw array bodies need an X-Image-Shape header (height,width,3)")
+
+    try:
+        shape = [int(value) for value in re.split(r'[,x\s]+', header.strip()) if value]
+    except ValueError:
+        raise HTTPException(status_code=400, detail=f"Invalid X-Image-Shape header '{header}'")
+
+    if len(shape) == 2:
+        shape.append(3)
+
+    if len(shape) != 3 or shape[2] != 3 or shape[0] <= 0 or shape[1] <= 0:
+        raise HTTPException(status_code=400, detail=f"X-Image-Shape must be height,width,3 , got '{header}'")
+
+    height, width, channels = shape
+
+    if height * width > max_pixels:
+        raise HTTPException(status_code=413, detail=f"Image too large ({width}x{height}) , at most {max_pixels} pixels allowed")
+
+    if height * width * channels != body_size:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Body holds {body_size} bytes , X-Image-Shape {height}x{width}x{channels} needs {height * width * channels}",
+        )
+
+    return height, width
+
+
+
+def wants(accept, media_types):
+    accept = (accept or '').lower()
+    return any(media_type in accept for media_type in media_types)
+
+
+
+def pack_probabilities(prediction, classes):
+
+    """ Probabilities of every class as little endian float32 , in label encoder class order """
+
+    all_predictions = prediction["all_predictions"]
+    return np.asarray([all_predictions[name] for name in classes], dtype='<f4').tobytes()
+
+
+
+def binary_response(prediction, accept, classes, model_version):
+
+    """
+    Encodes a prediction for the Accept header : MessagePack , or packed float32 probabilities
+    (class names in the X-Classes header). Returns None when the client did not ask for a binary format.
+    """
+
+    headers = {'X-Model-Version': str(model_version)}
+
+    if wants(accept, MSGPACK_MEDIA_TYPES):
+        if not MSGPACK_AVAILABLE:
+            raise HTTPException(status_code=406, detail="MessagePack responses need the msgpack package on the server")
+
+        return Response(content=msgpack.packb(prediction), media_type=MSGPACK_MEDIA_TYPES[0], headers=headers)
+
+    if wants(accept, (FLOAT32_MEDIA_TYPE,)):
+        headers['X-Classes'] = json.dumps([str(name) for name in classes])
+        headers['X-Dtype'] = 'float32-le'
+        return Response(content=pack_probabilities(prediction, classes), media_type=FLOAT32_MEDIA_TYPE, headers=headers)
+
+    return None
@@ -0,0 +1,314 @@
+import argparse
+import collections
+import csv
+import os
+import sys
+import tarfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+import torch
+from src.logger import logger
+from src.exception import MyException
+from src.constants import BATCH_ENDPOINT_CHUNK_SIZE, INFERENCE_WORKERS, TORCH_NUM_THREADS
+from . import model_loader
+from .executor import decode_and_preprocess, forward_batch
+from .image_folder import is_image_file, list_images
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+    PYARROW_AVAILABLE = True
+except ImportError:
+    PYARROW_AVAILABLE = False
+
+
+# one row per image , the same columns for CSV and Parquet
+COLUMNS = ['path', 'predicted_class', 'confidence', 'model_version', 'error']
+
+# batches decoded ahead of the one currently in the model
+PREFETCH_BATCHES = 4
+
+# rows per Parquet part file
+ROWS_PER_PART = 10000
+
+# throughput is logged every this many images
+LOG_EVERY = 1000
+
+
+
+def iter_directory(folder, done):
+
+    """ Yields (key , path) for every image under folder , keys are paths relative to folder """
+
+    for path in list_images(folder):
+        key = os.path.relpath(path, folder)
+        if key not in done:
+            yield key, path
+
+
+
+def iter_tar(archive_path, done):
+
+    """
+    Yields (key , bytes) for every image in a tar archive (plain or compressed).
+    The archive is read as a stream , in member order , and already scored members are not even read.
+    """
+
+    with tarfile.open(archive_path, 'r|*') as archive:
+        for member in archive:
+            if not member.isfile() or not is_image_file(member.name) or member.name in done:
+                continue
+            yield member.name, archive.extractfile(member).read()
+
+
+
+def load_and_preprocess(source):
+
+    """ Reads (when given a path) and preprocesses one image , runs in the decode pool """
+
+    if isinstance(source, str):
+        with open(source, 'rb') as f:
+            source = f.read()
+
+    return decode_and_preprocess(source)
+
+
+
+class CsvResults:
+
+    """ Appends result rows to a CSV file , flushed after every batch """
+
+    def __init__(self, path):
+
+        self.path = path
+        self._truncate_partial_row()
+
+        is_new = not os.path.exists(path) or os.path.getsize(path) == 0
+        self._file = open(path, 'a', newline='', encoding='utf-8')
+        self._writer = csv.DictWriter(self._file, fieldnames=COLUMNS)
+        if is_new:
+            self._writer.writeheader()
+            self._file.flush()
+
+
+    def _truncate_partial_row(self):
+
+        """ Drops a half written last row left behind by an interrupted run """
+
+        if not os.path.exists(self.path):
+            return
+
+        with open(self.path, 'rb+') as f:
+            data = f.read()
+            if data and not data.endswith(b'\n'):
+                f.truncate(data.rfind(b'\n') + 1)
+
+
+    def done_keys(self):
+        with open(self.path, newline='', encoding='utf-8') as f:
+            return {row['path'] for row in csv.DictReader(f)}
+
+
+    def write(self, rows):
+        self._writer.writerows(rows)
+        self._file.flush()
+
+
+    def close(self):
+        self._file.close()
+
+
+
+class ParquetResults:
+
+    """
+    Writes result rows as part files into a directory , a part is only renamed into place once complete ,
+    so an interrupted run loses at most the rows buffered since the last part
+    """
+
+    def __init__(self, folder, rows_per_part=ROWS_PER_PART):
+
+        if not PYARROW_AVAILABLE:
+            raise MyException('Parquet output needs pyarrow , install it or write to a .csv file', sys)
+
+        self.folder = folder
+        self.rows_per_part = rows_per_part
+        self._rows = []
+
+        os.makedirs(folder, exist_ok=True)
+        self._parts = sorted(name for name in os.listdir(folder) if name.endswith('.parquet'))
+
+
+    def done_keys(self):
+        done = set()
+        for name in self._parts:
+            done.update(pq.read_table(os.path.join(self.folder, name), columns=['path']).column('path').to_pylist())
+        return done
+
+
+    def write(self, rows):
+        self._rows.extend(rows)
+        if len(self._rows) >= self.rows_per_part:
+            self._flush()
+
+
+    def _flush(self):
+
+        if not self._rows:
+            return
+
+        name = f'part-{len(self._parts):05d}.parquet'
+        tmp_path = os.path.join(self.folder, name + '.tmp')
+
+        table = pa.Table.from_pylist(self._rows, schema=pa.schema([
+            ('path', pa.string()),
+            ('predicted_class', pa.string()),
+            ('confidence', pa.float32()),
+            ('model_version', pa.string()),
+            ('error', pa.string()),
+        ]))
+        pq.write_table(table, tmp_path)
+        os.replace(tmp_path, os.path.join(self.folder, name))
+
+        self._parts.append(name)
+        self._rows = []
+
+
+    def close(self):
+        self._flush()
+
+
+
+def open_results(output, output_format=None):
+
+    """ Parquet for a .parquet path or a directory , CSV otherwise (unless output_format says so) """
+
+    if output_format is None:
+        output_format = 'parquet' if output.endswith('.parquet') or os.path.isdir(output) else 'csv'
+
+    if output_format == 'parquet':
+        return ParquetResults(output)
+    if output_format == 'csv':
+        return CsvResults(output)
+
+    raise MyException(f"Unknown output format '{output_format}' , expected 'csv' or 'parquet'", sys)
+
+
+
+def score(input_path, results, batch_size=BATCH_ENDPOINT_CHUNK_SIZE, workers=INFERENCE_WORKERS, prefetch=PREFETCH_BATCHES):
+
+    """
+    Scores every image of a directory or tar archive that is not in results yet.
+    Decoding runs in a thread pool that keeps up to prefetch batches in flight ahead of the model ,
+    the forward pass runs on the main thread one batch at a time. Returns (images scored , seconds).
+    """
+
+    done = results.done_keys()
+    if done:
+        logger.info(f'Resuming , {len(done)} image(s) already scored')
+
+    if os.path.isdir(input_path):
+        items = iter_directory(input_path, done)
+    elif tarfile.is_tarfile(input_path):
+        items = iter_tar(input_path, done)
+    else:
+        raise MyException(f'{input_path} is neither a directory nor a tar archive', sys)
+
+    model_version = model_loader.model_version
+    pending = collections.deque()
+    scored = 0
+    start = time.perf_counter()
+
+
+    def run_batch(batch):
+
+        rows = [{'path': key, 'predicted_class': None, 'confidence': None, 'model_version': model_version, 'error': error}
+                for key, _, error in batch]
+        valid = [index for index, (_, tensor, _) in enumerate(batch) if tensor is not None]
+
+        if valid:
+            try:
+                predictions = forward_batch(torch.cat([batch[index][1] for index in valid], dim=0))
+                for index, prediction in zip(valid, predictions):
+                    rows[index]['predicted_class'] = prediction['predicted_class']
+                    rows[index]['confidence'] = prediction['confidence']
+            except Exception as e:
+                logger.error(f'Batch of {len(valid)} failed : {str(e)}')
+                for index in valid:
+                    rows[index]['error'] = f'Prediction failed: {str(e)}'
+
+        results.write(rows)
+        return len(rows)
+
+
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix='decode') as pool:
+
+        batch = []
+        exhausted = False
+
+        while True:
+
+            # keeping the decode pool prefetch batches ahead of the model
+            while not exhausted and len(pending) < batch_size * prefetch:
+                item = next(items, None)
+                if item is None:
+                    exhausted = True
+                    break
+                key, source = item
+                pending.append((key, pool.submit(load_and_preprocess, source)))
+
+            if not pending:
+                break
+
+            # results are taken in submission order , so output rows follow the input order
+            key, future = pending.popleft()
+            try:
+                batch.append((key, future.result(), None))
+            except Exception as e:
+                batch.append((key, None, f'Decode failed: {str(e)}'))
+
+            if len(batch) == batch_size:
+                scored += run_batch(batch)
+                batch = []
+
+                if scored % LOG_EVERY < batch_size:
+                    logger.info(f'{scored} image(s) scored , {scored / (time.perf_counter() - start):.1f} images/s')
+
+        if batch:
+            scored += run_batch(batch)
+
+    return scored, time.perf_counter() - start
+
+
+
+def main():
+
+    parser = argparse.ArgumentParser(description='Score every image of a directory or tar archive with the trained model')
+    parser.add_argument('input', help='directory of images or tar archive (.tar , .tar.gz , ...)')
+    parser.add_argument('--output', required=True, help='results .csv file , or .parquet / directory for Parquet part files')
+    parser.add_argument('--format', choices=['csv', 'parquet'], default=None, help='output format , inferred from --output by default')
+    parser.add_argument('--batch-size', type=int, default=BATCH_ENDPOINT_CHUNK_SIZE)
+    parser.add_argument('--workers', type=int, default=INFERENCE_WORKERS, help='decode threads')
+    parser.add_argument('--prefetch', type=int, default=PREFETCH_BATCHES, help='batches decoded ahead of the model')
+    args = parser.parse_args()
+
+    if TORCH_NUM_THREADS > 0:
+        torch.set_num_threads(TORCH_NUM_THREADS)
+
+    # same model , preprocessing and prediction code as the API , configured through the same environment
+    model_loader.load_model_safe()
+
+    results = open_results(args.output, args.format)
+    try:
+        scored, seconds = score(args.input, results, max(1, args.batch_size), max(1, args.workers), max(1, args.prefetch))
+    finally:
+        results.close()
+
+    rate = scored / seconds if seconds > 0 else 0.0
+    logger.info(f'Scored {scored} image(s) in {seconds:.1f} s , {rate:.1f} images/s')
+    print(f'{scored} image(s) scored in {seconds:.1f} s ({rate:.1f} images/s) -> {args.output}')
+
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,304 @@
+import asyncio
+import hashlib
+import json
+import os
+import shutil
+import threading
+import time
+from collections import OrderedDict
+from src.logger import logger
+from src.constants import CACHE_MAX_ENTRIES, CACHE_TTL_SECONDS, CACHE_DIR, CACHE_DISK_MAX_ENTRIES, CACHE_SWEEP_INTERVAL
+
+
+class PredictionCache:
+
+    """
+    Content addressed cache of prediction results , keyed by a hash of the raw upload bytes
+    and the model version. Memory tier is an LRU with TTL , the optional disk tier stores one
+    JSON file per entry under disk_dir/<model_version>/ so it survives restarts.
+    The memory tier is dropped as soon as a new model version shows up. The disk tier is swept every
+    sweep_interval seconds : expired files are removed , each version directory is trimmed to disk_max_entries
+    (oldest writes first) and directories of other versions go once nothing was written to them within the TTL ,
+    since other workers (or a rollout still on the old version) may share the same disk_dir.
+    """
+
+    def __init__(self, max_entries=CACHE_MAX_ENTRIES, ttl_seconds=CACHE_TTL_SECONDS, disk_dir=CACHE_DIR,
+                 disk_max_entries=CACHE_DISK_MAX_ENTRIES, sweep_interval=CACHE_SWEEP_INTERVAL):
+
+        self.max_entries = max(1, int(max_entries))
+        self.ttl = ttl_seconds
+        self.disk_dir = disk_dir or None
+        self.disk_max_entries = max(1, int(disk_max_entries))
+        self.sweep_interval = sweep_interval
+        self._sweeper = None
+
+        # key -> (expires_at , result) , most recently used at the end
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._version = None
+
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.disk_evictions = 0
+
+
+    @staticmethod
+    def content_hash(content):
+        return hashlib.blake2b(content, digest_size=16).hexdigest()
+
+
+    def _sync_version(self, model_version):
+
+        """ Invalidates the memory tier when load_model_safe loaded a different checkpoint , True if it did """
+
+        if model_version == self._version:
+            return False
+
+        with self._lock:
+            if model_version == self._version:
+                return False
+
+            if self._version is not None:
+                logger.info(f'Model version changed ({self._version} -> {model_version}) , clearing prediction cache')
+            self._entries.clear()
+            self._version = model_version
+
+        return True
+
+
+    def _disk_path(self, key):
+        return os.path.join(self.disk_dir, str(self._version), key[:2], f'{key}.json')
+
+
+    def _sweep_disk(self):
+
+        """
+        One pass over the disk tier : drops idle directories of other model versions , expired entries
+        and the oldest entries beyond disk_max_entries per version. Returns the number of files removed.
+        """
+
+        if not os.path.isdir(self.disk_dir):
+            return 0
+
+        cutoff = time.time() - self.ttl
+        removed = 0
+
+        for name in os.listdir(self.disk_dir):
+            version_dir = os.path.join(self.disk_dir, name)
+            if not os.path.isdir(version_dir):
+                continue
+
+            if name != str(self._version) and self._last_write(version_dir) < cutoff:
+                logger.info(f'Removing stale prediction cache directory {version_dir}')
+                shutil.rmtree(version_dir, ignore_errors=True)
+                continue
+
+            removed += self._trim_version_dir(version_dir, cutoff)
+
+        self.disk_evictions += removed
+        return removed
+
+
+    def _trim_version_dir(self, version_dir, cutoff):
+
+        # (mtime , path) of the entries still alive , expired and abandoned temp files are removed right away
+        alive = []
+        removed = 0
+
+        for root, _, files in os.walk(version_dir):
+            for name in files:
+                path = os.path.join(root, name)
+                try:
+                    mtime = os.path.getmtime(path)
+                    if mtime < cutoff:
+                        os.remove(path)
+                        removed += 1
+                    elif name.endswith('.json'):
+                        alive.append((mtime, path))
+                except OSError:
+                    # another worker swept or replaced it first
+                    continue
+
+        if len(alive) > self.disk_max_entries:
+            alive.sort()
+            for _, path in alive[:len(alive) - self.disk_max_entries]:
+                try:
+                    os.remove(path)
+                    removed += 1
+                except OSError:
+                    continue
+
+        return removed
+
+
+    def start_sweeping(self):
+
+        if self.disk_dir and self.sweep_interval > 0 and self._sweeper is None:
+            self._sweeper = asyncio.create_task(self._sweep())
+            logger.info(f'Sweeping the prediction cache in {self.disk_dir} every {self.sweep_interval:.0f} s')
+
+
+    async def stop_sweeping(self):
+
+        if self._sweeper is None:
+            return
+
+        self._sweeper.cancel()
+        try:
+            await self._sweeper
+        except asyncio.CancelledError:
+            pass
+        self._sweeper = None
+
+
+    async def _sweep(self):
+
+        """ Periodic disk tier sweep , off the event loop """
+
+        while True:
+            await asyncio.sleep(self.sweep_interval)
+
+            try:
+                removed = await asyncio.to_thread(self._sweep_disk)
+                if removed:
+                    logger.info(f'Prediction cache sweep removed {removed} files')
+            except Exception as e:
+                logger.warning(f'Prediction cache sweep failed : {str(e)}')
+
+
+    @staticmethod
+    def _last_write(version_dir):
+
+        # writing an entry renames it into its shard directory , which updates the shard mtime
+        try:
+            with os.scandir(version_dir) as entries:
+                shard_times = [entry.stat().st_mtime for entry in entries if entry.is_dir()]
+            return max([os.path.getmtime(version_dir)] + shard_times)
+
+        except OSError:
+            return time.time()
+
+
+    def get(self, key):
+
+        """ Memory tier lookup , returns None on miss or expiry """
+
+        now = time.monotonic()
+
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+
+            expires_at, result = entry
+            if expires_at < now:
+                del self._entries[key]
+                return None
+
+            self._entries.move_to_end(key)
+            return result
+
+
+    def put(self, key, result):
+
+        with self._lock:
+            self._entries[key] = (time.monotonic() + self.ttl, result)
+            self._entries.move_to_end(key)
+
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+
+    def _get_disk(self, key):
+        path = self._disk_path(key)
+
+        try:
+            if time.time() - os.path.getmtime(path) > self.ttl:
+                os.remove(path)
+                return None
+
+            with open(path) as f:
+                return json.load(f)
+
+        except (OSError, ValueError):
+            return None
+
+
+    def _put_disk(self, key, result):
+        path = self._disk_path(key)
+
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+
+            # writing to a temp file first so a crash never leaves a half written entry
+            tmp_path = f'{path}.{os.getpid()}.tmp'
+            with open(tmp_path, 'w') as f:
+                json.dump(result, f)
+            os.replace(tmp_path, path)
+
+        except OSError as e:
+            logger.warning(f'Could not write prediction cache entry to disk : {str(e)}')
+
+
+    async def lookup(self, content, model_version):
+
+        """
+        Returns (key , cached_result or None) for the uploaded bytes.
+        Hashing and disk reads run in a thread so large uploads do not block the event loop.
+        """
+
+        if self._sync_version(model_version) and self.disk_dir:
+            await asyncio.to_thread(self._sweep_disk)
+
+        key = await asyncio.to_thread(self.content_hash, content)
+
+        result = self.get(key)
+        if result is not None:
+            self.hits += 1
+            return key, result
+
+        if self.disk_dir:
+            result = await asyncio.to_thread(self._get_disk, key)
+            if result is not None:
+                self.disk_hits += 1
+                self.put(key, result)
+                return key, result
+
+        self.misses += 1
+        return key, None
+
+
+    async def store(self, key, result, model_version):
+
+        # a reload may have happened while this prediction was running
+        if model_version != self._version:
+            return
+
+        self.put(key, result)
+
+        if self.disk_dir:
+            await asyncio.to_thread(self._put_disk, key, result)
+
+
+    def stats(self):
+
+        """ Hit / miss counters for the health endpoint """
+
+        lookups = self.hits + self.disk_hits + self.misses
+
+        return {
+            'entries': len(self._entries),
+            'max_entries': self.max_entries,
+            'ttl_seconds': self.ttl,
+            'disk_tier': self.disk_dir is not None,
+            'model_version': self._version,
+            'hits': self.hits,
+            'disk_hits': self.disk_hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+            'disk_evictions': self.disk_evictions,
+            'hit_rate': ((self.hits + self.disk_hits) / lookups) if lookups else 0.0,
+        }
@@ -0,0 +1,242 @@
+import argparse
+import json
+import sys
+import threading
+import time
+import torch
+import torch.nn.functional as F
+from src.logger import logger
+from src.exception import MyException
+from src.constants import CASCADE_ENABLED, CASCADE_RESOLUTION, CASCADE_THRESHOLD
+from .metrics import stage_timer, CASCADE_IMAGES, CASCADE_FALLBACKS
+from .image_folder import list_labeled_images, load_image_batches
+from .preprocess_image import CROP_SIZE
+
+
+# thresholds and resolutions swept by the evaluation
+EVAL_THRESHOLDS = (0.5, 0.6, 0.7, 0.8, 0.85, 0.9, 0.95, 0.98)
+EVAL_RESOLUTIONS = (128, 160, 192)
+
+
+
+def downscale(batch, resolution):
+
+    """ Resizes an already preprocessed (N,3,224,224) batch to (N,3,resolution,resolution) """
+
+    if resolution >= batch.shape[-1]:
+        return batch
+
+    return F.interpolate(batch, size=(resolution, resolution), mode='bilinear', antialias=True, align_corners=False)
+
+
+
+class Cascade:
+
+    """
+    Two stage inference with the same EfficientNet-B3 weights. Stage 1 runs every image at a reduced
+    resolution (the backbone ends in adaptive pooling , so it accepts any input size) , stage 2 reruns only
+    the images whose top stage 1 probability is below threshold at the full 224px.
+    """
+
+    def __init__(self, resolution=CASCADE_RESOLUTION, threshold=CASCADE_THRESHOLD):
+
+        self.resolution = int(resolution)
+        self.threshold = float(threshold)
+        self.enabled = True
+
+        self._lock = threading.Lock()
+        self.images_total = 0
+        self.escalated_total = 0
+        self.stage1_seconds = 0.0
+        self.stage2_seconds = 0.0
+        self.fallbacks_total = 0
+
+
+    def run(self, model, batch, record=True):
+
+        """
+        Returns (probabilities (N,C) , cascade stage that answered each image).
+        record=False leaves the routing stats and metrics untouched (warm-up batches).
+        """
+
+        start = time.perf_counter()
+
+        try:
+            with stage_timer('cascade_stage1'):
+                prob = torch.softmax(model(downscale(batch, self.resolution)), dim=1)
+
+        except Exception as e:
+            # this batch gets the full model , the cascade stays on for the next ones
+            # (a model with a fixed input size , like an ONNX graph exported before dynamic image axes , fails every time)
+            logger.error(f'Cascade stage 1 failed , running the full model for this batch : {str(e)}')
+            CASCADE_FALLBACKS.inc()
+            with self._lock:
+                self.fallbacks_total += 1
+            with stage_timer('forward'):
+                return torch.softmax(model(batch), dim=1), None
+
+        stage1_end = time.perf_counter()
+
+        escalate = prob.max(dim=1).values < self.threshold
+        escalated = int(escalate.sum())
+
+        if escalated:
+            with stage_timer('forward'):
+                prob[escalate] = torch.softmax(model(batch[escalate]), dim=1)
+
+        if record:
+            self._record(len(batch), escalated, stage1_end - start, time.perf_counter() - stage1_end)
+
+        return prob, (escalate.long() + 1).tolist()
+
+
+    def _record(self, images, escalated, stage1_seconds, stage2_seconds):
+
+        CASCADE_IMAGES.labels('stage1').inc(images - escalated)
+        CASCADE_IMAGES.labels('stage2').inc(escalated)
+
+        with self._lock:
+            self.images_total += images
+            self.escalated_total += escalated
+            self.stage1_seconds += stage1_seconds
+            self.stage2_seconds += stage2_seconds
+
+
+    def stats(self):
+
+        """ Routing rates and per stage latency for the health endpoint """
+
+        images = self.images_total
+
+        return {
+            'enabled': self.enabled,
+            'resolution': self.resolution,
+            'threshold': self.threshold,
+            'images_total': images,
+            'fallbacks_total': self.fallbacks_total,
+            'stage1_rate': ((images - self.escalated_total) / images) if images else 0.0,
+            'stage2_rate': (self.escalated_total / images) if images else 0.0,
+            'stage1_ms_per_image': (self.stage1_seconds * 1000 / images) if images else 0.0,
+            'stage2_ms_per_escalated_image': (self.stage2_seconds * 1000 / self.escalated_total) if self.escalated_total else 0.0,
+        }
+
+
+
+# cascade used by forward_batch , None runs the full model on every image
+default_cascade = Cascade() if CASCADE_ENABLED else None
+
+
+
+def _timed_probs(model, batch, resolution):
+    start = time.perf_counter()
+    # copying back to the CPU also waits for the device , so the timing covers the whole forward pass
+    prob = torch.softmax(model(downscale(batch, resolution)), dim=1).cpu()
+    return prob, time.perf_counter() - start
+
+
+
+def evaluate(model, classes, eval_dir, resolutions=EVAL_RESOLUTIONS, thresholds=EVAL_THRESHOLDS, batch_size=16, device='cpu'):
+
+    """
+    Accuracy / latency trade-off of the cascade on a labeled folder (eval_dir/<class name>/<image>).
+    The full model and every stage 1 resolution run once over the folder , every threshold is then
+    evaluated on those probabilities. Latency per image is stage 1 time plus the escalated share of the full pass
+    (measured per image on batches , so it does not include the smaller stage 2 batch effect).
+    """
+
+    samples = [(path, label) for path, label in list_labeled_images(eval_dir) if label in set(classes)]
+    if not samples:
+        raise MyException(f"No labeled images matching the model classes found in {eval_dir}", sys)
+
+    class_index = {name: i for i, name in enumerate(classes)}
+    targets = torch.tensor([class_index[label] for _, label in samples])
+
+    full_probs, full_seconds = [], 0.0
+    stage1_probs = {resolution: [] for resolution in resolutions}
+    stage1_seconds = {resolution: 0.0 for resolution in resolutions}
+
+    with torch.no_grad():
+        for batch in load_image_batches([path for path, _ in samples], batch_size):
+            batch = batch.to(device)
+
+            prob, seconds = _timed_probs(model, batch, CROP_SIZE)
+            full_probs.append(prob)
+            full_seconds += seconds
+
+            for resolution in resolutions:
+                prob, seconds = _timed_probs(model, batch, resolution)
+                stage1_probs[resolution].append(prob)
+                stage1_seconds[resolution] += seconds
+
+    images = len(samples)
+    full_probs = torch.cat(full_probs)
+    full_pred = full_probs.argmax(1)
+    full_ms = full_seconds * 1000 / images
+
+    report = {
+        'images': images,
+        'full_model': {'accuracy': float((full_pred == targets).float().mean()), 'ms_per_image': full_ms},
+        'cascade': [],
+    }
+
+    for resolution in resolutions:
+        probs = torch.cat(stage1_probs[resolution])
+        confidence, stage1_pred = probs.max(dim=1)
+        stage1_ms = stage1_seconds[resolution] * 1000 / images
+
+        for threshold in thresholds:
+            escalate = confidence < threshold
+            pred = torch.where(escalate, full_pred, stage1_pred)
+            stage2_rate = float(escalate.float().mean())
+
+            report['cascade'].append({
+                'resolution': resolution,
+                'threshold': threshold,
+                'accuracy': float((pred == targets).float().mean()),
+                'agreement_with_full': float((pred == full_pred).float().mean()),
+                'stage2_rate': stage2_rate,
+                'ms_per_image': stage1_ms + stage2_rate * full_ms,
+            })
+
+    return report
+
+
+
+def main():
+
+    parser = argparse.ArgumentParser(description='Measure the cascade accuracy / latency trade-off on a labeled image folder')
+    parser.add_argument('eval_dir', help='folder laid out as <class name>/<image>')
+    parser.add_argument('--resolutions', default=','.join(map(str, EVAL_RESOLUTIONS)))
+    parser.add_argument('--thresholds', default=','.join(map(str, EVAL_THRESHOLDS)))
+    parser.add_argument('--batch-size', type=int, default=16)
+    parser.add_argument('--output', default=None, help='optional path to write the report as JSON')
+    args = parser.parse_args()
+
+    from . import model_loader
+
+    handle = model_loader.load_model_safe()
+
+    report = evaluate(
+        handle.model,
+        list(handle.label_encoder.classes_),
+        args.eval_dir,
+        [int(value) for value in args.resolutions.split(',')],
+        [float(value) for value in args.thresholds.split(',')],
+        args.batch_size,
+        handle.device,
+    )
+
+    full = report['full_model']
+    print(f"full model      | accuracy {full['accuracy']:.4f} | {full['ms_per_image']:.2f} ms / image")
+    for row in report['cascade']:
+        print(f"{row['resolution']:>4}px @ {row['threshold']:.2f} | accuracy {row['accuracy']:.4f} | "
+              f"stage 2 {row['stage2_rate'] * 100:5.1f} % | {row['ms_per_image']:.2f} ms / image")
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+
+
+
+if __name__ == '__main__':
+    main()
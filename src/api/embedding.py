@@ -0,0 +1,76 @@
+import torch
+import torch.nn as nn
+
+
+# width of the embedding , the output of the 1024 -> 512 block of the custom head
+EMBEDDING_DIM = 512
+
+
+
+class EmbeddingNet(nn.Module):
+
+    """
+    EfficientNet-B3 with the custom head split before its output layer , so one forward pass yields
+    both the logits and the penultimate 512-d activation used as the image embedding.
+    forward still returns the logits only , so it is a drop-in replacement for the plain model.
+    """
+
+    def __init__(self, model):
+
+        super().__init__()
+        self.features = model.features
+        self.avgpool = model.avgpool
+        self.head = model.classifier[:-1]
+        self.output = model.classifier[-1]
+
+
+    def forward(self, x):
+        return self.forward_with_embedding(x)[0]
+
+
+    @torch.jit.export
+    def forward_with_embedding(self, x):
+        x = torch.flatten(self.avgpool(self.features(x)), 1)
+        embedding = self.head(x)
+        return self.output(embedding), embedding
+
+
+
+class EmbeddingOutputs(EmbeddingNet):
+
+    """ Returns (logits , embedding) from forward , used to export both as graph outputs """
+
+    def forward(self, x):
+        return self.forward_with_embedding(x)
+
+
+
+def supports_embedding(model):
+
+    """
+    True when the model can return the embedding next to the logits : eager torch models ,
+    optimized models (frozen with forward_with_embedding preserved) and ONNX graphs exported with an embedding output.
+    The traced INT8 artifact only exposes its logits.
+    """
+
+    if isinstance(model, torch.jit.ScriptModule):
+        return hasattr(model, 'forward_with_embedding')
+
+    if hasattr(model, 'forward_with_embedding'):
+        return getattr(model, 'has_embedding', True)
+
+    return isinstance(model, nn.Module) and all(hasattr(model, name) for name in ('features', 'avgpool', 'classifier'))
+
+
+
+def forward_with_embedding(model, batch):
+
+    """ Runs one forward pass , returns (logits (N,C) , embeddings (N,512)) """
+
+    if hasattr(model, 'forward_with_embedding'):
+        return model.forward_with_embedding(batch)
+
+    # eager torchvision model : the same steps as EfficientNet.forward , with the head split before its last layer
+    x = torch.flatten(model.avgpool(model.features(batch)), 1)
+    embedding = model.classifier[:-1](x)
+    return model.classifier[-1](embedding), embedding
@@ -0,0 +1,244 @@
+import asyncio
+import functools
+import multiprocessing
+import os
+import threading
+import sys
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+import torch
+from src.logger import logger
+from src.exception import MyException
+from src.constants import INFERENCE_EXECUTOR, INFERENCE_WORKERS, TORCH_NUM_THREADS
+from . import model_loader
+from .preprocess_image import preprocess_bytes, preprocess_array, normalize_batch
+from .predictor import predict_batch, predict_with_embedding
+from .phash import perceptual_hash
+from . import cascade
+from .tta import predict_tta
+
+
+# Global executor shared by every request , created on startup
+executor = None
+
+
+
+def decode_and_preprocess(content):
+
+    """
+    Decodes uploaded bytes and turns them into the (1,3,224,224) tensor the model expects
+    (uint8 with the tensor preprocessing backend). Runs inside the inference executor.
+    """
+
+    return preprocess_bytes(content, model_loader.serving_device())
+
+
+
+def decode_preprocess_and_hash(content):
+
+    """ Same as decode_and_preprocess , plus the perceptual hash of the preprocessed image """
+
+    image_tensor = preprocess_bytes(content, model_loader.serving_device())
+    return image_tensor, perceptual_hash(image_tensor)
+
+
+
+def preprocess_raw_array(content, height, width):
+
+    """ Preprocesses a packed (H,W,3) uint8 RGB body , already decoded by the client """
+
+    return preprocess_array(content, height, width)
+
+
+
+def forward_batch(batch_tensor, top_k=None, warmup=False):
+
+    """
+    Runs the model over a stacked batch and returns one result per image (top_k classes each , None for all).
+    Runs inside the inference executor , using whatever model is loaded in that worker.
+    Warm-up batches run the cascade too , but stay out of its routing stats.
+    """
+
+    # uint8 batches come from the tensor preprocessing backend and get normalized in one go
+    if batch_tensor.dtype == torch.uint8:
+        batch_tensor = normalize_batch(batch_tensor)
+
+    # the whole batch runs on the version it started with , even if a reload swaps the model meanwhile
+    with model_loader.use_model() as handle:
+        results = predict_batch(handle.model, handle.label_encoder, batch_tensor, handle.device, top_k, cascade.default_cascade, not warmup)
+
+    for result in results:
+        result["model_version"] = handle.version
+
+    return results
+
+
+
+def forward_tta(image_tensor, views, method, top_k=None):
+
+    """ Test time augmentation of one preprocessed image , all views in one batched forward pass """
+
+    if image_tensor.dtype == torch.uint8:
+        image_tensor = normalize_batch(image_tensor)
+
+    with model_loader.use_model() as handle:
+        result = predict_tta(handle.model, handle.label_encoder, image_tensor, handle.device, views, method, top_k)
+
+    result["model_version"] = handle.version
+    return result
+
+
+
+def forward_embed(image_tensor, top_k=None):
+
+    """ Prediction and embedding of one preprocessed image from a single forward pass , returns (result , embedding) """
+
+    if image_tensor.dtype == torch.uint8:
+        image_tensor = normalize_batch(image_tensor)
+
+    with model_loader.use_model() as handle:
+        results, embeddings = predict_with_embedding(handle.model, handle.label_encoder, image_tensor, handle.device, top_k)
+
+    result = results[0]
+    result["model_version"] = handle.version
+    return result, embeddings[0]
+
+
+
+def _init_process_worker(num_threads, version=None):
+
+    """ Every worker process pins its torch thread budget and loads its own copy of the model """
+
+    if num_threads > 0:
+        torch.set_num_threads(num_threads)
+
+    model_loader.load_model_safe(version=version)
+
+
+
+def _warm_worker(barrier, timeout):
+
+    """
+    Warm-up inside a process worker : one decode , then the dummy passes on the model its initializer loaded.
+    Every task waits on the barrier first , so no worker can pick up a second task before all of them got one.
+    """
+
+    from .warmup import warm_handle, dummy_upload
+
+    barrier.wait(timeout)
+
+    decode_and_preprocess(dummy_upload())
+    warm_handle(model_loader.current)
+    return os.getpid()
+
+
+
+def create_executor(kind=INFERENCE_EXECUTOR, max_workers=INFERENCE_WORKERS, num_threads=TORCH_NUM_THREADS, version=None):
+
+    """
+    Creates an inference executor , either a thread pool sharing the already loaded model
+    or a process pool where every worker loads its own model (the given registry version , or the active one).
+    """
+
+    if kind == 'thread':
+
+        # torch thread budget is process wide , so it is set once for the whole pool
+        if num_threads > 0:
+            torch.set_num_threads(num_threads)
+
+        new_executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='inference')
+
+    elif kind == 'process':
+
+        # spawn instead of fork , forking after torch started its thread pools can deadlock
+        new_executor = ProcessPoolExecutor(
+            max_workers=max_workers,
+            mp_context=multiprocessing.get_context('spawn'),
+            initializer=_init_process_worker,
+            initargs=(num_threads, version),
+        )
+
+    else:
+        raise MyException(f"Unknown inference executor '{kind}' , expected 'thread' or 'process'", sys)
+
+    logger.info(f'Inference executor started : {kind} pool with {max_workers} worker(s), torch threads : {torch.get_num_threads()}')
+
+    return new_executor
+
+
+
+def start_executor(kind=INFERENCE_EXECUTOR, max_workers=INFERENCE_WORKERS, num_threads=TORCH_NUM_THREADS, version=None):
+
+    """ Creates the global executor shared by every request , once """
+
+    global executor
+
+    if executor is None:
+        executor = create_executor(kind, max_workers, num_threads, version)
+
+    return executor
+
+
+
+def prepare_process_executor(version=None, max_workers=INFERENCE_WORKERS, timeout=600):
+
+    """
+    Starts a process pool on version and warms it up before it takes any traffic : one warm-up task per worker ,
+    held at a barrier until every worker has one , so each worker loads the model and runs the dummy passes exactly once.
+    Blocking , used by a hot reload from a background thread.
+    """
+
+    new_executor = create_executor('process', max_workers, version=version)
+
+    try:
+        with multiprocessing.get_context('spawn').Manager() as manager:
+            barrier = manager.Barrier(max_workers)
+            futures = [new_executor.submit(_warm_worker, barrier, timeout) for _ in range(max_workers)]
+            workers = {future.result() for future in futures}
+
+        if len(workers) != max_workers:
+            raise MyException(f'Warm-up reached {len(workers)} of {max_workers} process workers', sys)
+
+    except Exception:
+        new_executor.shutdown(wait=False, cancel_futures=True)
+        raise
+
+    logger.info(f'Process pool for model version {version} warmed up in all {len(workers)} worker(s)')
+    return new_executor
+
+
+
+def replace_executor(new_executor):
+
+    """
+    Swaps in a fresh (already warm) executor and drains the old one in the background ,
+    used after a hot reload so process workers serve the new model version
+    """
+
+    global executor
+
+    old_executor = executor
+    executor = new_executor
+
+    if old_executor is not None:
+        # waits for the work already submitted without blocking the caller
+        threading.Thread(target=old_executor.shutdown, kwargs={'wait': True}, daemon=True).start()
+
+
+
+def shutdown_executor():
+
+    global executor
+
+    if executor is not None:
+        executor.shutdown(wait=True, cancel_futures=True)
+        executor = None
+        logger.info('Inference executor stopped')
+
+
+
+async def run_in_executor(fn, *args):
+
+    """ Runs a blocking function in the inference executor without blocking the event loop """
+
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(executor, functools.partial(fn, *args))
@@ -0,0 +1,62 @@
+import os
+import torch
+from .preprocess_image import preprocess_bytes, normalize_batch
+
+
+# file extensions treated as images when walking a folder
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.bmp', '.webp', '.tif', '.tiff')
+
+
+
+def is_image_file(name):
+    return name.lower().endswith(IMAGE_EXTENSIONS)
+
+
+
+def list_images(folder):
+
+    """
+    Returns every image path under folder (recursively) , sorted so runs are reproducible
+    """
+
+    paths = []
+    for root, _, files in os.walk(folder):
+        for name in files:
+            if is_image_file(name):
+                paths.append(os.path.join(root, name))
+
+    return sorted(paths)
+
+
+
+def list_labeled_images(folder):
+
+    """
+    Returns (path , label) pairs for a folder laid out as folder/<class name>/<image>
+    """
+
+    samples = []
+    for label in sorted(os.listdir(folder)):
+        class_dir = os.path.join(folder, label)
+        if os.path.isdir(class_dir):
+            samples.extend((path, label) for path in list_images(class_dir))
+
+    return samples
+
+
+
+def load_image_batches(paths, batch_size, device='cpu'):
+
+    """
+    Yields preprocessed (N,3,224,224) float batches of the given image files , in order ,
+    through the same preprocessing as the API (uint8 batches of the tensor backend get normalized)
+    """
+
+    for start in range(0, len(paths), batch_size):
+        tensors = []
+        for path in paths[start:start + batch_size]:
+            with open(path, 'rb') as f:
+                tensors.append(preprocess_bytes(f.read(), device))
+
+        batch = torch.cat(tensors, dim=0)
+        yield normalize_batch(batch) if batch.dtype == torch.uint8 else batch
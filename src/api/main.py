@@ -1,24 +1,139 @@
-from fastapi import FastAPI, File, UploadFile, HTTPException
+from fastapi import FastAPI, File, UploadFile, HTTPException, Request, Query
+from typing import List, Optional
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import JSONResponse
+from fastapi.responses import JSONResponse, Response
+from starlette.requests import ClientDisconnect
 from src.logger import logger
-from .model_loader import load_model_safe, device
+from src.constants import BATCH_ENDPOINT_CHUNK_SIZE, MAX_FILES_PER_REQUEST, CACHE_ENABLED, PHASH_ENABLED, MODEL_REGISTRY_DIR, ADMIN_TOKEN, SIMILARITY_INDEX_DIR, SIMILARITY_MAX_K
+from .model_loader import load_model_safe
 from . import model_loader
-from .preprocess_image import apply_transformation
-from .predictor import predict_image
-from PIL import Image
-import io
+from .batcher import MicroBatcher
+from .cache import PredictionCache
+from .memory import process_memory
+from .metrics import (
+    REQUESTS, IN_FLIGHT, REQUEST_LATENCY, UPLOAD_BYTES, SHED, endpoint_label, stage_timer, record_error, render_metrics,
+)
+from .phash import NearDuplicateIndex
+from . import warmup
+from . import cascade
+from .tta import TTA_VIEWS, TTA_AGGREGATES
+from .admission import AdmissionController, DeadlineExceeded, ADMITTED_ENDPOINTS, parse_deadline, check_deadline
+from .registry import ModelReloader, read_manifest
+from .similarity import open_index
+from .predictor import trim_prediction, covers_top_k, compact_prediction
+from .upload import read_upload, check_image_header, max_request_bytes, RequestSizeLimit
+from .binary import (
+    read_body, parse_image_shape, binary_response, wants, IMAGE_CONTENT_TYPES, ARRAY_CONTENT_TYPE, FLOAT32_MEDIA_TYPE, SHAPE_HEADER,
+)
+import asyncio
+import time
+import torch
+from .executor import start_executor, shutdown_executor, run_in_executor, decode_and_preprocess, decode_preprocess_and_hash, preprocess_raw_array, forward_batch, forward_tta, forward_embed
+
+try:
+    # orjson serializes the prediction payloads several times faster than the stdlib json encoder
+    import orjson
+    from fastapi.responses import ORJSONResponse as FastJSONResponse
+    ORJSON_AVAILABLE = True
+except ImportError:
+    FastJSONResponse = JSONResponse
+    ORJSON_AVAILABLE = False
 
 
 
 app = FastAPI(
     title='Skin disease classification API',
     description='AI - powered skin classifier API',
-    version="1.0.0"
+    version="1.0.0",
+    default_response_class=FastJSONResponse
 )
 
 
 
+# Collects concurrent /predict requests into one forward pass
+batcher = MicroBatcher(forward_batch)
+
+# Serves repeated uploads of the same image without decoding or running the model again
+prediction_cache = PredictionCache() if CACHE_ENABLED else None
+
+# Reuses predictions of re-encoded copies of an image that the exact byte cache misses
+near_duplicate_index = NearDuplicateIndex() if PHASH_ENABLED else None
+
+# Hot reload of model registry versions (admin endpoint , and the manifest watcher keeping every worker on the active version)
+model_reloader = ModelReloader() if MODEL_REGISTRY_DIR else None
+
+# Memory mapped similar case index behind /similar , built offline with python -m src.api.similarity
+similarity_index = open_index(SIMILARITY_INDEX_DIR) if SIMILARITY_INDEX_DIR else None
+
+# Bounds the prediction requests in flight , the rest are shed with 429
+admission = AdmissionController()
+
+
+
+# Middleware runs outermost-last-registered : CORS -> track_requests -> admission_control -> RequestSizeLimit -> endpoints ,
+# so the 429 / 413 answered early are still counted and carry the CORS headers
+
+# body size cap of the upload endpoints , enforced on the raw request stream
+app.add_middleware(RequestSizeLimit, limits={
+    path: max_request_bytes(MAX_FILES_PER_REQUEST if path == '/predict/batch' else 1)
+    for path in ('/predict', '/predict/batch', '/predict/raw', '/similar')
+})
+
+
+
+@app.middleware('http')
+async def admission_control(request: Request, call_next):
+
+    """
+    Turns prediction requests beyond MAX_IN_FLIGHT away with a fast 429 before their body is read ,
+    and attaches the request deadline (request.state.deadline) the endpoints check before decode and inference
+    """
+
+    if request.method != 'POST' or request.url.path not in ADMITTED_ENDPOINTS:
+        return await call_next(request)
+
+    endpoint = endpoint_label(request.url.path)
+
+    try:
+        request.state.deadline = parse_deadline(request.headers)
+    except HTTPException as e:
+        record_error(endpoint, e)
+        return JSONResponse(status_code=e.status_code, content={"detail": e.detail})
+
+    if not admission.try_admit():
+        SHED.labels(endpoint, 'overload').inc()
+        record_error(endpoint, HTTPException(status_code=429))
+        return JSONResponse(
+            status_code=429,
+            content={"detail": "Server busy , retry later"},
+            headers={"Retry-After": str(admission.retry_after)},
+        )
+
+    try:
+        return await call_next(request)
+    finally:
+        admission.release()
+
+
+
+@app.middleware('http')
+async def track_requests(request: Request, call_next):
+
+    """ Request count , in-flight gauge and end to end latency per endpoint """
+
+    endpoint = endpoint_label(request.url.path)
+    REQUESTS.labels(endpoint).inc()
+    IN_FLIGHT.labels(endpoint).inc()
+    start = time.perf_counter()
+
+    try:
+        return await call_next(request)
+    finally:
+        REQUEST_LATENCY.labels(endpoint).observe(time.perf_counter() - start)
+        IN_FLIGHT.labels(endpoint).dec()
+
+
+
 # Enable CORS for external clients
 app.add_middleware(
     CORSMiddleware,
@@ -36,12 +151,42 @@ async def startup():
     try:
         load_model_safe()  
         logger.info('Model loaded successfully during startup')
+        start_executor()
+        await batcher.start()
+
+        # warming up in the background , /health answers right away and /ready once the model is warm
+        app.state.warmup_task = asyncio.create_task(warmup.warm_up())
+
+        if model_reloader is not None:
+            model_reloader.start_watching()
+
+        if prediction_cache is not None:
+            prediction_cache.start_sweeping()
     except Exception as e:
         logger.error(f'Startup failed: {str(e)}')
         raise e
 
 
 
+@app.on_event('shutdown')
+async def shutdown():
+    logger.info('Shutting down API')
+
+    warmup_task = getattr(app.state, 'warmup_task', None)
+    if warmup_task is not None and not warmup_task.done():
+        warmup_task.cancel()
+
+    if model_reloader is not None:
+        await model_reloader.stop_watching()
+
+    if prediction_cache is not None:
+        await prediction_cache.stop_sweeping()
+
+    await batcher.stop()
+    shutdown_executor()
+
+
+
 @app.get('/')
 async def root():
     return {
@@ -55,52 +200,510 @@ async def root():
 
 @app.get('/health')
 async def health_check():
-    return {
-        'Status': 'healthy',
-        'Model loaded': 'Successfully',
-        'device': str(device)
-    }
+    """Liveness , fails only when no model is loaded"""
+
+    model_loaded = model_loader.model is not None and model_loader.label_encoder is not None
 
+    return FastJSONResponse(status_code=200 if model_loaded else 503, content={
+        'Status': 'healthy' if model_loaded else 'unhealthy',
+        'Model loaded': 'Successfully' if model_loaded else 'Not loaded',
+        'model_version': model_loader.model_version,
+        'ready': warmup.ready,
+        'device': str(model_loader.serving_device()),
+        'json_encoder': 'orjson' if ORJSON_AVAILABLE else 'json',
+        'batching': batcher.stats(),
+        'admission': admission.stats(),
+        'cascade': cascade.default_cascade.stats() if cascade.default_cascade is not None else None,
+        'cache': prediction_cache.stats() if prediction_cache is not None else None,
+        'near_duplicates': near_duplicate_index.stats() if near_duplicate_index is not None else None,
+        'similarity_index': similarity_index.stats() if similarity_index is not None else None
+    })
+
+
+
+@app.get('/ready')
+async def readiness():
+    """Readiness , passes only once the model is loaded and warmed up , so no traffic reaches a cold instance"""
+
+    is_ready = warmup.ready and model_loader.model is not None
+
+    return FastJSONResponse(status_code=200 if is_ready else 503, content={
+        'ready': is_ready,
+        'model_version': model_loader.model_version,
+        'warmup': warmup.report,
+    })
+
+
+
+
+@app.get('/memory')
+async def memory_usage():
+    """Memory of the worker that served this request , Pss shows the share of the mapped weights"""
+    return process_memory()
+
+
+
+
+@app.get('/metrics')
+async def metrics():
+    """Prometheus metrics : per-stage latency histograms , request / error counters , in-flight requests and image sizes"""
+    body, content_type = render_metrics()
+    return Response(content=body, media_type=content_type)
+
+
+
+
+def num_classes():
+    return len(model_loader.label_encoder.classes_)
 
 
 
 @app.post('/predict')
-async def predict_skin_disease(file: UploadFile = File(...)):
-    """Predicts skin disease from an uploaded image"""
+async def predict_skin_disease(
+    request: Request,
+    file: UploadFile = File(...),
+    top_k: Optional[int] = Query(None, ge=1, description="only return the top_k most likely classes"),
+    compact: bool = Query(False, description="array based response : classes and scores , highest first"),
+    tta: Optional[str] = Query(None, description=f"test time augmentation views : {', '.join(TTA_VIEWS)}"),
+    tta_aggregate: str = Query('mean', description="how the views are combined : mean or geometric"),
+):
+    """
+    Predicts skin disease from an uploaded image.
+    Response : Success , prediction (or classes and scores with compact=true) , filename , cached ,
+    near_duplicate ({reused , hamming_distance} , reused false when the model ran) and model_version ,
+    the same keys for fresh , cached and near-duplicate results.
+    """
 
     if model_loader.model is None or model_loader.label_encoder is None:
         logger.error('Model not Loaded')
+        record_error('/predict', HTTPException(status_code=503))
         raise HTTPException(status_code=503, detail="Model not available, try again later :(")
 
+    if tta is not None and (tta not in TTA_VIEWS or tta_aggregate not in TTA_AGGREGATES):
+        record_error('/predict', HTTPException(status_code=400))
+        raise HTTPException(status_code=400, detail=f"tta must be one of {list(TTA_VIEWS)} and tta_aggregate one of {list(TTA_AGGREGATES)}")
+
+    started = time.perf_counter()
+    deadline = getattr(request.state, 'deadline', None)
+
+    # the caches hold plain predictions , TTA requests neither read nor fill them
+    cache = prediction_cache if tta is None else None
+    near_index = near_duplicate_index if tta is None else None
+
     try:
      
-        content = await file.read()
+        # streamed with a byte cap , an oversized upload is rejected without being buffered
+        with stage_timer('read'):
+            content = await read_upload(file)
+        UPLOAD_BYTES.observe(len(content))
+
         if len(content) == 0:
             raise HTTPException(status_code=400, detail="Received Empty file")
 
-        # Open image
-        image = Image.open(io.BytesIO(content))
-        if image.mode != 'RGB':
-            image = image.convert('RGB')
+        # header only , decompression bombs and huge images never reach the decoder
+        check_image_header(content)
 
-        # Preprocess for EfficientNet-B3
-        image = apply_transformation(image, device)
+        # Same bytes already predicted by the same model version
+        prediction = None
+        model_version = model_loader.model_version
+        if cache is not None:
+            cache_key, prediction = await cache.lookup(content, model_version)
 
-        # Prediction
-        prediction = predict_image(model_loader.model, model_loader.label_encoder, image, device)
-        logger.info(f'Prediction successful: {prediction.get("predicted_class","Unknown")}')
+            # an entry computed for a smaller top_k cannot answer this request
+            if prediction is not None and not covers_top_k(prediction, top_k, num_classes()):
+                prediction = None
 
-        # Return structured JSON
-        return JSONResponse(
+        cached = prediction is not None
+        near_duplicate = None
+
+        if not cached:
+            # work that can no longer be answered in time is dropped instead of computed
+            check_deadline(deadline, 'decode', '/predict')
+
+            # Decode and preprocess for EfficientNet-B3 in the inference executor ,
+            # so the event loop keeps serving other uploads and health checks
+            if near_index is not None:
+                image, image_hash = await run_in_executor(decode_preprocess_and_hash, content)
+                prediction, distance = near_index.lookup(image_hash, model_version)
+                if prediction is not None and not covers_top_k(prediction, top_k, num_classes()):
+                    prediction = None
+                if prediction is not None:
+                    near_duplicate = {"reused": True, "hamming_distance": distance}
+            else:
+                image = await run_in_executor(decode_and_preprocess, content)
+
+            if prediction is None:
+                check_deadline(deadline, 'inference', '/predict')
+
+            if prediction is None and tta is not None:
+                # every augmented view in one batched forward pass , aggregated into one prediction
+                prediction = await run_in_executor(forward_tta, image, tta, tta_aggregate, top_k)
+                model_version = prediction["model_version"]
+
+            elif prediction is None:
+                # Prediction , batched together with other concurrent requests
+                prediction = await batcher.submit(image, top_k, deadline)
+
+                # a hot reload may have swapped the model while this request waited
+                model_version = prediction.get("model_version", model_version)
+
+                if near_index is not None:
+                    near_index.add(image_hash, prediction, model_version)
+
+            if cache is not None:
+                await cache.store(cache_key, prediction, model_version)
+
+        # one structured record per request , formatted lazily on the log writer thread
+        logger.info(
+            'event=prediction filename=%s bytes=%d class=%s confidence=%.4f cached=%s near_duplicate=%s model_version=%s latency_ms=%.1f',
+            file.filename, len(content), prediction.get("predicted_class", "Unknown"), prediction.get("confidence", 0.0),
+            cached, near_duplicate is not None, model_version, (time.perf_counter() - started) * 1000,
+        )
+
+        prediction = trim_prediction(prediction, top_k)
+
+        # Return structured JSON , the same envelope whether the result was computed , cached or reused
+        with stage_timer('serialize'):
+            body = compact_prediction(prediction) if compact else {"prediction": prediction}
+
+            return FastJSONResponse(
+                content={
+                    "Success": True,
+                    **body,
+                    "filename": file.filename,
+                    "cached": cached,
+                    "near_duplicate": near_duplicate or {"reused": False},
+                    "model_version": model_version,
+                }
+            )
+
+    except DeadlineExceeded as e:
+        record_error('/predict', HTTPException(status_code=504))
+        raise HTTPException(status_code=504, detail=str(e))
+    except HTTPException as e:
+        record_error('/predict', e)
+        raise
+    except Exception as e:
+        record_error('/predict', e)
+        logger.error(f"Prediction failed: {str(e)}")
+        raise HTTPException(status_code=500, detail=f"Prediction failed: {str(e)}")
+
+
+
+@app.post('/predict/batch')
+async def predict_skin_disease_batch(
+    request: Request,
+    files: List[UploadFile] = File(...),
+    top_k: Optional[int] = Query(None, ge=1, description="only return the top_k most likely classes"),
+    compact: bool = Query(False, description="array based predictions : classes and scores , highest first"),
+):
+    """Predicts skin disease for many uploaded images , results are returned in upload order"""
+
+    if model_loader.model is None or model_loader.label_encoder is None:
+        logger.error('Model not Loaded')
+        record_error('/predict/batch', HTTPException(status_code=503))
+        raise HTTPException(status_code=503, detail="Model not available, try again later :(")
+
+    if len(files) > MAX_FILES_PER_REQUEST:
+        record_error('/predict/batch', HTTPException(status_code=400))
+        raise HTTPException(status_code=400, detail=f"Too many files , at most {MAX_FILES_PER_REQUEST} per request")
+
+    deadline = getattr(request.state, 'deadline', None)
+
+    try:
+
+        # one result slot per file , a bad file only fails its own slot
+        results = [None] * len(files)
+
+
+        async def prepare(file):
+            with stage_timer('read'):
+                content = await read_upload(file)
+            UPLOAD_BYTES.observe(len(content))
+
+            if len(content) == 0:
+                raise HTTPException(status_code=400, detail="Received Empty file")
+
+            check_image_header(content)
+            check_deadline(deadline, 'decode', '/predict/batch')
+            return await run_in_executor(decode_and_preprocess, content)
+
+
+        # reading , decoding and preprocessing all files in parallel
+        tensors = await asyncio.gather(*(prepare(file) for file in files), return_exceptions=True)
+
+        valid = []
+        for index, tensor in enumerate(tensors):
+            if isinstance(tensor, HTTPException):
+                results[index] = {"Success": False, "error": tensor.detail, "status_code": tensor.status_code, "filename": files[index].filename}
+            elif isinstance(tensor, DeadlineExceeded):
+                results[index] = {"Success": False, "error": str(tensor), "status_code": 504, "filename": files[index].filename}
+            elif isinstance(tensor, Exception):
+                results[index] = {"Success": False, "error": str(tensor), "status_code": 500, "filename": files[index].filename}
+            else:
+                valid.append(index)
+
+
+        # running the decoded images through the model in memory sized chunks
+        for start in range(0, len(valid), BATCH_ENDPOINT_CHUNK_SIZE):
+            chunk = valid[start:start + BATCH_ENDPOINT_CHUNK_SIZE]
+
+            try:
+                check_deadline(deadline, 'inference', '/predict/batch')
+                stacked = torch.cat([tensors[index] for index in chunk], dim=0)
+                predictions = await run_in_executor(forward_batch, stacked, top_k)
+            except DeadlineExceeded as e:
+                for index in chunk:
+                    results[index] = {"Success": False, "error": str(e), "status_code": 504, "filename": files[index].filename}
+                continue
+            except Exception as e:
+                logger.error(f"Batch chunk prediction failed: {str(e)}")
+                for index in chunk:
+                    results[index] = {"Success": False, "error": f"Prediction failed: {str(e)}", "status_code": 500, "filename": files[index].filename}
+                continue
+
+            for index, prediction in zip(chunk, predictions):
+                if compact:
+                    results[index] = {"Success": True, **compact_prediction(prediction), "filename": files[index].filename,
+                                      "model_version": prediction["model_version"]}
+                else:
+                    results[index] = {"Success": True, "prediction": prediction, "filename": files[index].filename}
+
+
+        logger.info('event=batch_prediction files=%d decoded=%d', len(files), len(valid))
+
+        return FastJSONResponse(
             content={
                 "Success": True,
-                "prediction": prediction,
-                "filename": file.filename,
+                "count": len(files),
+                "results": results,
             }
         )
 
-    except HTTPException:
+    except HTTPException as e:
+        record_error('/predict/batch', e)
         raise
     except Exception as e:
-        logger.error(f"Prediction failed: {str(e)}")
-        raise HTTPException(status_code=500, detail=f"Prediction failed: {str(e)}")
+        record_error('/predict/batch', e)
+        logger.error(f"Batch prediction failed: {str(e)}")
+        raise HTTPException(status_code=500, detail=f"Batch prediction failed: {str(e)}")
+
+
+
+@app.post('/predict/raw')
+async def predict_skin_disease_raw(
+    request: Request,
+    top_k: Optional[int] = Query(None, ge=1, description="only return the top_k most likely classes (ignored for packed float32)"),
+):
+    """
+    Predicts skin disease from a raw request body , for machine clients.
+    Body : an encoded image (Content-Type image/jpeg , image/png , ...) or a packed uint8 RGB array
+    (Content-Type application/octet-stream with an X-Image-Shape: height,width,3 header) that skips decoding.
+    Response : MessagePack (Accept: application/msgpack) , little endian float32 probabilities in label
+    encoder class order (Accept: application/octet-stream) , or JSON otherwise.
+    """
+
+    if model_loader.model is None or model_loader.label_encoder is None:
+        logger.error('Model not Loaded')
+        record_error('/predict/raw', HTTPException(status_code=503))
+        raise HTTPException(status_code=503, detail="Model not available, try again later :(")
+
+    started = time.perf_counter()
+    deadline = getattr(request.state, 'deadline', None)
+    content_type = request.headers.get('content-type', '').split(';')[0].strip().lower()
+    accept = request.headers.get('accept')
+
+    try:
+
+        with stage_timer('read'):
+            content = await read_body(request)
+        UPLOAD_BYTES.observe(len(content))
+
+        if len(content) == 0:
+            raise HTTPException(status_code=400, detail="Received Empty body")
+
+        check_deadline(deadline, 'decode', '/predict/raw')
+
+        if content_type == ARRAY_CONTENT_TYPE:
+            # already decoded by the client , only resize / crop / normalize are left
+            height, width = parse_image_shape(request.headers.get(SHAPE_HEADER), len(content))
+            image = await run_in_executor(preprocess_raw_array, content, height, width)
+
+        elif content_type in IMAGE_CONTENT_TYPES:
+            check_image_header(content)
+            image = await run_in_executor(decode_and_preprocess, content)
+
+        else:
+            raise HTTPException(
+                status_code=415,
+                detail=f"Unsupported Content-Type '{content_type}' , send an image or {ARRAY_CONTENT_TYPE} with {SHAPE_HEADER}",
+            )
+
+        # the packed float32 response always carries every class
+        packed = wants(accept, (FLOAT32_MEDIA_TYPE,))
+        check_deadline(deadline, 'inference', '/predict/raw')
+        prediction = await batcher.submit(image, None if packed else top_k, deadline)
+        model_version = prediction["model_version"]
+
+        logger.info(
+            'event=raw_prediction content_type=%s bytes=%d class=%s confidence=%.4f model_version=%s latency_ms=%.1f',
+            content_type, len(content), prediction["predicted_class"], prediction["confidence"],
+            model_version, (time.perf_counter() - started) * 1000,
+        )
+
+        with stage_timer('serialize'):
+            response = binary_response(prediction, accept, model_loader.label_encoder.classes_, model_version)
+            if response is not None:
+                return response
+
+            return FastJSONResponse(content={"Success": True, "prediction": prediction, "model_version": model_version})
+
+    except DeadlineExceeded as e:
+        record_error('/predict/raw', HTTPException(status_code=504))
+        raise HTTPException(status_code=504, detail=str(e))
+    except HTTPException as e:
+        record_error('/predict/raw', e)
+        raise
+    except ClientDisconnect:
+        # client gone , or a body cut off by RequestSizeLimit which answers and counts the 413 itself
+        raise
+    except Exception as e:
+        record_error('/predict/raw', e)
+        logger.error(f"Raw prediction failed: {str(e)}")
+        raise HTTPException(status_code=500, detail=f"Raw prediction failed: {str(e)}")
+
+
+
+def require_admin(request: Request):
+
+    """ Admin endpoints are disabled unless ADMIN_TOKEN is set , and then need it in X-Admin-Token """
+
+    if not ADMIN_TOKEN:
+        raise HTTPException(status_code=403, detail="Admin endpoints are disabled , set ADMIN_TOKEN to enable them")
+
+    if request.headers.get('x-admin-token') != ADMIN_TOKEN:
+        raise HTTPException(status_code=401, detail="Invalid admin token")
+
+
+
+@app.get('/models')
+async def list_models():
+    """Model registry versions , the active one and the one serving in this worker"""
+
+    return {
+        'serving': model_loader.model_version,
+        'registry': read_manifest() if MODEL_REGISTRY_DIR else None,
+        'reloader': model_reloader.stats() if model_reloader is not None else None,
+    }
+
+
+
+@app.post('/admin/models/reload')
+async def reload_model(request: Request, version: Optional[str] = Query(None, description="registry version , the manifest's active one by default")):
+    """
+    Loads and warms a registry version in the background while the current one keeps serving ,
+    swaps it in between batches and drains the old one. With a version it also becomes the active one ,
+    and the other workers follow through their manifest watcher (MODEL_WATCH_INTERVAL).
+    """
+
+    require_admin(request)
+
+    if model_reloader is None:
+        raise HTTPException(status_code=409, detail="No model registry configured , set MODEL_REGISTRY_DIR")
+
+    try:
+        if version is not None:
+            return await model_reloader.activate(version)
+        return await model_reloader.reload()
+
+    except Exception as e:
+        logger.error(f"Model reload failed: {str(e)}")
+        raise HTTPException(status_code=500, detail=f"Model reload failed: {str(e)}")
+
+
+
+@app.post('/similar')
+async def similar_cases(
+    request: Request,
+    file: UploadFile = File(...),
+    k: int = Query(5, ge=1, le=SIMILARITY_MAX_K, description="number of similar reference cases to return"),
+    top_k: Optional[int] = Query(None, ge=1, description="only return the top_k most likely classes"),
+    nprobe: Optional[int] = Query(None, ge=1, description="inverted lists scanned on an IVF index"),
+):
+    """
+    Predicts skin disease and returns the most similar confirmed reference cases.
+    The prediction and the embedding used for the search come from the same forward pass.
+    """
+
+    if model_loader.model is None or model_loader.label_encoder is None:
+        logger.error('Model not Loaded')
+        record_error('/similar', HTTPException(status_code=503))
+        raise HTTPException(status_code=503, detail="Model not available, try again later :(")
+
+    if similarity_index is None:
+        record_error('/similar', HTTPException(status_code=503))
+        raise HTTPException(status_code=503, detail="Similar case index not loaded , set SIMILARITY_INDEX_DIR")
+
+    started = time.perf_counter()
+    deadline = getattr(request.state, 'deadline', None)
+
+    try:
+
+        with stage_timer('read'):
+            content = await read_upload(file)
+        UPLOAD_BYTES.observe(len(content))
+
+        if len(content) == 0:
+            raise HTTPException(status_code=400, detail="Received Empty file")
+
+        check_image_header(content)
+
+        check_deadline(deadline, 'decode', '/similar')
+        image = await run_in_executor(decode_and_preprocess, content)
+
+        check_deadline(deadline, 'inference', '/similar')
+        prediction, embedding = await run_in_executor(forward_embed, image, top_k)
+        model_version = prediction["model_version"]
+
+        # embeddings of different model versions live in different spaces , comparing them is meaningless
+        if model_version != similarity_index.model_version:
+            raise HTTPException(
+                status_code=409,
+                detail=f"Similar case index was built with model version {similarity_index.model_version} , "
+                       f"serving {model_version} , rebuild the index",
+            )
+
+        # the mapped vectors are scanned off the event loop
+        with stage_timer('similarity_search'):
+            similar = await asyncio.to_thread(similarity_index.search, embedding, k, nprobe)
+
+        logger.info(
+            'event=similar filename=%s class=%s confidence=%.4f k=%d model_version=%s latency_ms=%.1f',
+            file.filename, prediction["predicted_class"], prediction["confidence"], k,
+            model_version, (time.perf_counter() - started) * 1000,
+        )
+
+        with stage_timer('serialize'):
+            return FastJSONResponse(
+                content={
+                    "Success": True,
+                    "prediction": prediction,
+                    "similar": similar,
+                    "filename": file.filename,
+                    "model_version": model_version,
+                }
+            )
+
+    except DeadlineExceeded as e:
+        record_error('/similar', HTTPException(status_code=504))
+        raise HTTPException(status_code=504, detail=str(e))
+    except HTTPException as e:
+        record_error('/similar', e)
+        raise
+    except ClientDisconnect:
+        # client gone , or a body cut off by RequestSizeLimit which answers and counts the 413 itself
+        raise
+    except Exception as e:
+        record_error('/similar', e)
+        logger.error(f"Similar case search failed: {str(e)}")
+        raise HTTPException(status_code=500, detail=f"Similar case search failed: {str(e)}")
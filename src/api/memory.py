@@ -0,0 +1,32 @@
+import os
+import resource
+
+
+# fields of /proc/self/smaps_rollup reported per worker
+SMAPS_FIELDS = ('Rss', 'Pss', 'Shared_Clean', 'Shared_Dirty', 'Private_Clean', 'Private_Dirty', 'Anonymous')
+
+
+
+def process_memory():
+
+    """
+    Memory of the current worker process in MB.
+    Rss counts shared pages (mapped weights) fully in every worker , Pss splits them between the
+    processes sharing them , so summing Pss over all workers gives the real footprint.
+    """
+
+    info = {'pid': os.getpid()}
+
+    try:
+        with open('/proc/self/smaps_rollup') as f:
+            for line in f:
+                parts = line.split()
+                field = parts[0].rstrip(':')
+                if field in SMAPS_FIELDS:
+                    info[f'{field.lower()}_mb'] = int(parts[1]) / 1024
+
+    except OSError:
+        # not on Linux , only the peak resident size is available
+        info['max_rss_mb'] = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+    return info
@@ -0,0 +1,87 @@
+import os
+import time
+from contextlib import contextmanager
+from fastapi import HTTPException
+from prometheus_client import (
+    Counter, Gauge, Histogram, CollectorRegistry, REGISTRY, CONTENT_TYPE_LATEST, generate_latest, multiprocess,
+)
+
+
+# endpoints tracked by name , everything else is grouped as 'other' to keep label cardinality bounded
+TRACKED_ENDPOINTS = ('/', '/health', '/ready', '/memory', '/metrics', '/predict', '/predict/batch', '/predict/raw', '/similar', '/models', '/admin/models/reload')
+
+# latency buckets in seconds , from sub millisecond stages up to slow batched forwards
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+REQUESTS = Counter('skin_api_requests_total', 'HTTP requests received', ['endpoint'])
+ERRORS = Counter('skin_api_errors_total', 'Failed requests by error type', ['endpoint', 'error_type'])
+IN_FLIGHT = Gauge('skin_api_in_flight_requests', 'Requests currently being handled', ['endpoint'], multiprocess_mode='livesum')
+SHED = Counter('skin_api_shed_total', 'Requests dropped without being computed , by reason', ['endpoint', 'reason'])
+REQUEST_LATENCY = Histogram('skin_api_request_seconds', 'End to end request latency', ['endpoint'], buckets=LATENCY_BUCKETS)
+
+STAGE_LATENCY = Histogram(
+    'skin_api_stage_seconds',
+    'Latency of each prediction stage (read , decode , preprocess , queue_wait , cascade_stage1 , forward , postprocess , similarity_search , serialize)',
+    ['stage'],
+    buckets=LATENCY_BUCKETS,
+)
+
+UPLOAD_BYTES = Histogram(
+    'skin_api_upload_bytes', 'Size of uploaded images in bytes',
+    buckets=(16e3, 64e3, 256e3, 1e6, 2e6, 4e6, 8e6, 16e6, 32e6),
+)
+IMAGE_PIXELS = Histogram(
+    'skin_api_image_pixels', 'Pixel count of uploaded images before decoding',
+    buckets=(0.1e6, 0.3e6, 1e6, 2e6, 4e6, 8e6, 12e6, 16e6, 24e6, 50e6),
+)
+
+CASCADE_IMAGES = Counter('skin_api_cascade_images_total', 'Images answered by each cascade stage', ['stage'])
+CASCADE_FALLBACKS = Counter('skin_api_cascade_fallbacks_total', 'Batches that fell back to the full model because cascade stage 1 failed')
+
+BATCH_SIZE = Histogram('skin_api_batch_size', 'Images per forward pass of the micro-batcher', buckets=(1, 2, 4, 8, 16, 32, 64))
+QUEUE_DEPTH = Gauge('skin_api_batch_queue_depth', 'Requests waiting in the micro-batcher queue', multiprocess_mode='livesum')
+
+
+
+def endpoint_label(path):
+    return path if path in TRACKED_ENDPOINTS else 'other'
+
+
+
+@contextmanager
+def stage_timer(stage):
+
+    """ Records the duration of the wrapped block in the stage latency histogram """
+
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        STAGE_LATENCY.labels(stage).observe(time.perf_counter() - start)
+
+
+
+def record_error(endpoint, error):
+
+    """ Counts a failed request , HTTP errors by status code and everything else by exception class """
+
+    error_type = f'http_{error.status_code}' if isinstance(error, HTTPException) else type(error).__name__
+    ERRORS.labels(endpoint, error_type).inc()
+
+
+
+def render_metrics():
+
+    """
+    Returns (body , content type) of the Prometheus exposition.
+    With several uvicorn workers set PROMETHEUS_MULTIPROC_DIR so every worker's samples get aggregated.
+    """
+
+    if os.getenv('PROMETHEUS_MULTIPROC_DIR'):
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+    else:
+        registry = REGISTRY
+
+    return generate_latest(registry), CONTENT_TYPE_LATEST
@@ -6,7 +6,14 @@ from sklearn.preprocessing import LabelEncoder
 from torchvision.models import efficientnet_b3
 from src.logger import logger
 from src.exception import MyException
+from src.constants import (
+    INFERENCE_BACKEND, ONNX_MODEL_PATH, MODEL_PRECISION, QUANTIZED_MODEL_PATH, OPTIMIZE_FOR_INFERENCE,
+    CHECKPOINT_PATH, WEIGHTS_FORMAT, SAFETENSORS_PATH, MODEL_CONFIG_PATH, SHARED_WEIGHTS, MODEL_REGISTRY_DIR,
+)
+from contextlib import contextmanager
+import threading
 import sys
+import hashlib
 
 
 # Global variable to store Model and label encoder 
@@ -14,12 +21,107 @@ import sys
 device = torch.device('cuda' if torch.cuda.is_available() else 'cpu')
 model = None
 label_encoder = None
+# identifies the loaded checkpoint , changes whenever a different checkpoint gets loaded
+model_version = None
+# the three above bundled , swapped as one reference on a hot reload
+current = None
+# taken by install and use_model , so a forward pass never acquires a handle that was already swapped out
+_swap_lock = threading.Lock()
 
 
-def get_custom_efficientb3(num_classes = 10):
 
+class ModelHandle:
+
+    """
+    One loaded model version and the device it runs on. Every forward pass holds the handle it started with ,
+    so after a hot reload the replaced version can be drained before it is released.
     """
-    This function create custom efficent b3 model which is being used while training
+
+    def __init__(self, model, label_encoder, version, handle_device = None):
+        self.model = model
+        self.label_encoder = label_encoder
+        self.version = version
+        self.device = handle_device if handle_device is not None else device
+        self.in_flight = 0
+        self._lock = threading.Lock()
+
+
+    def acquire(self):
+        with self._lock:
+            self.in_flight += 1
+
+
+    def release(self):
+        with self._lock:
+            self.in_flight -= 1
+
+
+
+def install(handle):
+
+    """ Makes handle the serving model , returns the handle it replaced (None on the first load) """
+
+    global current , model , label_encoder , model_version
+
+    # single reference swap , a batch either holds the old handle or sees the new one
+    with _swap_lock:
+        previous = current
+        current = handle
+        model, label_encoder, model_version = handle.model, handle.label_encoder, handle.version
+
+    return previous
+
+
+
+def serving_device():
+
+    """ Device of the serving model , the host default before anything is loaded """
+
+    handle = current
+    return handle.device if handle is not None else device
+
+
+
+@contextmanager
+def use_model():
+
+    """ Holds the serving model for one forward pass """
+
+    # reading and acquiring in one step , once install returned the replaced handle gets no new passes
+    with _swap_lock:
+        handle = current
+        if handle is None:
+            raise MyException('Model not loaded' , sys)
+        handle.acquire()
+
+    try:
+        yield handle
+    finally:
+        handle.release()
+
+
+
+def checkpoint_fingerprint(path, chunk_size = 4 * 1024 * 1024):
+
+    """
+    Checkpoint identity built from the file content , so copying or redeploying the same weights
+    keeps the version (caches and the similar case index are tied to it)
+    """
+
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            digest.update(chunk)
+
+    return digest.hexdigest()[:12]
+
+
+def get_custom_efficientb3(num_classes = 10, in_features = None, move_to_device = True):
+
+    """
+    This function create custom efficent b3 model which is being used while training.
+    When in_features is known (1536 for B3) the first head layer is a concrete Linear instead of LazyLinear ,
+    so the model can be built on the meta device and get its weights assigned directly
 
     """
 
@@ -34,7 +136,7 @@ def get_custom_efficientb3(num_classes = 10):
 
     model.classifier = nn.Sequential(
 
-        nn.LazyLinear(2000),
+        nn.LazyLinear(2000) if in_features is None else nn.Linear(in_features, 2000),
         nn.BatchNorm1d(2000), 
         nn.ReLU(),           
         nn.Dropout(0.4),      
@@ -55,100 +157,263 @@ def get_custom_efficientb3(num_classes = 10):
         nn.Linear(512, num_classes)
     )
 
-    model = model.to(device)
-    logger.info(f"Model created and moved to {device}")
+    if move_to_device:
+        model = model.to(device)
+        logger.info(f"Model created and moved to {device}")
 
     return model
 
 
 
-def load_model_safe():
+def load_onnx_model(onnx_path = ONNX_MODEL_PATH):
+
+    """ Loads the exported ONNX graph into ONNX Runtime , returns (model , label encoder , version) """
+
+    from .onnx_backend import OnnxModel
+
+    if not os.path.exists(onnx_path):
+        error_msg = f"ONNX model not found at {onnx_path} , export it with python -m src.api.onnx_backend"
+        logger.error(error_msg)
+        raise MyException(error_msg , sys)
+
+    logger.info(f"Loading ONNX model from : {onnx_path}")
+
+    onnx_model = OnnxModel(onnx_path)
+
+    return onnx_model, onnx_model.label_encoder(), checkpoint_fingerprint(onnx_path)
+
+
+
+def load_int8_model(quantized_path = QUANTIZED_MODEL_PATH):
+
+    """ Loads the INT8 quantized TorchScript artifact , returns (model , label encoder , version) """
+
+    from .quantize import load_quantized_model
+
+    if not os.path.exists(quantized_path):
+        error_msg = f"Quantized model not found at {quantized_path} , create it with python -m src.api.quantize"
+        logger.error(error_msg)
+        raise MyException(error_msg , sys)
+
+    if device.type != 'cpu':
+        # quantized kernels only exist for CPU , build_model pins this handle (not the process) to it
+        logger.warning("INT8 quantized model selected , inference will run on CPU")
+
+    logger.info(f"Loading INT8 quantized model from : {quantized_path}")
+
+    int8_model, int8_label_encoder = load_quantized_model(quantized_path)
+
+    return int8_model, int8_label_encoder, checkpoint_fingerprint(quantized_path)
+
 
-    """ Safely loads the trained model and label encoder from checkpoint file. """
 
-    global model , label_encoder
+def load_checkpoint_model(checkpoint_path = CHECKPOINT_PATH):
+
+    """ Loads the pickled .pth training checkpoint , returns (model , label encoder , version) """
+
+    if not os.path.exists(checkpoint_path):
+        error_msg = f"Model not found at {checkpoint_path}"
+        logger.error(error_msg)
+        raise MyException(error_msg , sys)
+    
+
+    logger.info(f"Loading checkpoint from  : {checkpoint_path}")
+
+
+    # Add numpy.dtype to safe globals as suggested in the warning
+    safe_globals = [
+        LabelEncoder,
+        np.ndarray,
+        np.dtype,  # Add this as suggested in the warning
+        np.core.multiarray._reconstruct,
+        np._core.multiarray._reconstruct,
+    ]
+
 
     try:
+        # Adding safe globals before attempting to load
+        torch.serialization.add_safe_globals(safe_globals)
+        
+        # loading safely first
+        checkpoint = torch.load(checkpoint_path, map_location=device, weights_only=True)
+
+
+
+    except Exception as safe_error:
+        # it is also safe bcz i trained it :)
+        logger.warning(f"Safe loading failed : {safe_error}")
+        logger.info(f"Attempting to load with weights_only = False")
+
+        checkpoint = torch.load(checkpoint_path, map_location=device, weights_only=False) 
+
+    # verifying that checkpoint contain required components or not
+    required_keys = ['label_encoder','model_state_dict']
+    missing_keys = [key for key in required_keys if key not in checkpoint]
+
+
+
+    if missing_keys:
+        error_msg = f"checkpoint file is missing required keys : {missing_keys}"
+        logger.error(error_msg)
+        raise MyException(error_msg,sys)
+
+
+
+    # fetching label encoder 
+    label_encoder = checkpoint['label_encoder']
+    num_classes = len(label_encoder.classes_)
+
+
+    logger.info(f"Found {num_classes} classes")
+
+
+
+    # creating model architecture with correct number of output classes
+    model = get_custom_efficientb3(num_classes=num_classes)
+
+    # Loading the trained weights into the model
+    model.load_state_dict(checkpoint['model_state_dict'])
+
+    return model, label_encoder, checkpoint_fingerprint(checkpoint_path)
 
-        logger.info('Starting model loading process.....')
 
-        checkpoint_path = 'model_path/best_skin_disease_model_enhanced.pth'
 
+def load_safetensors_model(weights_path = SAFETENSORS_PATH, config_path = MODEL_CONFIG_PATH):
 
-        if not os.path.exists(checkpoint_path):
-            error_msg = f"Model not found at {checkpoint_path}"
+    """
+    Loads the memory mapped safetensors weights and their JSON sidecar , returns (model , label encoder , version).
+    The model is built on the meta device with a concrete Linear head and the mapped tensors are assigned
+    directly , so no weights are copied and no LazyLinear has to be materialized
+    """
+
+    from .weights import load_safetensors_mmap, read_model_config
+
+    for path in (weights_path, config_path):
+        if not os.path.exists(path):
+            error_msg = f"Model weights not found at {path} , create them with python -m src.api.weights"
             logger.error(error_msg)
             raise MyException(error_msg , sys)
-        
 
-        logger.info(f"Loading checkpoint from  : {checkpoint_path}")
+    logger.info(f"Mapping weights from : {weights_path}")
 
+    config = read_model_config(config_path)
 
-        # Add numpy.dtype to safe globals as suggested in the warning
-        safe_globals = [
-            LabelEncoder,
-            np.ndarray,
-            np.dtype,  # Add this as suggested in the warning
-            np.core.multiarray._reconstruct,
-            np._core.multiarray._reconstruct,
-        ]
+    weights_label_encoder = LabelEncoder()
+    weights_label_encoder.classes_ = np.array(config['classes'])
 
+    with torch.device('meta'):
+        weights_model = get_custom_efficientb3(
+            num_classes=config['num_classes'], in_features=config['in_features'], move_to_device=False
+        )
 
-        try:
-            # Adding safe globals before attempting to load
-            torch.serialization.add_safe_globals(safe_globals)
-            
-            # loading safely first
-            checkpoint = torch.load(checkpoint_path, map_location=device, weights_only=True)
+    state_dict = load_safetensors_mmap(weights_path)
+    weights_model.load_state_dict(state_dict, assign=True)
 
+    if device.type != 'cpu':
+        weights_model = weights_model.to(device)
 
+    return weights_model, weights_label_encoder, checkpoint_fingerprint(weights_path)
 
-        except Exception as safe_error:
-            # it is also safe bcz i trained it :)
-            logger.warning(f"Safe loading failed : {safe_error}")
-            logger.info(f"Attempting to load with weights_only = False")
 
-            checkpoint = torch.load(checkpoint_path, map_location=device, weights_only=False) 
 
-        # verifying that checkpoint contain required components or not
-        required_keys = ['label_encoder','model_state_dict']
-        missing_keys = [key for key in required_keys if key not in checkpoint]
+def build_model(backend = INFERENCE_BACKEND, precision = MODEL_PRECISION, optimize = OPTIMIZE_FOR_INFERENCE,
+                weights_format = WEIGHTS_FORMAT, shared_weights = SHARED_WEIGHTS, artifact = None):
 
+    """
+    Loads a model without installing it and returns its ModelHandle.
+    artifact is a model registry entry , its format and paths take the place of the configured ones.
+    """
 
+    eager = True
+    handle_device = device
 
-        if missing_keys:
-            error_msg = f"checkpoint file is missing required keys : {missing_keys}"
-            logger.error(error_msg)
-            raise MyException(error_msg,sys)
+    if artifact is not None:
+        artifact_format = artifact['format']
 
+        if artifact_format == 'onnx':
+            loaded, eager = load_onnx_model(artifact['path']), False
+        elif artifact_format == 'int8':
+            loaded, eager, handle_device = load_int8_model(artifact['path']), False, torch.device('cpu')
+        elif artifact_format == 'safetensors':
+            loaded = load_safetensors_model(artifact['path'], artifact['config'])
+        elif artifact_format == 'pth':
+            loaded = load_checkpoint_model(artifact['path'])
+        else:
+            raise MyException(f"Unknown artifact format '{artifact_format}' for model version {artifact['version']}" , sys)
 
+        # registry versions are reported by their name
+        loaded = loaded[0], loaded[1], artifact['version']
 
-        # fetching label encoder 
-        label_encoder = checkpoint['label_encoder']
-        num_classes = len(label_encoder.classes_)
+    elif backend == 'onnx':
+        loaded, eager = load_onnx_model(), False
 
+    elif backend != 'torch':
+        raise MyException(f"Unknown inference backend '{backend}' , expected 'torch' or 'onnx'" , sys)
 
-        logger.info(f"Found {num_classes} classes")
+    elif precision == 'int8':
+        loaded, eager, handle_device = load_int8_model(), False, torch.device('cpu')
 
+    elif precision != 'fp32':
+        raise MyException(f"Unknown model precision '{precision}' , expected 'fp32' or 'int8'" , sys)
 
+    # 'auto' prefers the memory mapped safetensors weights when they exist ,
+    # shared weights need the mapped file
+    elif shared_weights or weights_format == 'safetensors' or (weights_format == 'auto' and os.path.exists(SAFETENSORS_PATH)):
+        loaded = load_safetensors_model()
 
-        # creating model architecture with correct number of output classes
-        model = get_custom_efficientb3(num_classes=num_classes)
+    else:
+        loaded = load_checkpoint_model()
 
-        # Loading the trained weights into the model
-        model.load_state_dict(checkpoint['model_state_dict'])
 
+    new_model, new_label_encoder, version = loaded
 
+    if eager:
         # setting model to eval mode , so dropout and batchnorm get disabled
-        model.eval()
+        new_model.eval()
+
+        # shared weights need the mapped file used as is , folding BatchNorm would give every worker a private copy
+        if optimize and shared_weights:
+            logger.info("Shared weights mode , skipping inference optimization to keep the mapped weights shared")
+
+        # folding BatchNorm / dropping Dropout and freezing the graph , verified against the eager model
+        elif optimize:
+            from .optimize import optimize_for_inference
+            new_model = optimize_for_inference(new_model, device)
+
+    return ModelHandle(new_model, new_label_encoder, version, handle_device)
+
+
+
+def load_model_safe(backend = INFERENCE_BACKEND, precision = MODEL_PRECISION, optimize = OPTIMIZE_FOR_INFERENCE,
+                    weights_format = WEIGHTS_FORMAT, shared_weights = SHARED_WEIGHTS,
+                    registry_dir = MODEL_REGISTRY_DIR, version = None):
+
+    """
+    Safely loads the trained model and label encoder and makes them the serving model.
+    With a model registry the active version (or the given one) is loaded , otherwise the configured artifact.
+    """
+
+    try:
+
+        logger.info('Starting model loading process.....')
+
+        artifact = None
+        if registry_dir:
+            from .registry import resolve_artifact
+            artifact = resolve_artifact(version, registry_dir)
+
+        handle = build_model(backend, precision, optimize, weights_format, shared_weights, artifact)
+        install(handle)
+
+        logger.info(f"Model version : {model_version}")
 
         logger.info(f"Model loaded successfully and set to evaluation mode")
-        logger.info(f"Model is running on: {device}")
+        logger.info(f"Model is running on: {handle.device}")
         logger.info(f"Available classes: {label_encoder.classes_.tolist()}")
 
+        return handle
+
     except Exception as e:
       error_msg = f"Failed to load model: {str(e)}"
       logger.error(error_msg)
       raise MyException(error_msg, sys)
-    
-
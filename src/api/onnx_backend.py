@@ -0,0 +1,146 @@
+import argparse
+import json
+import sys
+import numpy as np
+import torch
+from sklearn.preprocessing import LabelEncoder
+from src.logger import logger
+from src.exception import MyException
+from src.constants import ONNX_MODEL_PATH, ONNX_OPSET, TORCH_NUM_THREADS
+
+try:
+    import onnxruntime as ort
+    ONNXRUNTIME_AVAILABLE = True
+except ImportError:
+    ONNXRUNTIME_AVAILABLE = False
+
+
+# key of the ONNX metadata entry holding the label encoder classes
+CLASSES_METADATA_KEY = 'classes'
+
+# graph output holding the penultimate activation , missing in graphs exported before it was added
+EMBEDDING_OUTPUT = 'embedding'
+
+
+
+class OnnxModel:
+
+    """
+    Runs the exported graph through ONNX Runtime behind the same call interface as the torch model ,
+    so predict_image / predict_batch work unchanged (tensor in , logits tensor out).
+    """
+
+    def __init__(self, onnx_path, num_threads=TORCH_NUM_THREADS):
+
+        if not ONNXRUNTIME_AVAILABLE:
+            raise MyException("INFERENCE_BACKEND is 'onnx' but onnxruntime is not installed", sys)
+
+        options = ort.SessionOptions()
+        options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        if num_threads > 0:
+            options.intra_op_num_threads = num_threads
+
+        self.session = ort.InferenceSession(onnx_path, options, providers=['CPUExecutionProvider'])
+        self.input_name = self.session.get_inputs()[0].name
+
+        outputs = [output.name for output in self.session.get_outputs()]
+        self.logits_output = outputs[0]
+        self.has_embedding = EMBEDDING_OUTPUT in outputs
+
+        metadata = self.session.get_modelmeta().custom_metadata_map
+        if CLASSES_METADATA_KEY not in metadata:
+            raise MyException(f"ONNX model at {onnx_path} has no '{CLASSES_METADATA_KEY}' metadata , re-export it", sys)
+        self.classes = json.loads(metadata[CLASSES_METADATA_KEY])
+
+
+    def _inputs(self, image_tensor):
+        return {self.input_name: image_tensor.detach().cpu().numpy().astype(np.float32, copy=False)}
+
+
+    def __call__(self, image_tensor):
+        return torch.from_numpy(self.session.run([self.logits_output], self._inputs(image_tensor))[0])
+
+
+    def forward_with_embedding(self, image_tensor):
+
+        """ Logits and embedding from one run of the graph , like EmbeddingNet.forward_with_embedding """
+
+        if not self.has_embedding:
+            raise MyException(f"ONNX model has no '{EMBEDDING_OUTPUT}' output , re-export it", sys)
+
+        logits, embedding = self.session.run([self.logits_output, EMBEDDING_OUTPUT], self._inputs(image_tensor))
+        return torch.from_numpy(logits), torch.from_numpy(embedding)
+
+
+    def eval(self):
+        # kept for interface parity with nn.Module , the graph is always in inference mode
+        return self
+
+
+    def label_encoder(self):
+
+        """ Rebuilds the label encoder from the class list stored in the ONNX metadata """
+
+        label_encoder = LabelEncoder()
+        label_encoder.classes_ = np.array(self.classes)
+        return label_encoder
+
+
+
+def export_onnx(model, classes, output_path, opset=ONNX_OPSET):
+
+    """
+    Exports the loaded (eval mode) model to ONNX with dynamic batch and image size axes
+    (the cascade runs the same graph at a lower resolution) and stores the class list in the model metadata.
+    The penultimate activation is exported as a second output , so /similar works on the ONNX backend too.
+    """
+
+    import onnx
+    from .embedding import EmbeddingOutputs
+
+    logger.info(f'Exporting model to ONNX at {output_path} (opset {opset})')
+
+    model = EmbeddingOutputs(model.eval().cpu()).eval()
+    dummy_input = torch.randn(1, 3, 224, 224)
+
+    with torch.no_grad():
+        torch.onnx.export(
+            model,
+            dummy_input,
+            output_path,
+            input_names=['image'],
+            output_names=['logits', EMBEDDING_OUTPUT],
+            dynamic_axes={'image': {0: 'batch', 2: 'height', 3: 'width'}, 'logits': {0: 'batch'}, EMBEDDING_OUTPUT: {0: 'batch'}},
+            opset_version=opset,
+            do_constant_folding=True,
+        )
+
+    onnx_model = onnx.load(output_path)
+    entry = onnx_model.metadata_props.add()
+    entry.key = CLASSES_METADATA_KEY
+    entry.value = json.dumps([str(name) for name in classes])
+    onnx.checker.check_model(onnx_model)
+    onnx.save(onnx_model, output_path)
+
+    logger.info(f'ONNX export finished : {output_path}')
+    return output_path
+
+
+
+def main():
+
+    parser = argparse.ArgumentParser(description='Export the trained checkpoint to an ONNX model')
+    parser.add_argument('--output', default=ONNX_MODEL_PATH)
+    parser.add_argument('--opset', type=int, default=ONNX_OPSET)
+    args = parser.parse_args()
+
+    from . import model_loader
+
+    # exporting always starts from the eager torch checkpoint
+    model_loader.load_model_safe(backend='torch', precision='fp32', optimize=False, registry_dir='')
+    export_onnx(model_loader.model, model_loader.label_encoder.classes_, args.output, args.opset)
+
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,113 @@
+import copy
+import torch
+import torch.nn as nn
+from torch.nn.utils.fusion import fuse_conv_bn_eval, fuse_linear_bn_eval
+from src.logger import logger
+from src.constants import OPTIMIZE_ATOL
+from .embedding import EmbeddingNet
+
+
+def fold_head(classifier: nn.Sequential) -> nn.Sequential:
+
+    """
+    Folds every Linear -> BatchNorm1d pair of the custom head into a single Linear
+    and drops the Dropout layers , which are no-ops in eval mode
+    """
+
+    layers = list(classifier)
+    folded = []
+    i = 0
+
+    while i < len(layers):
+        layer = layers[i]
+
+        if isinstance(layer, nn.Linear) and i + 1 < len(layers) and isinstance(layers[i + 1], nn.BatchNorm1d):
+            folded.append(fuse_linear_bn_eval(layer, layers[i + 1]))
+            i += 2
+            continue
+
+        if not isinstance(layer, nn.Dropout):
+            folded.append(layer)
+        i += 1
+
+    return nn.Sequential(*folded)
+
+
+
+def fold_backbone(features: nn.Module) -> int:
+
+    """
+    Folds every Conv2d -> BatchNorm2d pair of the backbone in place
+    (the BatchNorm gets replaced by Identity) , returns how many pairs were folded
+    """
+
+    count = 0
+
+    for module in features.modules():
+        if not isinstance(module, nn.Sequential):
+            continue
+
+        for i in range(len(module) - 1):
+            if isinstance(module[i], nn.Conv2d) and isinstance(module[i + 1], nn.BatchNorm2d):
+                module[i] = fuse_conv_bn_eval(module[i], module[i + 1])
+                module[i + 1] = nn.Identity()
+                count += 1
+
+    return count
+
+
+
+def check_equivalence(reference, candidate, device, atol=OPTIMIZE_ATOL):
+
+    """ Compares logits and softmax of two models on a fixed random batch , returns (ok , max logit diff) """
+
+    generator = torch.Generator().manual_seed(0)
+    inputs = torch.randn(4, 3, 224, 224, generator=generator).to(device)
+
+    with torch.no_grad():
+        expected = reference(inputs)
+        actual = candidate(inputs)
+
+    max_diff = float((expected - actual).abs().max())
+    same_top1 = bool((expected.argmax(1) == actual.argmax(1)).all())
+
+    return max_diff <= atol and same_top1, max_diff
+
+
+
+def optimize_for_inference(model, device, verify=True):
+
+    """
+    Returns an inference only version of the eval mode model : BatchNorm folded into the preceding
+    Linear / Conv weights , Dropout removed , scripted and frozen with TorchScript.
+    The frozen module keeps forward_with_embedding , so /similar gets the embedding from the same pass.
+    When verify is set the result is checked against the original model and the original
+    is returned if they disagree.
+    """
+
+    logger.info('Optimizing model for inference.....')
+
+    model.eval()
+
+    # materializing the LazyLinear of the head , so it is a plain Linear before folding
+    with torch.no_grad():
+        model(torch.zeros(1, 3, 224, 224, device=device))
+
+    optimized = copy.deepcopy(model)
+    optimized.classifier = fold_head(optimized.classifier)
+    folded = fold_backbone(optimized.features)
+    optimized.eval()
+
+    # a freshly built wrapper starts in training mode , freezing needs eval mode
+    frozen = torch.jit.freeze(torch.jit.script(EmbeddingNet(optimized).eval()), preserved_attrs=['forward_with_embedding'])
+
+    logger.info(f'Folded {folded} Conv+BN pairs in the backbone , head reduced to {len(optimized.classifier)} layers')
+
+    if verify:
+        ok, max_diff = check_equivalence(model, frozen, device)
+        if not ok:
+            logger.error(f'Optimized model is not equivalent to the original (max logit diff : {max_diff:.2e}) , keeping the original')
+            return model
+        logger.info(f'Optimized model verified against the original , max logit diff : {max_diff:.2e}')
+
+    return frozen
@@ -0,0 +1,150 @@
+import torch
+import torch.nn.functional as F
+from collections import OrderedDict
+from src.logger import logger
+from src.constants import PHASH_MAX_DISTANCE, PHASH_MAX_ENTRIES
+from .preprocess_image import NORMALIZE_MEAN, NORMALIZE_STD
+
+
+HASH_BITS = 64
+
+
+
+def perceptual_hash(image_tensor):
+
+    """
+    64 bit difference hash (dHash) of a preprocessed (1,3,224,224) image tensor.
+    Works on the already downscaled model input , so it costs a pooling op and nothing else.
+    Survives re-encoding , recompression and EXIF stripping of the same photo.
+    """
+
+    image = image_tensor[:1].to(torch.float32)
+
+    if image_tensor.dtype == torch.uint8:
+        image = image / 255.0
+    else:
+        # undoing Normalize so the hash does not depend on the preprocessing backend
+        image = image * NORMALIZE_STD + NORMALIZE_MEAN
+
+    gray = image.mean(dim=1, keepdim=True)
+    small = F.adaptive_avg_pool2d(gray, (8, 9))[0, 0]
+
+    # one bit per horizontal neighbour pair : is the left pixel brighter than the right one
+    bits = (small[:, :-1] > small[:, 1:]).flatten().tolist()
+
+    value = 0
+    for bit in bits:
+        value = (value << 1) | int(bit)
+    return value
+
+
+
+def hamming_distance(a, b):
+    return bin(a ^ b).count('1')
+
+
+
+class NearDuplicateIndex:
+
+    """
+    Finds earlier predictions whose perceptual hash is within max_distance bits of a new image.
+    Uses multi-index hashing : the 64 bits are split into max_distance + 1 bands , and two hashes
+    within max_distance bits must agree exactly on at least one band , so a lookup only compares
+    against entries sharing a band instead of scanning everything.
+    Bounded LRU , and cleared whenever the model version changes.
+    """
+
+    def __init__(self, max_distance=PHASH_MAX_DISTANCE, max_entries=PHASH_MAX_ENTRIES):
+
+        self.max_distance = max(0, int(max_distance))
+        self.max_entries = max(1, int(max_entries))
+
+        num_bands = self.max_distance + 1
+        width = HASH_BITS // num_bands
+        # (shift , mask) per band , the last band takes the remaining bits
+        self._bands = []
+        for band in range(num_bands):
+            bits = width if band < num_bands - 1 else HASH_BITS - width * (num_bands - 1)
+            self._bands.append((band * width, (1 << bits) - 1))
+
+        self._entries = OrderedDict()      # hash -> result
+        self._tables = [dict() for _ in self._bands]   # band value -> set of hashes
+        self._version = None
+
+        self.hits = 0
+        self.misses = 0
+
+
+    def _keys(self, value):
+        return [(value >> shift) & mask for shift, mask in self._bands]
+
+
+    def _sync_version(self, model_version):
+        if model_version != self._version:
+            if self._version is not None:
+                logger.info('Model version changed , clearing near-duplicate index')
+            self._entries.clear()
+            self._tables = [dict() for _ in self._bands]
+            self._version = model_version
+
+
+    def _remove(self, value):
+        del self._entries[value]
+        for table, key in zip(self._tables, self._keys(value)):
+            bucket = table.get(key)
+            if bucket is not None:
+                bucket.discard(value)
+                if not bucket:
+                    del table[key]
+
+
+    def lookup(self, value, model_version):
+
+        """ Returns (result , hamming distance) of the closest earlier image , or (None , None) """
+
+        self._sync_version(model_version)
+
+        best, best_distance = None, None
+
+        for table, key in zip(self._tables, self._keys(value)):
+            for candidate in table.get(key, ()):
+                distance = hamming_distance(value, candidate)
+                if distance <= self.max_distance and (best_distance is None or distance < best_distance):
+                    best, best_distance = candidate, distance
+
+        if best is None:
+            self.misses += 1
+            return None, None
+
+        self.hits += 1
+        self._entries.move_to_end(best)
+        return self._entries[best], best_distance
+
+
+    def add(self, value, result, model_version):
+
+        if model_version != self._version:
+            return
+
+        if value in self._entries:
+            self._entries[value] = result
+            self._entries.move_to_end(value)
+            return
+
+        self._entries[value] = result
+        for table, key in zip(self._tables, self._keys(value)):
+            table.setdefault(key, set()).add(value)
+
+        while len(self._entries) > self.max_entries:
+            self._remove(next(iter(self._entries)))
+
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            'entries': len(self._entries),
+            'max_distance': self.max_distance,
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': (self.hits / lookups) if lookups else 0.0,
+        }
@@ -1,7 +1,92 @@
+import sys
 import torch
+import logging
+import itertools
 import numpy as np
 from src.logger import logger
 from src.exception import MyException
+from .metrics import stage_timer
+from .embedding import supports_embedding, forward_with_embedding
+
+
+def format_prediction(probs, classes):
+
+        """
+        Converts the softmax probabilities of one image into the structured prediction result.
+        """
+
+        predicted_idx_value = int(np.argmax(probs))
+        predicted_class = classes[predicted_idx_value]
+        confidence_value = float(probs[predicted_idx_value])
+
+        # creating dictionary mapping class names to probabilities
+        class_probabilities = {}
+
+        for i, class_name in enumerate(classes):
+            class_probabilities[class_name] = float(probs[i])
+
+
+        # Sort classes by probability (highest first)
+        sorted_predictions = dict(
+            sorted(class_probabilities.items(),
+                    key=lambda x: x[1],
+                    reverse=True)
+        )
+
+        return {
+            "predicted_class": predicted_class,
+            "confidence": confidence_value,
+            "all_predictions": sorted_predictions
+        }
+
+
+
+def format_top_k(values, indices, classes):
+
+        """
+        Builds the prediction result from one row of torch.topk output (already sorted , highest first).
+        Same schema as format_prediction , all_predictions only holds the top k classes.
+        """
+
+        return {
+            "predicted_class": classes[indices[0]],
+            "confidence": values[0],
+            "all_predictions": {classes[i]: p for i, p in zip(indices, values)}
+        }
+
+
+
+def trim_prediction(result, top_k=None):
+
+        """ Keeps only the top_k highest classes of a prediction result (None keeps all) """
+
+        if top_k is None or len(result["all_predictions"]) <= top_k:
+            return result
+
+        return {
+            **result,
+            "all_predictions": dict(itertools.islice(result["all_predictions"].items(), top_k))
+        }
+
+
+
+def covers_top_k(result, top_k, num_classes):
+
+        """ True when a (possibly trimmed) result holds enough classes to answer a top_k request """
+
+        return len(result["all_predictions"]) >= (num_classes if top_k is None else min(top_k, num_classes))
+
+
+
+def compact_prediction(result):
+
+        """ Array based form of a prediction result : class names and probabilities , highest first """
+
+        return {
+            "classes": list(result["all_predictions"]),
+            "scores": list(result["all_predictions"].values())
+        }
+
 
 
 def predict_image(model , label_encoder , image_tensor , device):
@@ -12,73 +97,114 @@ def predict_image(model , label_encoder , image_tensor , device):
         """
 
         try:
-            logger.info('Starting image prediction...')
+            logger.debug('Starting image prediction...')
 
             model.eval()
 
             with torch.no_grad():
-                  
+
                   # forward pass
                 outputs = model(image_tensor)
-                logger.info(f'Model outputs shape : {outputs.shape}')
+                logger.debug('Model outputs shape : %s', outputs.shape)
 
                 # Applying softmax to convert logits into probabilities
                 prob = torch.softmax(outputs , dim = 1)
 
 
+                # Getting probabilities for all classes
+                all_probs = prob.cpu().numpy()[0] # remves batch dimension
 
-                # Finding the class with the highest probability 
-                confidence , predicted_idx = torch.max(prob , dim =1)
 
+                result = format_prediction(all_probs, label_encoder.classes_)
 
-                # converting tensor indices to actual values
-                predicted_idx_value = predicted_idx.cpu().item()
-                confidence_value = confidence.cpu().item()
+                # Log prediction and top 3 for debugging , as one record and only when DEBUG is on
+                if logger.isEnabledFor(logging.DEBUG):
+                    top_3 = list(result["all_predictions"].items())[:3]
+                    logger.debug('Predicted class : %s , confidence : %.4f , top 3 : %s',
+                                 result["predicted_class"], result["confidence"],
+                                 ', '.join(f'{class_name}={prob:.4f}' for class_name, prob in top_3))
 
+                # Return structured results
+                return result
 
-                # Getting the class name using the label encoder
-                predicted_class = label_encoder.classes_[predicted_idx_value]
+        except Exception as e:
+            error_msg = f"Prediction error: {str(e)}"
+            logger.error(error_msg)
+            raise Exception(error_msg)
 
-                logger.info(f'Predicted class  : {predicted_class}')
-                logger.info(f'Confidence score :{confidence_value}')
 
 
-                # Getting probabilities for all classes
-                all_probs = prob.cpu().numpy()[0] # remves batch dimension
+def predict_batch(model , label_encoder , batch_tensor , device , top_k = None , cascade = None , record_cascade = True):
+
+        """
+        Runs one forward pass over a stacked batch of preprocessed images (N,3,224,224)
+        and returns a list with one predict_image style result per image , in input order.
+        With top_k , all_predictions only holds the top_k classes of every image.
+        With a cascade , confident images are answered by its reduced resolution stage
+        and every result records the cascade_stage that produced it.
+        record_cascade=False keeps the batch out of the cascade routing stats (warm-up).
+        """
 
+        try:
+            stages = None
 
-                # creating dictionary mapping class names to probabilities 
-                class_probabilities = {}
+            if cascade is not None and cascade.enabled:
+                with torch.no_grad():
+                    prob, stages = cascade.run(model, batch_tensor.to(device), record_cascade)
 
-                for i, class_name in enumerate(label_encoder.classes_):
-                   class_probabilities[class_name] = float(all_probs[i])
+            else:
+                with torch.no_grad(), stage_timer('forward'):
 
+                    # single forward pass for the whole batch
+                    outputs = model(batch_tensor.to(device))
+
+                    prob = torch.softmax(outputs , dim = 1)
+
+            logger.debug('Batch prediction done for %d image(s)', len(prob))
+
+            with stage_timer('postprocess'):
+
+                # one vectorized (sorted) top-k over the whole batch instead of a dict + sort per image
+                k = prob.shape[1] if top_k is None else max(1, min(top_k, prob.shape[1]))
+                values, indices = torch.topk(prob, k, dim = 1)
+
+                classes = label_encoder.classes_
+                results = [format_top_k(row_values, row_indices, classes)
+                           for row_values, row_indices in zip(values.cpu().tolist(), indices.cpu().tolist())]
+
+                if stages is not None:
+                    for result, stage in zip(results, stages):
+                        result["cascade_stage"] = stage
+
+                return results
 
-                            # Sort classes by probability (highest first)
-                sorted_predictions = dict(
-                    sorted(class_probabilities.items(), 
-                            key=lambda x: x[1], 
-                            reverse=True)
-                )
-                
-                              
-                    # Log top 3 predictions for debugging
-                top_3 = list(sorted_predictions.items())[:3]
-                logger.info("Top 3 predictions:")
-                for class_name, prob in top_3:
-                    logger.info(f"  {class_name}: {prob:.4f}")
-                
-                # Return structured results
-                return {
-                    "predicted_class": predicted_class,
-                    "confidence": confidence_value,
-                    "all_predictions": sorted_predictions
-                }
-                    
         except Exception as e:
-            error_msg = f"Prediction error: {str(e)}"
+            error_msg = f"Batch prediction error: {str(e)}"
             logger.error(error_msg)
             raise Exception(error_msg)
 
 
 
+def predict_with_embedding(model , label_encoder , batch_tensor , device , top_k = None):
+
+        """
+        Same results as predict_batch (without the cascade , the embedding comes from the full resolution pass) ,
+        plus the (N,512) float32 numpy embeddings taken from the same forward pass.
+        """
+
+        if not supports_embedding(model):
+            raise MyException('The loaded model does not expose its embedding (INT8 artifact or an ONNX graph exported without it)' , sys)
+
+        with torch.no_grad(), stage_timer('forward'):
+            logits, embeddings = forward_with_embedding(model, batch_tensor.to(device))
+            prob = torch.softmax(logits , dim = 1)
+
+        with stage_timer('postprocess'):
+            k = prob.shape[1] if top_k is None else max(1, min(top_k, prob.shape[1]))
+            values, indices = torch.topk(prob, k, dim = 1)
+
+            classes = label_encoder.classes_
+            results = [format_top_k(row_values, row_indices, classes)
+                       for row_values, row_indices in zip(values.cpu().tolist(), indices.cpu().tolist())]
+
+        return results, embeddings.float().cpu().numpy()
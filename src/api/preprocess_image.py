@@ -1,14 +1,28 @@
 from PIL import Image
 import torch
 from torchvision import transforms
+from torchvision.io import decode_image as decode_image_tensor, ImageReadMode
+import torchvision.transforms.v2.functional as F
+import numpy as np
+import warnings
 from src.logger import logger
 from src.exception import MyException
 import sys
+import io
+from src.constants import DECODE_DRAFT, PREPROCESS_BACKEND, MAX_IMAGE_PIXELS
+from .metrics import stage_timer
+
+# PIL's own decompression bomb guard , uploads are checked against the same limit in upload.check_image_header
+Image.MAX_IMAGE_PIXELS = MAX_IMAGE_PIXELS
+
+# short side the image is resized to , and the final square crop fed to the model
+RESIZE_SIZE = 256
+CROP_SIZE = 224
 
 # This is the transformation which is required for efficientNet-B3
 transformation = transforms.Compose([
-    transforms.Resize(256),
-    transforms.CenterCrop(224),
+    transforms.Resize(RESIZE_SIZE),
+    transforms.CenterCrop(CROP_SIZE),
     transforms.ToTensor(),
     transforms.Normalize(
         mean=[0.485, 0.456, 0.406],  # efficientNet-B3 mean for RGB
@@ -17,6 +31,14 @@ transformation = transforms.Compose([
 ])
 
 
+# ToTensor + Normalize folded into one multiply-add on uint8 pixels :
+# (x / 255 - mean) / std  ==  x * (1 / (255 * std)) + (-mean / std)
+NORMALIZE_MEAN = torch.tensor([0.485, 0.456, 0.406]).view(1, 3, 1, 1)
+NORMALIZE_STD = torch.tensor([0.229, 0.224, 0.225]).view(1, 3, 1, 1)
+NORMALIZE_SCALE = 1.0 / (255.0 * NORMALIZE_STD)
+NORMALIZE_BIAS = -NORMALIZE_MEAN / NORMALIZE_STD
+
+
 def apply_transformation(image : Image.Image , device):
 
     """
@@ -25,17 +47,17 @@ def apply_transformation(image : Image.Image , device):
     """
 
     try:
-        logger.info('Image preprocessing started.....')
+        logger.debug('Image preprocessing started.....')
 
         
         # checking if image is in a RGB mode or not
         if image.mode != 'RGB':
-            logger.info(f'converting image from {image.mode} to RGB')
+            logger.debug('converting image from %s to RGB', image.mode)
             image = image.convert('RGB')
 
 
         # storing image size just for logging
-        logger.info(f'The size of image is {image.size}')
+        logger.debug('The size of image is %s', image.size)
 
 
         # Apply the actual transforamtion on the image
@@ -50,7 +72,7 @@ def apply_transformation(image : Image.Image , device):
         # moving tensor to specified device
         image_tensor.to(device)
 
-        logger.info(f'Image preprocessing completed , Final tensor shape : {image_tensor.shape}')
+        logger.debug('Image preprocessing completed , Final tensor shape : %s', image_tensor.shape)
 
 
         return image_tensor
@@ -61,3 +83,134 @@ def apply_transformation(image : Image.Image , device):
         raise MyException(error_msg,sys)
 
 
+
+def decode_image(content: bytes, draft: bool = DECODE_DRAFT) -> Image.Image:
+
+    """
+    This function decodes raw uploaded bytes into an RGB PIL image.
+    With draft enabled , JPEGs are decoded by libjpeg at 1/2 , 1/4 or 1/8 scale
+    while keeping the short side at or above RESIZE_SIZE , so the full resolution
+    image is never materialized just to be thrown away by transforms.Resize
+
+    """
+
+    image = Image.open(io.BytesIO(content))
+
+    if draft and image.format == 'JPEG':
+        # draft only picks a scale that keeps both sides >= the requested size
+        image.draft('RGB', (RESIZE_SIZE, RESIZE_SIZE))
+
+    if image.mode != 'RGB':
+        image = image.convert('RGB')
+
+    return image
+
+
+
+def decode_to_uint8_tensor(content: bytes) -> torch.Tensor:
+
+    """
+    This function decodes raw uploaded bytes straight into a (3,H,W) uint8 RGB tensor
+    with torchvision.io , falling back to PIL only for formats torchvision cannot decode
+
+    """
+
+    try:
+        with warnings.catch_warnings():
+            # the upload bytes are read only , decode_image never writes to them
+            warnings.simplefilter('ignore', UserWarning)
+            data = torch.frombuffer(content, dtype=torch.uint8)
+
+        return decode_image_tensor(data, mode=ImageReadMode.RGB)
+
+    except RuntimeError:
+        image = decode_image(content)
+        return torch.from_numpy(np.asarray(image)).permute(2, 0, 1)
+
+
+
+def resize_crop_uint8(image_tensor: torch.Tensor) -> torch.Tensor:
+
+    """
+    Same geometry as transformation (Resize 256 on the short side , CenterCrop 224)
+    but done on the uint8 tensor , returns (1,3,224,224) uint8
+
+    """
+
+    image_tensor = F.resize(image_tensor, [RESIZE_SIZE], antialias=True)
+    image_tensor = F.center_crop(image_tensor, [CROP_SIZE, CROP_SIZE])
+
+    return image_tensor.unsqueeze(0)
+
+
+
+def normalize_batch(batch: torch.Tensor) -> torch.Tensor:
+
+    """
+    Converts a whole (N,3,224,224) uint8 batch into the normalized float32 model input
+    with one fused multiply-add , instead of a ToTensor pass and a Normalize pass per image
+
+    """
+
+    return torch.addcmul(NORMALIZE_BIAS, batch.to(torch.float32), NORMALIZE_SCALE)
+
+
+
+def raw_rgb_to_tensor(content: bytes, height: int, width: int) -> torch.Tensor:
+
+    """
+    Wraps a packed (H,W,3) uint8 RGB buffer as a (3,H,W) uint8 tensor view , nothing gets decoded or copied
+
+    """
+
+    with warnings.catch_warnings():
+        # the body bytes are read only , nothing below writes to them
+        warnings.simplefilter('ignore', UserWarning)
+        data = torch.frombuffer(content, dtype=torch.uint8)
+
+    return data.view(height, width, 3).permute(2, 0, 1)
+
+
+
+def preprocess_array(content: bytes, height: int, width: int, backend: str = PREPROCESS_BACKEND) -> torch.Tensor:
+
+    """
+    Preprocesses an already decoded (H,W,3) uint8 RGB array , skipping the decode stage.
+    Returns the same dtype as preprocess_bytes with the same backend , so both can share a batch
+
+    """
+
+    with stage_timer('preprocess'):
+        image_tensor = resize_crop_uint8(raw_rgb_to_tensor(content, height, width))
+
+        if backend == 'tensor':
+            return image_tensor
+
+        return normalize_batch(image_tensor)
+
+
+
+def preprocess_bytes(content: bytes, device, backend: str = PREPROCESS_BACKEND) -> torch.Tensor:
+
+    """
+    Decodes and preprocesses uploaded bytes with the configured backend.
+    The 'pil' backend returns the normalized float tensor , the 'tensor' backend returns
+    a uint8 tensor that gets normalized later together with the rest of its batch
+
+    """
+
+    if backend == 'tensor':
+        with stage_timer('decode'):
+            image_tensor = decode_to_uint8_tensor(content)
+
+        with stage_timer('preprocess'):
+            return resize_crop_uint8(image_tensor)
+
+    if backend == 'pil':
+        with stage_timer('decode'):
+            image = decode_image(content)
+
+        with stage_timer('preprocess'):
+            return apply_transformation(image, device)
+
+    raise MyException(f"Unknown preprocessing backend '{backend}' , expected 'pil' or 'tensor'", sys)
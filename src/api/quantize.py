@@ -0,0 +1,164 @@
+import argparse
+import copy
+import json
+import sys
+import numpy as np
+import torch
+import torch.nn as nn
+from sklearn.preprocessing import LabelEncoder
+from torch.ao.quantization import get_default_qconfig_mapping, quantize_dynamic
+from torch.ao.quantization.quantize_fx import prepare_fx, convert_fx
+from src.logger import logger
+from src.exception import MyException
+from src.constants import QUANTIZED_MODEL_PATH, QUANTIZATION_ENGINE
+from .image_folder import list_images, list_labeled_images, load_image_batches
+
+
+# name of the file embedded in the TorchScript archive holding the label encoder classes
+CLASSES_FILE = 'classes.json'
+
+
+
+def quantize_model(model, calibration_dir, max_images=256, batch_size=16, engine=QUANTIZATION_ENGINE):
+
+    """
+    Builds the INT8 model :
+    backbone (model.features) gets static post training quantization , calibrated on the images in calibration_dir ,
+    classifier head gets dynamic quantization of its nn.Linear layers.
+    """
+
+    torch.backends.quantized.engine = engine
+
+    paths = list_images(calibration_dir)[:max_images]
+    if not paths:
+        raise MyException(f"No calibration images found in {calibration_dir}", sys)
+
+    logger.info(f'Quantizing model with {len(paths)} calibration image(s) , engine : {engine}')
+
+    quantized = copy.deepcopy(model).cpu().eval()
+
+    # a .pth checkpoint still has the LazyLinear head layer , one pass turns it into the nn.Linear
+    # quantize_dynamic matches (and keeps the traced graph identical between the trace and its check)
+    with torch.no_grad():
+        quantized(torch.zeros(1, 3, 224, 224))
+
+    # static PTQ of the convolutional backbone : observers record activation ranges during calibration
+    example_inputs = (torch.zeros(1, 3, 224, 224),)
+    prepared = prepare_fx(quantized.features, get_default_qconfig_mapping(engine), example_inputs)
+
+    with torch.no_grad():
+        for batch in load_image_batches(paths, batch_size):
+            prepared(batch)
+
+    quantized.features = convert_fx(prepared)
+
+    # dynamic quantization of the 2000 -> 1024 -> 512 head , weights int8 and activations quantized on the fly
+    quantized.classifier = quantize_dynamic(quantized.classifier, {nn.Linear}, dtype=torch.qint8)
+
+    return quantized
+
+
+
+def save_quantized_model(quantized, classes, output_path):
+
+    """ Saves the quantized model as a TorchScript archive with the class list embedded """
+
+    with torch.no_grad():
+        scripted = torch.jit.trace(quantized, torch.zeros(1, 3, 224, 224))
+
+    extra_files = {CLASSES_FILE: json.dumps([str(name) for name in classes])}
+    torch.jit.save(scripted, output_path, _extra_files=extra_files)
+
+    logger.info(f'Quantized model saved at {output_path}')
+    return output_path
+
+
+
+def load_quantized_model(path, engine=QUANTIZATION_ENGINE):
+
+    """ Loads the INT8 TorchScript artifact , returns (model , label encoder) """
+
+    torch.backends.quantized.engine = engine
+
+    extra_files = {CLASSES_FILE: ''}
+    model = torch.jit.load(path, map_location='cpu', _extra_files=extra_files)
+    model.eval()
+
+    label_encoder = LabelEncoder()
+    label_encoder.classes_ = np.array(json.loads(extra_files[CLASSES_FILE]))
+
+    return model, label_encoder
+
+
+
+def accuracy_drift(float_model, quantized_model, classes, eval_dir, batch_size=16):
+
+    """
+    Compares the float and INT8 models on a labeled folder (eval_dir/<class name>/<image>) ,
+    returns accuracy of both , top-1 agreement and probability drift
+    """
+
+    samples = [(path, label) for path, label in list_labeled_images(eval_dir) if label in set(classes)]
+    if not samples:
+        raise MyException(f"No labeled images matching the model classes found in {eval_dir}", sys)
+
+    class_index = {name: i for i, name in enumerate(classes)}
+    targets = torch.tensor([class_index[label] for _, label in samples])
+
+    float_probs, quantized_probs = [], []
+    with torch.no_grad():
+        for batch in load_image_batches([path for path, _ in samples], batch_size):
+            float_probs.append(torch.softmax(float_model(batch), dim=1))
+            quantized_probs.append(torch.softmax(quantized_model(batch), dim=1))
+
+    float_probs = torch.cat(float_probs)
+    quantized_probs = torch.cat(quantized_probs)
+
+    float_pred = float_probs.argmax(1)
+    quantized_pred = quantized_probs.argmax(1)
+
+    return {
+        'images': len(samples),
+        'float_accuracy': float((float_pred == targets).float().mean()),
+        'int8_accuracy': float((quantized_pred == targets).float().mean()),
+        'top1_agreement': float((float_pred == quantized_pred).float().mean()),
+        'mean_abs_prob_drift': float((float_probs - quantized_probs).abs().mean()),
+        'max_abs_prob_drift': float((float_probs - quantized_probs).abs().max()),
+    }
+
+
+
+def main():
+
+    parser = argparse.ArgumentParser(description='Create the INT8 quantized model artifact')
+    parser.add_argument('--calibration-dir', required=True, help='folder of sample images used for calibration')
+    parser.add_argument('--eval-dir', default=None, help='labeled folder (<class>/<image>) for the accuracy drift report')
+    parser.add_argument('--output', default=QUANTIZED_MODEL_PATH)
+    parser.add_argument('--max-images', type=int, default=256)
+    parser.add_argument('--report', default=None, help='optional path to write the drift report as JSON')
+    args = parser.parse_args()
+
+    from . import model_loader
+
+    # quantization always starts from the float checkpoint
+    model_loader.load_model_safe(backend='torch', precision='fp32', optimize=False, registry_dir='')
+    float_model = model_loader.model.cpu().eval()
+    classes = model_loader.label_encoder.classes_
+
+    quantized = quantize_model(float_model, args.calibration_dir, args.max_images)
+    save_quantized_model(quantized, classes, args.output)
+
+    if args.eval_dir:
+        scripted, _ = load_quantized_model(args.output)
+        report = accuracy_drift(float_model, scripted, list(classes), args.eval_dir)
+        logger.info(f'Accuracy drift report : {report}')
+        print(json.dumps(report, indent=2))
+
+        if args.report:
+            with open(args.report, 'w') as f:
+                json.dump(report, f, indent=2)
+
+
+
+if __name__ == '__main__':
+    main()
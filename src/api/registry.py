@@ -0,0 +1,357 @@
+import argparse
+import asyncio
+import gc
+import json
+import os
+import shutil
+import sys
+import time
+from datetime import datetime, timezone
+import torch
+from src.logger import logger
+from src.exception import MyException
+from src.constants import MODEL_REGISTRY_DIR, MODEL_WATCH_INTERVAL, INFERENCE_EXECUTOR
+from . import model_loader
+
+
+# Local model registry , a directory of versioned artifacts and a manifest naming the active one :
+#
+#   <registry>/manifest.json
+#   <registry>/<version>/<artifact files>
+#
+#   {
+#     "active": "v2",
+#     "versions": {
+#       "v1": {"format": "pth", "path": "v1/best_skin_disease_model_enhanced.pth", "registered_at": "..."},
+#       "v2": {"format": "safetensors", "path": "v2/model.safetensors", "config": "v2/model.json", "registered_at": "..."}
+#     }
+#   }
+
+
+MANIFEST_NAME = 'manifest.json'
+
+# artifact formats , the ones model_loader.build_model knows how to load
+ARTIFACT_FORMATS = ('pth', 'safetensors', 'onnx', 'int8')
+
+# file extension -> artifact format , for register
+EXTENSION_FORMATS = {'.pth': 'pth', '.safetensors': 'safetensors', '.onnx': 'onnx', '.pt': 'int8'}
+
+
+
+def manifest_path(registry_dir=MODEL_REGISTRY_DIR):
+    return os.path.join(registry_dir, MANIFEST_NAME)
+
+
+
+def read_manifest(registry_dir=MODEL_REGISTRY_DIR):
+
+    """ Returns the manifest , an empty one when the registry has none yet """
+
+    path = manifest_path(registry_dir)
+    if not os.path.exists(path):
+        return {'active': None, 'versions': {}}
+
+    with open(path) as f:
+        return json.load(f)
+
+
+
+def write_manifest(manifest, registry_dir=MODEL_REGISTRY_DIR):
+
+    """ Writes the manifest atomically , watchers never see a half written file """
+
+    os.makedirs(registry_dir, exist_ok=True)
+    tmp_path = manifest_path(registry_dir) + '.tmp'
+
+    with open(tmp_path, 'w') as f:
+        json.dump(manifest, f, indent=2)
+
+    os.replace(tmp_path, manifest_path(registry_dir))
+
+
+
+def resolve_artifact(version=None, registry_dir=MODEL_REGISTRY_DIR):
+
+    """
+    Returns the registry entry of version (the active one by default) with absolute paths ,
+    or None when the registry has no active version (the configured artifact gets loaded then).
+    """
+
+    manifest = read_manifest(registry_dir)
+    version = version or manifest.get('active')
+
+    if version is None:
+        if manifest['versions']:
+            logger.warning(f'Model registry {registry_dir} has no active version , loading the configured model')
+        return None
+
+    if version not in manifest['versions']:
+        raise MyException(f"Model version '{version}' is not in the registry {registry_dir}", sys)
+
+    entry = dict(manifest['versions'][version])
+    entry['version'] = version
+    entry['path'] = os.path.join(registry_dir, entry['path'])
+    if entry.get('config'):
+        entry['config'] = os.path.join(registry_dir, entry['config'])
+
+    return entry
+
+
+
+def register_artifact(version, path, config_path=None, artifact_format=None, activate=False, registry_dir=MODEL_REGISTRY_DIR):
+
+    """ Copies an artifact (and its JSON sidecar for safetensors) into the registry as a new version """
+
+    artifact_format = artifact_format or EXTENSION_FORMATS.get(os.path.splitext(path)[1].lower())
+    if artifact_format not in ARTIFACT_FORMATS:
+        raise MyException(f"Cannot tell the artifact format of {path} , pass one of {ARTIFACT_FORMATS}", sys)
+
+    if artifact_format == 'safetensors' and not config_path:
+        raise MyException('safetensors artifacts need their JSON sidecar (--config)', sys)
+
+    manifest = read_manifest(registry_dir)
+    if version in manifest['versions']:
+        raise MyException(f"Model version '{version}' already exists , versions are immutable", sys)
+
+    version_dir = os.path.join(registry_dir, version)
+    os.makedirs(version_dir, exist_ok=True)
+
+    entry = {
+        'format': artifact_format,
+        'path': os.path.join(version, os.path.basename(path)),
+        'registered_at': datetime.now(timezone.utc).isoformat(timespec='seconds'),
+    }
+    shutil.copy2(path, os.path.join(registry_dir, entry['path']))
+
+    if config_path:
+        entry['config'] = os.path.join(version, os.path.basename(config_path))
+        shutil.copy2(config_path, os.path.join(registry_dir, entry['config']))
+
+    manifest['versions'][version] = entry
+    if activate or manifest.get('active') is None:
+        manifest['active'] = version
+
+    write_manifest(manifest, registry_dir)
+    logger.info(f"Registered model version {version} ({artifact_format}) , active version : {manifest['active']}")
+
+    return entry
+
+
+
+def set_active(version, registry_dir=MODEL_REGISTRY_DIR):
+
+    manifest = read_manifest(registry_dir)
+    if version not in manifest['versions']:
+        raise MyException(f"Model version '{version}' is not in the registry {registry_dir}", sys)
+
+    manifest['active'] = version
+    write_manifest(manifest, registry_dir)
+
+
+
+class ModelReloader:
+
+    """
+    Hot reload of registry versions. The new version is loaded and warmed up in a background thread
+    while the current one keeps serving , then swapped in with a single reference assignment
+    (every batch holds the handle it started with , so no batch mixes versions).
+    The replaced version is released once its in-flight forward passes drained.
+    """
+
+    def __init__(self, registry_dir=MODEL_REGISTRY_DIR, watch_interval=MODEL_WATCH_INTERVAL):
+
+        self.registry_dir = registry_dir
+        self.watch_interval = watch_interval
+
+        # one reload at a time
+        self._lock = asyncio.Lock()
+        self._watcher = None
+
+        self.reloads = 0
+        self.last_reload = None
+        self.last_error = None
+
+
+    async def reload(self, version=None):
+
+        """ Loads , warms and swaps in version (the manifest's active version by default) """
+
+        async with self._lock:
+
+            artifact = resolve_artifact(version, self.registry_dir)
+            if artifact is None:
+                raise MyException(f'Model registry {self.registry_dir} has no active version', sys)
+
+            if artifact['version'] == model_loader.model_version:
+                return {'status': 'unchanged', 'model_version': artifact['version']}
+
+            start = time.perf_counter()
+            logger.info(f"Loading model version {artifact['version']} in the background")
+
+            try:
+                handle = await asyncio.to_thread(model_loader.build_model, artifact=artifact)
+
+                from .warmup import warm_handle
+                await asyncio.to_thread(warm_handle, handle)
+
+                # process workers hold their own copy , a fresh pool loads and warms the new version
+                # before it takes traffic , so the first requests after the swap do not pay the cold start
+                new_executor = None
+                if INFERENCE_EXECUTOR == 'process':
+                    from .executor import prepare_process_executor
+                    new_executor = await asyncio.to_thread(prepare_process_executor, handle.version)
+
+            except Exception as e:
+                self.last_error = f"{artifact['version']} : {str(e)}"
+                logger.error(f"Loading model version {artifact['version']} failed , keeping {model_loader.model_version} : {str(e)}")
+                raise
+
+            previous = model_loader.install(handle)
+
+            if new_executor is not None:
+                from .executor import replace_executor
+                replace_executor(new_executor)
+
+            self.reloads += 1
+            self.last_error = None
+            self.last_reload = {
+                'from': previous.version if previous is not None else None,
+                'to': handle.version,
+                'seconds': round(time.perf_counter() - start, 3),
+            }
+            logger.info(f"Model version {handle.version} is serving , replaced {self.last_reload['from']} after {self.last_reload['seconds']:.2f} s")
+
+            if previous is not None:
+                asyncio.create_task(self._drain(previous))
+
+            return {'status': 'reloaded', 'model_version': handle.version, **self.last_reload}
+
+
+    async def activate(self, version):
+
+        """
+        Reloads version here and , once it loaded and warmed up fine , makes it the active one
+        in the manifest. The manifest is what the other uvicorn workers follow : their watchers
+        pick the new active version up within watch_interval seconds.
+        """
+
+        result = await self.reload(version)
+        await asyncio.to_thread(set_active, version, self.registry_dir)
+
+        if self.watch_interval > 0:
+            result['propagation'] = f'other workers follow the manifest within {self.watch_interval:g} s'
+        else:
+            logger.warning(f'Model watcher disabled (MODEL_WATCH_INTERVAL=0) , only this worker serves {version}')
+            result['propagation'] = 'watcher disabled , only this worker reloaded'
+
+        return result
+
+
+    async def _drain(self, handle, poll_interval=0.05):
+
+        """ Waits for the forward passes still running on a replaced version , then lets it go """
+
+        while handle.in_flight > 0:
+            await asyncio.sleep(poll_interval)
+
+        handle.model = None
+        handle.label_encoder = None
+        gc.collect()
+        if torch.cuda.is_available():
+            torch.cuda.empty_cache()
+
+        logger.info(f'Model version {handle.version} drained and released')
+
+
+    def start_watching(self):
+
+        if self.watch_interval > 0 and self._watcher is None:
+            self._watcher = asyncio.create_task(self._watch())
+            logger.info(f'Watching {manifest_path(self.registry_dir)} every {self.watch_interval:.1f} s for a new active model version')
+
+
+    async def stop_watching(self):
+
+        if self._watcher is None:
+            return
+
+        self._watcher.cancel()
+        try:
+            await self._watcher
+        except asyncio.CancelledError:
+            pass
+        self._watcher = None
+
+
+    async def _watch(self):
+
+        """ Polls the manifest and reloads when its active version changed """
+
+        path = manifest_path(self.registry_dir)
+        last_mtime = None
+
+        while True:
+            await asyncio.sleep(self.watch_interval)
+
+            try:
+                mtime = os.stat(path).st_mtime_ns
+                if mtime == last_mtime:
+                    continue
+                last_mtime = mtime
+
+                active = (await asyncio.to_thread(read_manifest, self.registry_dir)).get('active')
+                if active is not None and active != model_loader.model_version:
+                    await self.reload(active)
+
+            except FileNotFoundError:
+                continue
+            except Exception as e:
+                # a broken version keeps the current one serving , the watcher tries again on the next change
+                logger.error(f'Model watcher reload failed : {str(e)}')
+
+
+    def stats(self):
+        return {
+            'registry_dir': self.registry_dir,
+            'watching': self._watcher is not None,
+            'reloads': self.reloads,
+            'last_reload': self.last_reload,
+            'last_error': self.last_error,
+        }
+
+
+
+def main():
+
+    parser = argparse.ArgumentParser(description='Manage the local model registry')
+    parser.add_argument('--registry', default=MODEL_REGISTRY_DIR or 'model_registry')
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    register = commands.add_parser('register', help='copy an artifact into the registry as a new version')
+    register.add_argument('version')
+    register.add_argument('path', help='.pth checkpoint , .safetensors weights , .onnx graph or .pt INT8 TorchScript')
+    register.add_argument('--config', default=None, help='JSON sidecar of safetensors weights')
+    register.add_argument('--format', choices=ARTIFACT_FORMATS, default=None, help='inferred from the file extension by default')
+    register.add_argument('--activate', action='store_true')
+
+    activate = commands.add_parser('activate', help='make a version the active one')
+    activate.add_argument('version')
+
+    commands.add_parser('list', help='show every version and the active one')
+
+    args = parser.parse_args()
+
+    if args.command == 'register':
+        register_artifact(args.version, args.path, args.config, args.format, args.activate, args.registry)
+    elif args.command == 'activate':
+        set_active(args.version, args.registry)
+
+    manifest = read_manifest(args.registry)
+    for version, entry in manifest['versions'].items():
+        marker = '*' if version == manifest.get('active') else ' '
+        print(f"{marker} {version:<16} {entry['format']:<12} {entry['path']:<48} {entry.get('registered_at', '')}")
+
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,437 @@
+import argparse
+import json
+import os
+import sys
+import threading
+import time
+from datetime import datetime, timezone
+import numpy as np
+import torch
+from src.logger import logger
+from src.exception import MyException
+from src.constants import SIMILARITY_INDEX_DIR, SIMILARITY_NPROBE
+from .embedding import supports_embedding, forward_with_embedding
+from .image_folder import list_labeled_images, load_image_batches
+
+
+# Similar case index , built offline from a labeled reference folder and memory mapped at serving time :
+#
+#   <index>/meta.json       count , dim , dtype , nlist , model version and the label names
+#   <index>/vectors.npy     (count , dim) L2 normalized embeddings , grouped by inverted list on an IVF index
+#   <index>/labels.npy      (count ,) int16 position of each row's label in meta.json labels
+#   <index>/paths.txt       reference image of each row , relative to the reference folder
+#   <index>/centroids.npy   (nlist , dim) float32 list centroids , IVF only
+#   <index>/offsets.npy     (nlist + 1 ,) int64 first row of every list , IVF only
+
+
+META_FILE = 'meta.json'
+VECTORS_FILE = 'vectors.npy'
+LABELS_FILE = 'labels.npy'
+PATHS_FILE = 'paths.txt'
+CENTROIDS_FILE = 'centroids.npy'
+OFFSETS_FILE = 'offsets.npy'
+
+FORMAT_VERSION = 1
+
+# storage types of the vectors , float16 and int8 halve / quarter the memory and disk read by a scan
+VECTOR_DTYPES = ('float32', 'float16', 'int8')
+# int8 rows store round(127 * value) , unit vectors have every component in [-1 , 1]
+INT8_SCALE = 127.0
+
+# rows scored per matrix product , bounds the float32 copy made when scanning float16 / int8 rows
+SCAN_CHUNK = 262144
+
+# below this many vectors the automatic nlist builds a flat (exact) index
+IVF_MIN_VECTORS = 10000
+# k-means trains on at most this many vectors per list
+KMEANS_SAMPLES_PER_LIST = 256
+
+
+
+def normalize_rows(vectors):
+
+    """ L2 normalizes every row , so a dot product is the cosine similarity """
+
+    vectors = np.asarray(vectors, dtype=np.float32)
+    norms = np.linalg.norm(vectors, axis=-1, keepdims=True)
+    return vectors / np.maximum(norms, 1e-12)
+
+
+
+def top_k_indices(scores, k):
+
+    """ Indices of the k highest scores , highest first , with a partial sort instead of a full one """
+
+    if len(scores) <= k:
+        return np.argsort(-scores, kind='stable')
+
+    candidates = np.argpartition(-scores, k - 1)[:k]
+    return candidates[np.argsort(-scores[candidates], kind='stable')]
+
+
+
+def auto_nlist(count):
+
+    """ Number of inverted lists for count vectors , about 4 * sqrt(count) , 0 (flat index) for small indexes """
+
+    if count < IVF_MIN_VECTORS:
+        return 0
+    return int(4 * np.sqrt(count))
+
+
+
+def assign_lists(vectors, centroids, chunk=65536):
+
+    """ Nearest centroid (highest cosine) of every row , computed in chunks """
+
+    assignment = np.empty(len(vectors), dtype=np.int32)
+
+    for start in range(0, len(vectors), chunk):
+        block = np.asarray(vectors[start:start + chunk], dtype=np.float32)
+        assignment[start:start + len(block)] = np.argmax(block @ centroids.T, axis=1)
+
+    return assignment
+
+
+
+def train_ivf(vectors, nlist, iterations=10, seed=0):
+
+    """
+    Spherical k-means on a sample of the normalized vectors , returns (nlist , dim) unit centroids.
+    Empty lists get reseeded with random sample vectors.
+    """
+
+    rng = np.random.default_rng(seed)
+
+    count = len(vectors)
+    sample_size = min(count, nlist * KMEANS_SAMPLES_PER_LIST)
+    sample = np.asarray(vectors[np.sort(rng.choice(count, sample_size, replace=False))], dtype=np.float32)
+
+    centroids = sample[rng.choice(sample_size, nlist, replace=False)].copy()
+
+    for _ in range(iterations):
+        assignment = assign_lists(sample, centroids)
+
+        # per list sums with one sort and a segmented reduction instead of a loop over the lists
+        counts = np.bincount(assignment, minlength=nlist)
+        order = np.argsort(assignment, kind='stable')
+        filled = np.flatnonzero(counts)
+        starts = (np.cumsum(counts) - counts)[filled]
+        centroids[filled] = np.add.reduceat(sample[order], starts, axis=0)
+
+        empty = np.flatnonzero(counts == 0)
+        if len(empty):
+            centroids[empty] = sample[rng.choice(sample_size, len(empty), replace=False)]
+
+        centroids = normalize_rows(centroids)
+
+    return centroids
+
+
+
+def encode_vectors(block, dtype):
+
+    """ Converts normalized float32 rows to the index storage type """
+
+    if dtype == 'int8':
+        return np.clip(np.rint(block * INT8_SCALE), -INT8_SCALE, INT8_SCALE).astype(np.int8)
+    return block.astype(dtype)
+
+
+
+def write_index(embeddings, labels, paths, label_names, output_dir, model_version, nlist=None, dtype='float32', iterations=10):
+
+    """
+    Writes the index files from normalized float32 embeddings (an array or a memmap) with their labels
+    (positions in label_names) and paths. With nlist the rows are grouped by inverted list , so every list
+    is one contiguous slice of vectors.npy.
+    """
+
+    if dtype not in VECTOR_DTYPES:
+        raise MyException(f"Unknown vector dtype '{dtype}' , expected one of {VECTOR_DTYPES}", sys)
+
+    count, dim = embeddings.shape
+    nlist = auto_nlist(count) if nlist is None else min(int(nlist), count)
+
+    os.makedirs(output_dir, exist_ok=True)
+
+    if nlist > 0:
+        logger.info(f'Training {nlist} inverted lists on {count} vectors')
+        centroids = train_ivf(embeddings, nlist, iterations)
+        assignment = assign_lists(embeddings, centroids)
+        order = np.argsort(assignment, kind='stable')
+        offsets = np.concatenate(([0], np.cumsum(np.bincount(assignment, minlength=nlist)))).astype(np.int64)
+
+        np.save(os.path.join(output_dir, CENTROIDS_FILE), centroids)
+        np.save(os.path.join(output_dir, OFFSETS_FILE), offsets)
+    else:
+        order = np.arange(count)
+
+    # written chunk by chunk in list order , the embeddings never have to fit in memory twice
+    vectors = np.lib.format.open_memmap(os.path.join(output_dir, VECTORS_FILE), mode='w+', dtype=dtype, shape=(count, dim))
+    for start in range(0, count, SCAN_CHUNK):
+        rows = order[start:start + SCAN_CHUNK]
+        vectors[start:start + len(rows)] = encode_vectors(np.asarray(embeddings[rows], dtype=np.float32), dtype)
+    vectors.flush()
+    del vectors
+
+    np.save(os.path.join(output_dir, LABELS_FILE), np.asarray(labels, dtype=np.int16)[order])
+
+    with open(os.path.join(output_dir, PATHS_FILE), 'w') as f:
+        f.writelines(f'{paths[i]}\n' for i in order)
+
+    meta = {
+        'format_version': FORMAT_VERSION,
+        'count': int(count),
+        'dim': int(dim),
+        'dtype': dtype,
+        'nlist': int(nlist),
+        'model_version': model_version,
+        'labels': [str(name) for name in label_names],
+        'built_at': datetime.now(timezone.utc).isoformat(),
+    }
+    with open(os.path.join(output_dir, META_FILE), 'w') as f:
+        json.dump(meta, f, indent=2)
+
+    logger.info(f'Similar case index written to {output_dir} : {count} vectors , {dtype} , nlist {nlist}')
+    return meta
+
+
+
+def embed_reference(model, samples, raw_path, device, batch_size=32):
+
+    """
+    Embeds every (path , label) sample with the model into a float32 memmap at raw_path ,
+    returns it L2 normalized , one row per sample in input order
+    """
+
+    embeddings = None
+    start = 0
+
+    with torch.no_grad():
+        for batch in load_image_batches([path for path, _ in samples], batch_size, device):
+            _, embedding = forward_with_embedding(model, batch.to(device))
+            embedding = normalize_rows(embedding.float().cpu().numpy())
+
+            if embeddings is None:
+                embeddings = np.lib.format.open_memmap(raw_path, mode='w+', dtype=np.float32, shape=(len(samples), embedding.shape[1]))
+            embeddings[start:start + len(embedding)] = embedding
+            start += len(embedding)
+
+            logger.info(f'Embedded {start} / {len(samples)} reference images')
+
+    embeddings.flush()
+    return embeddings
+
+
+
+def build_index(model, reference_dir, output_dir, model_version, device, nlist=None, dtype='float32', batch_size=32, iterations=10):
+
+    """ Embeds the labeled reference folder (reference_dir/<class name>/<image>) and writes the index to output_dir """
+
+    if not supports_embedding(model):
+        raise MyException('The loaded model does not expose its embedding (INT8 artifact or an ONNX graph exported without it)', sys)
+
+    samples = list_labeled_images(reference_dir)
+    if not samples:
+        raise MyException(f"No labeled images found in {reference_dir}", sys)
+
+    label_names = sorted({label for _, label in samples})
+    label_index = {name: i for i, name in enumerate(label_names)}
+
+    os.makedirs(output_dir, exist_ok=True)
+    raw_path = os.path.join(output_dir, 'embeddings.tmp.npy')
+
+    try:
+        embeddings = embed_reference(model, samples, raw_path, device, batch_size)
+
+        return write_index(
+            embeddings,
+            [label_index[label] for _, label in samples],
+            [os.path.relpath(path, reference_dir) for path, _ in samples],
+            label_names, output_dir, model_version, nlist, dtype, iterations,
+        )
+
+    finally:
+        if os.path.exists(raw_path):
+            os.remove(raw_path)
+
+
+
+class SimilarityIndex:
+
+    """
+    Memory mapped similar case index. Flat indexes score every row (exact) , IVF indexes only score the
+    nprobe lists whose centroids are closest to the query , each a contiguous slice of the mapped vectors ,
+    so a query reads a few thousand rows instead of the whole file.
+    """
+
+    def __init__(self, index_dir, nprobe=SIMILARITY_NPROBE):
+
+        meta_path = os.path.join(index_dir, META_FILE)
+        if not os.path.exists(meta_path):
+            raise MyException(f"Similar case index not found at {index_dir} , build it with python -m src.api.similarity", sys)
+
+        with open(meta_path) as f:
+            self.meta = json.load(f)
+
+        self.vectors = np.load(os.path.join(index_dir, VECTORS_FILE), mmap_mode='r')
+        self.labels = np.load(os.path.join(index_dir, LABELS_FILE), mmap_mode='r')
+
+        with open(os.path.join(index_dir, PATHS_FILE)) as f:
+            self.paths = f.read().splitlines()
+
+        count = self.meta['count']
+        if self.vectors.shape != (count, self.meta['dim']) or len(self.labels) != count or len(self.paths) != count:
+            raise MyException(f"Similar case index at {index_dir} is inconsistent with its {META_FILE} , rebuild it", sys)
+
+        self.label_names = self.meta['labels']
+        self.model_version = self.meta['model_version']
+        self.nlist = self.meta['nlist']
+        self.nprobe = max(1, int(nprobe))
+
+        self.centroids = self.offsets = None
+        if self.nlist:
+            self.centroids = np.load(os.path.join(index_dir, CENTROIDS_FILE))
+            self.offsets = np.load(os.path.join(index_dir, OFFSETS_FILE))
+
+        # int8 scores are 127 times the cosine
+        self._scale = 1.0 / INT8_SCALE if self.vectors.dtype == np.int8 else 1.0
+
+        self._lock = threading.Lock()
+        self.queries = 0
+        self.search_seconds = 0.0
+
+        logger.info(f"Similar case index loaded from {index_dir} : {self.meta['count']} vectors , "
+                    f"{self.meta['dtype']} , {'IVF ' + str(self.nlist) + ' lists' if self.nlist else 'flat'} , model version {self.model_version}")
+
+
+    def _scores(self, start, stop, query):
+        block = self.vectors[start:stop]
+        if block.dtype != np.float32:
+            block = block.astype(np.float32)
+        return block @ query
+
+
+    def _flat(self, query, k):
+
+        """ Exact search , chunked so float16 / int8 rows are converted a slice at a time """
+
+        scores, ids = [], []
+        for start in range(0, len(self.vectors), SCAN_CHUNK):
+            chunk_scores = self._scores(start, start + SCAN_CHUNK, query)
+            top = top_k_indices(chunk_scores, k)
+            scores.append(chunk_scores[top])
+            ids.append(top + start)
+
+        return np.concatenate(scores), np.concatenate(ids)
+
+
+    def _ivf(self, query, k, nprobe):
+
+        """ Scores only the rows of the nprobe lists closest to the query """
+
+        lists = top_k_indices(self.centroids @ query, min(nprobe, self.nlist))
+
+        scores, ids = [], []
+        for index in lists:
+            start, stop = int(self.offsets[index]), int(self.offsets[index + 1])
+            if stop > start:
+                scores.append(self._scores(start, stop, query))
+                ids.append(np.arange(start, stop))
+
+        if not scores:
+            return np.empty(0, dtype=np.float32), np.empty(0, dtype=np.int64)
+
+        return np.concatenate(scores), np.concatenate(ids)
+
+
+    def search(self, embedding, k=5, nprobe=None):
+
+        """ The k reference cases most similar to one embedding , highest cosine similarity first """
+
+        start = time.perf_counter()
+
+        query = normalize_rows(np.asarray(embedding, dtype=np.float32).reshape(-1))
+        if query.shape[0] != self.meta['dim']:
+            raise MyException(f"Embedding has {query.shape[0]} dimensions , the index holds {self.meta['dim']}", sys)
+
+        if self.nlist:
+            scores, ids = self._ivf(query, k, nprobe or self.nprobe)
+        else:
+            scores, ids = self._flat(query, k)
+
+        top = top_k_indices(scores, k)
+
+        results = [
+            {
+                'score': float(scores[i]) * self._scale,
+                'label': self.label_names[self.labels[ids[i]]],
+                'path': self.paths[ids[i]],
+            }
+            for i in top
+        ]
+
+        with self._lock:
+            self.queries += 1
+            self.search_seconds += time.perf_counter() - start
+
+        return results
+
+
+    def stats(self):
+
+        """ Index shape and search latency for the health endpoint """
+
+        return {
+            'count': self.meta['count'],
+            'dim': self.meta['dim'],
+            'dtype': self.meta['dtype'],
+            'mode': 'ivf' if self.nlist else 'flat',
+            'nlist': self.nlist,
+            'nprobe': self.nprobe if self.nlist else None,
+            'model_version': self.model_version,
+            'queries': self.queries,
+            'mean_search_ms': (self.search_seconds * 1000 / self.queries) if self.queries else 0.0,
+        }
+
+
+
+def open_index(index_dir=SIMILARITY_INDEX_DIR):
+
+    """ Loads the index for serving , None (and /similar disabled) when it is missing or broken """
+
+    try:
+        return SimilarityIndex(index_dir)
+    except Exception as e:
+        logger.error(f'Similar case index could not be loaded , /similar is disabled : {str(e)}')
+        return None
+
+
+
+def main():
+
+    parser = argparse.ArgumentParser(description='Build the similar case index from a labeled reference folder')
+    parser.add_argument('reference_dir', help='folder of confirmed cases laid out as <class name>/<image>')
+    parser.add_argument('--output', default=SIMILARITY_INDEX_DIR or None, required=not SIMILARITY_INDEX_DIR)
+    parser.add_argument('--nlist', type=int, default=None, help='inverted lists , 0 for a flat (exact) index , default about 4 * sqrt(count)')
+    parser.add_argument('--dtype', default='float32', choices=VECTOR_DTYPES, help='storage type of the vectors')
+    parser.add_argument('--batch-size', type=int, default=32)
+    parser.add_argument('--kmeans-iterations', type=int, default=10)
+    args = parser.parse_args()
+
+    from . import model_loader
+
+    # the same model configuration as the server , so the recorded version matches the serving model
+    handle = model_loader.load_model_safe()
+
+    meta = build_index(
+        handle.model, args.reference_dir, args.output, handle.version, handle.device,
+        args.nlist, args.dtype, args.batch_size, args.kmeans_iterations,
+    )
+    print(json.dumps({key: value for key, value in meta.items() if key != 'labels'}, indent=2))
+
+
+
+if __name__ == '__main__':
+    main()
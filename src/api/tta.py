@@ -0,0 +1,89 @@
+import sys
+import torch
+import torch.nn.functional as F
+from src.exception import MyException
+from .metrics import stage_timer
+from .predictor import format_top_k
+
+
+# crop size of the five_crop views , cut from the preprocessed 224px image and resized back
+FIVE_CROP_SIZE = 192
+
+# TTA view sets , number of images in the batched forward pass
+TTA_VIEWS = {
+    'flip': 2,       # identity , horizontal flip
+    'flips': 4,      # + vertical flip , both flips
+    'dihedral': 8,   # the 4 rotations by 90 degrees , each with and without a horizontal flip
+    'five_crop': 6,  # identity + 4 corner crops + center crop
+}
+
+TTA_AGGREGATES = ('mean', 'geometric')
+
+
+
+def augment(image, views):
+
+    """
+    Builds every augmented view of one preprocessed image (1,3,H,W) , returns (V,3,H,W).
+    Flips and rotations are index permutations of the same tensor , five_crop resizes all crops in one interpolate.
+    """
+
+    if views == 'flip':
+        return torch.cat([image, image.flip(-1)])
+
+    if views == 'flips':
+        return torch.cat([image, image.flip(-1), image.flip(-2), image.flip(-1, -2)])
+
+    if views == 'dihedral':
+        rotations = torch.cat([image.rot90(k, dims=(-2, -1)) for k in range(4)])
+        return torch.cat([rotations, rotations.flip(-1)])
+
+    if views == 'five_crop':
+        size = image.shape[-1]
+        crop = FIVE_CROP_SIZE
+        offsets = [(0, 0), (0, size - crop), (size - crop, 0), (size - crop, size - crop), ((size - crop) // 2, (size - crop) // 2)]
+        crops = torch.cat([image[..., top:top + crop, left:left + crop] for top, left in offsets])
+        resized = F.interpolate(crops, size=(size, size), mode='bilinear', antialias=False, align_corners=False)
+        return torch.cat([image, resized])
+
+    raise MyException(f"Unknown TTA views '{views}' , expected one of {list(TTA_VIEWS)}", sys)
+
+
+
+def aggregate(probs, method='mean'):
+
+    """ Combines the (V,C) softmax outputs of every view into one (C,) distribution """
+
+    if method == 'mean':
+        return probs.mean(dim=0)
+
+    if method == 'geometric':
+        # mean of the log probabilities , renormalized , confident disagreements weigh more than with the mean
+        return torch.softmax(probs.clamp_min(1e-12).log().mean(dim=0), dim=0)
+
+    raise MyException(f"Unknown TTA aggregate '{method}' , expected one of {TTA_AGGREGATES}", sys)
+
+
+
+def predict_tta(model, label_encoder, image_tensor, device, views='flips', method='mean', top_k=None):
+
+    """
+    Test time augmentation for one preprocessed image : all views in one batched forward pass ,
+    softmax outputs aggregated into a single predict_batch style result.
+    """
+
+    with torch.no_grad():
+        batch = augment(image_tensor.to(device), views)
+
+        with stage_timer('forward'):
+            probs = torch.softmax(model(batch), dim=1)
+
+    with stage_timer('postprocess'):
+        prob = aggregate(probs, method)
+
+        k = prob.shape[0] if top_k is None else max(1, min(top_k, prob.shape[0]))
+        values, indices = torch.topk(prob, k)
+
+        result = format_top_k(values.cpu().tolist(), indices.cpu().tolist(), label_encoder.classes_)
+        result["tta"] = {"views": len(batch), "view_set": views, "aggregate": method}
+        return result
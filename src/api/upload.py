@@ -0,0 +1,160 @@
+import io
+from PIL import Image, UnidentifiedImageError
+from fastapi import HTTPException, UploadFile
+from fastapi.responses import JSONResponse
+from starlette.datastructures import Headers
+from src.constants import MAX_UPLOAD_BYTES, MAX_IMAGE_PIXELS
+from .metrics import IMAGE_PIXELS, endpoint_label, record_error
+
+
+# bytes pulled from the spooled upload per read
+UPLOAD_CHUNK_SIZE = 1024 * 1024
+
+# room for the multipart boundaries and part headers on top of the file bytes
+MULTIPART_OVERHEAD = 64 * 1024
+
+
+
+async def read_upload(file: UploadFile, max_bytes: int = MAX_UPLOAD_BYTES) -> bytes:
+
+    """
+    Reads an uploaded file in chunks and stops as soon as it goes over max_bytes.
+    By the time this runs Starlette has already spooled the whole multipart part (to disk past 1 MB) ,
+    so this only bounds the bytes pulled into memory : the early rejection of oversized bodies ,
+    chunked ones included , happens on the raw stream in RequestSizeLimit.
+    The chunks are joined once at the end (a single chunk is returned as is).
+    """
+
+    # the multipart parser already knows the size of a spooled part , no need to read it
+    if file.size is not None and file.size > max_bytes:
+        raise HTTPException(status_code=413, detail=f"File too large , at most {max_bytes} bytes allowed")
+
+    chunks = []
+    total = 0
+
+    while True:
+        chunk = await file.read(UPLOAD_CHUNK_SIZE)
+        if not chunk:
+            break
+
+        total += len(chunk)
+        if total > max_bytes:
+            raise HTTPException(status_code=413, detail=f"File too large , at most {max_bytes} bytes allowed")
+
+        chunks.append(chunk)
+
+    if len(chunks) == 1:
+        return chunks[0]
+
+    return b''.join(chunks)
+
+
+
+def check_image_header(content: bytes, max_pixels: int = MAX_IMAGE_PIXELS):
+
+    """
+    Reads only the image header (Image.open is lazy , no pixel data gets decoded) and rejects
+    unreadable images and images above max_pixels before they reach the decoder.
+    Returns (width , height).
+    """
+
+    try:
+        # BytesIO over bytes shares the buffer , nothing gets copied
+        with Image.open(io.BytesIO(content)) as image:
+            width, height = image.size
+
+    except Image.DecompressionBombError:
+        raise HTTPException(status_code=413, detail=f"Image too large , at most {max_pixels} pixels allowed")
+    except (UnidentifiedImageError, OSError, SyntaxError):
+        raise HTTPException(status_code=400, detail="Unsupported or corrupt image file")
+
+    IMAGE_PIXELS.observe(width * height)
+
+    if width * height > max_pixels:
+        raise HTTPException(
+            status_code=413,
+            detail=f"Image too large ({width}x{height}) , at most {max_pixels} pixels allowed",
+        )
+
+    return width, height
+
+
+
+def max_request_bytes(files: int = 1, max_bytes: int = MAX_UPLOAD_BYTES) -> int:
+
+    """ Largest request body accepted for an upload of the given number of files """
+
+    return files * (max_bytes + MULTIPART_OVERHEAD)
+
+
+
+class RequestSizeLimit:
+
+    """
+    ASGI middleware capping the request body of the upload endpoints on the raw stream.
+    A declared Content-Length over the limit gets a 413 before anything is read , and bodies without one
+    (chunked transfer) are counted while they arrive and cut off with a 413 as soon as they go over ,
+    before the multipart parser has spooled the rest of them.
+    """
+
+    def __init__(self, app, limits):
+        self.app = app
+        # path -> largest body accepted in bytes
+        self.limits = limits
+
+
+    async def __call__(self, scope, receive, send):
+
+        if scope['type'] != 'http' or scope['method'] != 'POST' or scope['path'] not in self.limits:
+            return await self.app(scope, receive, send)
+
+        limit = self.limits[scope['path']]
+        endpoint = endpoint_label(scope['path'])
+
+        content_length = Headers(scope=scope).get('content-length')
+        if content_length is not None and content_length.isdigit() and int(content_length) > limit:
+            record_error(endpoint, HTTPException(status_code=413))
+            response = JSONResponse(status_code=413, content={"detail": "Request body too large"})
+            return await response(scope, receive, send)
+
+        received = 0
+        exceeded = False
+        response_started = False
+
+        async def limited_receive():
+            nonlocal received, exceeded
+
+            if exceeded:
+                return {'type': 'http.disconnect'}
+
+            message = await receive()
+            if message['type'] == 'http.request':
+                received += len(message.get('body', b''))
+                if received > limit:
+                    # the app sees a disconnected client and stops reading , the 413 is sent once it returns
+                    exceeded = True
+                    return {'type': 'http.disconnect'}
+
+            return message
+
+        async def guarded_send(message):
+            nonlocal response_started
+
+            # whatever the app answers to the cut off body is replaced by the 413
+            if exceeded:
+                return
+
+            if message['type'] == 'http.response.start':
+                response_started = True
+            await send(message)
+
+        try:
+            await self.app(scope, limited_receive, guarded_send)
+        except Exception:
+            if not exceeded:
+                raise
+
+        if exceeded and not response_started:
+            record_error(endpoint, HTTPException(status_code=413))
+            response = JSONResponse(status_code=413, content={"detail": "Request body too large"})
+            await response(scope, receive, send)
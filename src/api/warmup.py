@@ -0,0 +1,97 @@
+import io
+import time
+import torch
+from PIL import Image
+from src.logger import logger
+from src.constants import WARMUP_BATCH_SIZES, WARMUP_ITERATIONS, PREPROCESS_BACKEND
+from .executor import run_in_executor, decode_and_preprocess, forward_batch
+from .predictor import predict_batch
+from .preprocess_image import CROP_SIZE, normalize_batch
+
+
+# set once the warm-up finished , /ready fails until then
+ready = False
+
+# what the warm-up did , reported by /ready
+report = {'status': 'pending'}
+
+
+
+def dummy_batch(batch_size, backend=PREPROCESS_BACKEND):
+
+    """ Input batch shaped and typed like the real ones of the configured preprocessing backend """
+
+    if backend == 'tensor':
+        return torch.randint(0, 256, (batch_size, 3, CROP_SIZE, CROP_SIZE), dtype=torch.uint8)
+
+    return torch.randn(batch_size, 3, CROP_SIZE, CROP_SIZE)
+
+
+
+def dummy_upload():
+
+    """ A small JPEG , so the decoder and the preprocessing transforms get initialized too """
+
+    buffer = io.BytesIO()
+    Image.new('RGB', (640, 480), (200, 150, 130)).save(buffer, format='JPEG')
+    return buffer.getvalue()
+
+
+
+async def warm_up(batch_sizes=WARMUP_BATCH_SIZES, iterations=WARMUP_ITERATIONS):
+
+    """
+    Runs one decode and iterations dummy forward passes at every batch size through the inference executor ,
+    so the first real requests do not pay for allocator growth , oneDNN kernel selection and lazy initialization.
+    Marks the service ready when done. A failing dummy forward pass would fail real requests as well ,
+    so a failed warm-up leaves the service not ready.
+    """
+
+    global ready, report
+
+    start = time.perf_counter()
+    timings = {}
+
+    try:
+        await run_in_executor(decode_and_preprocess, dummy_upload())
+
+        for batch_size in batch_sizes:
+            batch = dummy_batch(batch_size)
+
+            for iteration in range(max(1, iterations)):
+                iteration_start = time.perf_counter()
+                await run_in_executor(forward_batch, batch, None, True)
+
+            # the last iteration shows the warm latency
+            timings[str(batch_size)] = round((time.perf_counter() - iteration_start) * 1000, 2)
+
+    except Exception as e:
+        logger.error(f'Warm-up failed : {str(e)}')
+        report = {'status': 'failed', 'error': str(e), 'seconds': round(time.perf_counter() - start, 3)}
+        return
+
+    report = {
+        'status': 'done',
+        'batch_sizes': batch_sizes,
+        'warm_forward_ms': timings,
+        'seconds': round(time.perf_counter() - start, 3),
+    }
+    ready = True
+
+    logger.info(f"Warm-up done in {report['seconds']:.2f} s , warm forward latency (ms) per batch size : {timings}")
+
+
+
+def warm_handle(handle, batch_sizes=WARMUP_BATCH_SIZES, iterations=WARMUP_ITERATIONS):
+
+    """ Same dummy forward passes on a model that is not serving yet (hot reload) , runs in a background thread """
+
+    for batch_size in batch_sizes:
+        batch = dummy_batch(batch_size)
+        if batch.dtype == torch.uint8:
+            batch = normalize_batch(batch)
+
+        for _ in range(max(1, iterations)):
+            predict_batch(handle.model, handle.label_encoder, batch, handle.device)
+
+    logger.info(f'Model version {handle.version} warmed up at batch sizes {batch_sizes}')
@@ -0,0 +1,140 @@
+import argparse
+import json
+import mmap
+import os
+import struct
+import sys
+import torch
+from src.logger import logger
+from src.exception import MyException
+from src.constants import SAFETENSORS_PATH, MODEL_CONFIG_PATH, CHECKPOINT_PATH
+
+try:
+    from safetensors.torch import save_file
+    SAFETENSORS_AVAILABLE = True
+except ImportError:
+    SAFETENSORS_AVAILABLE = False
+
+
+# architecture recorded in the sidecar , the loader refuses anything else
+ARCHITECTURE = 'efficientnet_b3_custom_head'
+
+# pooled feature size of the EfficientNet-B3 backbone , input of the first head Linear
+B3_IN_FEATURES = 1536
+
+# safetensors dtype names -> torch dtypes
+DTYPES = {
+    'F64': torch.float64,
+    'F32': torch.float32,
+    'F16': torch.float16,
+    'BF16': torch.bfloat16,
+    'I64': torch.int64,
+    'I32': torch.int32,
+    'I16': torch.int16,
+    'I8': torch.int8,
+    'U8': torch.uint8,
+    'BOOL': torch.bool,
+}
+
+
+
+def load_safetensors_mmap(path):
+
+    """
+    Maps a .safetensors file into memory and returns its tensors as zero-copy views on the mapping.
+    The mapping is copy-on-write (private) , pages are read lazily from the page cache and shared by
+    every process mapping the same file for as long as nobody writes to them.
+    """
+
+    with open(path, 'rb') as f:
+        header_size = struct.unpack('<Q', f.read(8))[0]
+        header = json.loads(f.read(header_size))
+        buffer = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_COPY)
+
+    data_start = 8 + header_size
+    tensors = {}
+
+    for name, info in header.items():
+        if name == '__metadata__':
+            continue
+
+        dtype = DTYPES[info['dtype']]
+        begin, end = info['data_offsets']
+        count = (end - begin) // dtype.itemsize
+
+        if count == 0:
+            tensors[name] = torch.empty(info['shape'], dtype=dtype)
+            continue
+
+        tensor = torch.frombuffer(buffer, dtype=dtype, count=count, offset=data_start + begin)
+        tensors[name] = tensor.view(info['shape'])
+
+    return tensors
+
+
+
+def read_model_config(config_path):
+
+    with open(config_path) as f:
+        config = json.load(f)
+
+    if config.get('architecture') != ARCHITECTURE:
+        raise MyException(f"Unsupported architecture '{config.get('architecture')}' in {config_path}", sys)
+
+    return config
+
+
+
+def convert_checkpoint(model, classes, weights_path=SAFETENSORS_PATH, config_path=MODEL_CONFIG_PATH, source=None):
+
+    """
+    Writes the loaded model as a safetensors file plus a JSON sidecar with the class list
+    and the architecture config needed to rebuild the model without LazyLinear
+    """
+
+    if not SAFETENSORS_AVAILABLE:
+        raise MyException('safetensors is not installed , pip install safetensors', sys)
+
+    state_dict = {name: tensor.detach().cpu().contiguous() for name, tensor in model.state_dict().items()}
+
+    in_features = state_dict['classifier.0.weight'].shape[1]
+    if in_features != B3_IN_FEATURES:
+        logger.warning(f'Unexpected head input size {in_features} , expected {B3_IN_FEATURES}')
+
+    save_file(state_dict, weights_path)
+
+    config = {
+        'architecture': ARCHITECTURE,
+        'num_classes': len(classes),
+        'in_features': int(in_features),
+        'classes': [str(name) for name in classes],
+        'source_checkpoint': source,
+    }
+    with open(config_path, 'w') as f:
+        json.dump(config, f, indent=2)
+
+    logger.info(f'Weights written to {weights_path} , config written to {config_path}')
+    return weights_path, config_path
+
+
+
+def main():
+
+    parser = argparse.ArgumentParser(description='Convert the .pth checkpoint into memory mappable safetensors weights')
+    parser.add_argument('--weights', default=SAFETENSORS_PATH)
+    parser.add_argument('--config', default=MODEL_CONFIG_PATH)
+    args = parser.parse_args()
+
+    from . import model_loader
+
+    # conversion always starts from the pickled training checkpoint
+    model_loader.load_model_safe(backend='torch', precision='fp32', optimize=False, weights_format='pth', registry_dir='')
+    convert_checkpoint(
+        model_loader.model, model_loader.label_encoder.classes_, args.weights, args.config,
+        source=os.path.basename(CHECKPOINT_PATH),
+    )
+
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,133 @@
+import os
+
+# Constants for the inference service , every value can be overridden with an environment variable
+
+
+# Dynamic micro-batching for POST /predict
+# a batch is flushed when it reaches MAX_BATCH_SIZE images or when the oldest request waited MAX_BATCH_WAIT_MS
+MAX_BATCH_SIZE = int(os.getenv('MAX_BATCH_SIZE', 16))
+MAX_BATCH_WAIT_MS = float(os.getenv('MAX_BATCH_WAIT_MS', 10))
+
+
+# Inference executor , decode / preprocessing / forward pass run here instead of on the event loop
+# INFERENCE_EXECUTOR is either 'thread' or 'process'
+INFERENCE_EXECUTOR = os.getenv('INFERENCE_EXECUTOR', 'thread').lower()
+INFERENCE_WORKERS = int(os.getenv('INFERENCE_WORKERS', 4))
+# intra-op threads torch may use for the forward pass (per process) , 0 means let torch decide
+TORCH_NUM_THREADS = int(os.getenv('TORCH_NUM_THREADS', 0))
+
+
+# POST /predict/batch
+# images per forward pass (keeps peak activation memory bounded) and max files accepted per request
+BATCH_ENDPOINT_CHUNK_SIZE = int(os.getenv('BATCH_ENDPOINT_CHUNK_SIZE', 16))
+MAX_FILES_PER_REQUEST = int(os.getenv('MAX_FILES_PER_REQUEST', 64))
+
+
+# Decode JPEG uploads at reduced resolution (DCT scaling) , close to the size preprocessing resizes to anyway
+DECODE_DRAFT = os.getenv('DECODE_DRAFT', 'true').lower() in ('1', 'true', 'yes')
+
+
+# Preprocessing backend : 'pil' (torchvision Compose on a PIL image) or 'tensor'
+# (torchvision.io decode to uint8 , uint8 resize / crop , fused normalize over the whole batch)
+PREPROCESS_BACKEND = os.getenv('PREPROCESS_BACKEND', 'pil').lower()
+
+
+# Prediction cache keyed by upload bytes + model version
+# CACHE_DIR enables the on-disk tier that survives restarts , leave empty to keep the cache in memory only
+CACHE_ENABLED = os.getenv('CACHE_ENABLED', 'true').lower() in ('1', 'true', 'yes')
+CACHE_MAX_ENTRIES = int(os.getenv('CACHE_MAX_ENTRIES', 10000))
+CACHE_TTL_SECONDS = float(os.getenv('CACHE_TTL_SECONDS', 3600))
+CACHE_DIR = os.getenv('CACHE_DIR', '')
+# disk tier bound : entries kept per model version directory , and how often expired / surplus files are swept
+CACHE_DISK_MAX_ENTRIES = int(os.getenv('CACHE_DISK_MAX_ENTRIES', 100000))
+CACHE_SWEEP_INTERVAL = float(os.getenv('CACHE_SWEEP_INTERVAL', 300))
+
+
+# Near-duplicate reuse through perceptual hashing (re-encoded / recompressed copies of the same photo)
+PHASH_ENABLED = os.getenv('PHASH_ENABLED', 'false').lower() in ('1', 'true', 'yes')
+PHASH_MAX_DISTANCE = int(os.getenv('PHASH_MAX_DISTANCE', 4))
+PHASH_MAX_ENTRIES = int(os.getenv('PHASH_MAX_ENTRIES', 10000))
+
+
+# Inference backend : 'torch' (eager PyTorch checkpoint) or 'onnx' (ONNX Runtime on the exported graph)
+INFERENCE_BACKEND = os.getenv('INFERENCE_BACKEND', 'torch').lower()
+ONNX_MODEL_PATH = os.getenv('ONNX_MODEL_PATH', 'model_path/skin_disease_model.onnx')
+ONNX_OPSET = int(os.getenv('ONNX_OPSET', 17))
+
+
+# Model precision for the torch backend : 'fp32' (checkpoint) or 'int8' (quantized artifact from src.api.quantize)
+MODEL_PRECISION = os.getenv('MODEL_PRECISION', 'fp32').lower()
+QUANTIZED_MODEL_PATH = os.getenv('QUANTIZED_MODEL_PATH', 'model_path/skin_disease_model_int8.pt')
+# quantized kernel backend , 'x86' for server CPUs , 'qnnpack' for ARM
+QUANTIZATION_ENGINE = os.getenv('QUANTIZATION_ENGINE', 'x86')
+
+
+# Fold BatchNorm into Linear / Conv weights , drop Dropout and freeze the graph after loading the checkpoint
+OPTIMIZE_FOR_INFERENCE = os.getenv('OPTIMIZE_FOR_INFERENCE', 'true').lower() in ('1', 'true', 'yes')
+# max abs logit difference tolerated between the optimized and the original model at startup
+OPTIMIZE_ATOL = float(os.getenv('OPTIMIZE_ATOL', 1e-3))
+
+
+# Model weights : the pickled training checkpoint , or the memory mappable safetensors file + JSON sidecar
+# WEIGHTS_FORMAT is 'auto' (safetensors when present) , 'pth' or 'safetensors'
+CHECKPOINT_PATH = os.getenv('CHECKPOINT_PATH', 'model_path/best_skin_disease_model_enhanced.pth')
+WEIGHTS_FORMAT = os.getenv('WEIGHTS_FORMAT', 'auto').lower()
+SAFETENSORS_PATH = os.getenv('SAFETENSORS_PATH', 'model_path/skin_disease_model.safetensors')
+MODEL_CONFIG_PATH = os.getenv('MODEL_CONFIG_PATH', 'model_path/skin_disease_model.json')
+
+
+# Multi-worker serving : every uvicorn worker maps the same safetensors file read-only instead of
+# holding a private copy of the weights (page cache pages are shared between the workers)
+SHARED_WEIGHTS = os.getenv('SHARED_WEIGHTS', 'false').lower() in ('1', 'true', 'yes')
+
+
+# Logging , LOG_LEVEL defaults to INFO when APP_ENV is 'production' and DEBUG everywhere else
+APP_ENV = os.getenv('APP_ENV', 'development').lower()
+LOG_LEVEL = os.getenv('LOG_LEVEL', 'INFO' if APP_ENV == 'production' else 'DEBUG').upper()
+# hand records to a background writer thread instead of writing file / console inline
+LOG_ASYNC = os.getenv('LOG_ASYNC', 'true').lower() in ('1', 'true', 'yes')
+
+
+# Upload limits , checked while streaming the upload and on the image header before anything gets decoded
+# MAX_UPLOAD_BYTES is per file , MAX_IMAGE_PIXELS is width * height (also passed to PIL as its decompression bomb limit)
+MAX_UPLOAD_BYTES = int(os.getenv('MAX_UPLOAD_BYTES', 20 * 1024 * 1024))
+MAX_IMAGE_PIXELS = int(os.getenv('MAX_IMAGE_PIXELS', 50_000_000))
+
+
+# Warm-up after the model is loaded : dummy forward passes at these batch sizes (comma separated , empty disables)
+# so allocator growth and kernel selection happen before /ready lets traffic in
+WARMUP_BATCH_SIZES = [int(size) for size in os.getenv('WARMUP_BATCH_SIZES', f'1,{MAX_BATCH_SIZE}').split(',') if size.strip()]
+WARMUP_ITERATIONS = int(os.getenv('WARMUP_ITERATIONS', 2))
+
+
+# Model registry : a directory of versioned model artifacts with a manifest.json naming the active version
+# leave MODEL_REGISTRY_DIR empty to load the configured artifact paths above instead
+MODEL_REGISTRY_DIR = os.getenv('MODEL_REGISTRY_DIR', '')
+# seconds between manifest checks for a new active version , on by default so every uvicorn worker follows
+# a reload done through the admin endpoint (which only reloads the worker that served it) or the CLI ,
+# 0 disables the watcher (single worker deployments reloading through the admin endpoint only)
+MODEL_WATCH_INTERVAL = float(os.getenv('MODEL_WATCH_INTERVAL', 5))
+# token expected in the X-Admin-Token header of admin endpoints , admin endpoints are disabled while it is empty
+ADMIN_TOKEN = os.getenv('ADMIN_TOKEN', '')
+
+
+# Confidence gated cascade : every image first runs through the model at CASCADE_RESOLUTION ,
+# only images whose top probability is below CASCADE_THRESHOLD get the full 224px pass
+CASCADE_ENABLED = os.getenv('CASCADE_ENABLED', 'false').lower() in ('1', 'true', 'yes')
+CASCADE_RESOLUTION = int(os.getenv('CASCADE_RESOLUTION', 160))
+CASCADE_THRESHOLD = float(os.getenv('CASCADE_THRESHOLD', 0.9))
+
+
+# Admission control for the prediction endpoints : requests beyond MAX_IN_FLIGHT get 429 with Retry-After
+MAX_IN_FLIGHT = int(os.getenv('MAX_IN_FLIGHT', 64))
+RETRY_AFTER_SECONDS = int(os.getenv('RETRY_AFTER_SECONDS', 1))
+# deadline applied when a request brings none (X-Request-Timeout-Ms / X-Request-Deadline) , 0 means no deadline
+DEFAULT_REQUEST_TIMEOUT_MS = float(os.getenv('DEFAULT_REQUEST_TIMEOUT_MS', 0))
+
+
+# Similar case retrieval : directory of the vector index built offline with python -m src.api.similarity ,
+# leave it empty to disable /similar
+SIMILARITY_INDEX_DIR = os.getenv('SIMILARITY_INDEX_DIR', '')
+# inverted lists scanned per query on an IVF index , more lists scanned means higher recall and slower search
+SIMILARITY_NPROBE = int(os.getenv('SIMILARITY_NPROBE', 16))
+SIMILARITY_MAX_K = int(os.getenv('SIMILARITY_MAX_K', 50))
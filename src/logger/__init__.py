@@ -1,9 +1,12 @@
 import logging
-from logging.handlers import RotatingFileHandler
+from logging.handlers import RotatingFileHandler, QueueHandler, QueueListener
 from from_root import from_root
 from datetime import datetime
+import atexit
+import queue
 import time
 import os
+from src.constants import LOG_LEVEL, LOG_ASYNC
 
 # Constants for log configuration
 LOG_DIR = 'logs'
@@ -13,18 +16,45 @@ MAX_LOG_SIZE = 5 * 1024 * 1024  # 5 MB
 BACKUP_COUNT = 3  # Keep last 3 logs
 
 # Construct log file path
-log_dir_path = os.path.join(from_root(), LOG_DIR)
+try:
+    project_root = from_root()
+except FileNotFoundError:
+    # installed console scripts (skin-score , skin-models , skin-index) run outside the repo , logs go to the working directory
+    project_root = os.getcwd()
+
+log_dir_path = os.path.join(project_root, LOG_DIR)
 os.makedirs(log_dir_path, exist_ok=True)
 log_file_path = os.path.join(log_dir_path, LOG_FILE)
 
+# Background writer thread used in async mode
+listener = None
+
+
+
+class DeferredQueueHandler(QueueHandler):
+
+    """
+    Queue handler that leaves formatting to the writer thread.
+    The stock QueueHandler formats every record in the calling thread so it can be pickled ,
+    which is not needed for an in-process queue.
+    """
+
+    def prepare(self, record):
+        return record
+
+
 
-def configure_logger():
+def configure_logger(level=LOG_LEVEL, asynchronous=LOG_ASYNC):
     """
     Configures logging with a rotating file handler and console handler.
+    In async mode the request path only puts records on a queue and a background
+    thread does the formatting and the file / console writes.
     Avoids duplicate handlers if called multiple times.
     """
+    global listener
+
     logger = logging.getLogger()
-    logger.setLevel(logging.DEBUG)
+    logger.setLevel(level)
 
     # Prevent adding handlers multiple times
     if logger.handlers:
@@ -38,12 +68,24 @@ def configure_logger():
         log_file_path, maxBytes=MAX_LOG_SIZE, backupCount=BACKUP_COUNT
     )
     file_handler.setFormatter(formatter)
-    file_handler.setLevel(logging.DEBUG)
+    file_handler.setLevel(level)
 
     # Console handler
     console_handler = logging.StreamHandler()
     console_handler.setFormatter(formatter)
-    console_handler.setLevel(logging.DEBUG)
+    console_handler.setLevel(level)
+
+    if asynchronous:
+        # Unbounded queue , a slow disk never blocks the request path
+        log_queue = queue.SimpleQueue()
+        logger.addHandler(DeferredQueueHandler(log_queue))
+
+        listener = QueueListener(log_queue, file_handler, console_handler, respect_handler_level=True)
+        listener.start()
+
+        # flushing whatever is still queued when the process exits
+        atexit.register(stop_logging)
+        return logger
 
     # Attach handlers
     logger.addHandler(file_handler)
@@ -52,6 +94,15 @@ def configure_logger():
     return logger
 
 
+
+def stop_logging():
+    """Stops the background writer thread after it wrote every queued record."""
+    global listener
+
+    if listener is not None:
+        listener.stop()
+        listener = None
+
+
 # Configuring logger immediately when this module is imported
 logger = configure_logger()
-